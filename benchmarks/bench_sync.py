@@ -0,0 +1,293 @@
+"""
+Benchmark of a full sync loop against synthetic repositories.
+
+Creates N local bare remotes with a clone of each in a project folder, pushes
+commits to random remotes at a fixed rate, and runs the real scheduler against
+them with the stub docker CLI in benchmarks/bin on the PATH and a stub engine
+API on a Unix socket. Reports cycle
+latency, poll throughput, deploy latency after a push and peak RSS.
+
+    python benchmarks/bench_sync.py --repos 10,100,1000 --duration 60 --push-rate 2
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import main as syncatron  # noqa: E402
+from src.docker_engine import close_client  # noqa: E402
+from benchmarks.fake_engine import FakeEngine  # noqa: E402
+from src.get_env import Settings  # noqa: E402
+from src.state_store import StateStore  # noqa: E402
+
+FAKE_DOCKER_DIR = os.path.join(ROOT, "benchmarks", "bin")
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@example.com",
+    "GIT_CONFIG_NOSYSTEM": "1",
+}
+
+COMPOSE_FILE = "services:\n  app:\n    build: .\n"
+
+@dataclass
+class Fixture:
+    """The synthetic remotes, the clones Syncatron syncs, and the clones commits are pushed from."""
+    root: str
+    project_folder: str
+    repos: List[str] = field(default_factory=list)
+    authors: Dict[str, str] = field(default_factory=dict)
+
+@dataclass
+class Result:
+    """What one benchmark run measured."""
+    repos: int
+    duration: float
+    cycles: int
+    cycle_p50: float
+    cycle_p95: float
+    cycle_max: float
+    polls_per_second: float
+    pushes: int
+    deploys: int
+    undeployed_pushes: int
+    deploy_latency_p50: Optional[float]
+    deploy_latency_p95: Optional[float]
+    deploy_latency_max: Optional[float]
+    peak_rss_mb: float
+    setup_seconds: float
+
+def git(*args: str, cwd: Optional[str] = None) -> str:
+    env = dict(os.environ, **GIT_ENV)
+    return subprocess.run(["git", *args], cwd=cwd, env=env, check=True, capture_output=True, text=True).stdout.strip()
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+def create_fixture(root: str, count: int) -> Fixture:
+    """
+    Create count remotes and clones. One template is built with git and then copied,
+    so setting up a thousand repositories takes seconds rather than minutes.
+    """
+    fixture = Fixture(root=root, project_folder=os.path.join(root, "projects"))
+    for folder in ("remotes", "authors", "projects"):
+        os.makedirs(os.path.join(root, folder))
+
+    template_remote = os.path.join(root, "template.git")
+    template_clone = os.path.join(root, "template")
+    git("init", "-q", "--bare", "-b", "main", template_remote)
+    git("clone", "-q", template_remote, template_clone)
+    git("checkout", "-q", "-b", "main", cwd=template_clone)
+    for name, content in (("docker-compose.yml", COMPOSE_FILE), ("Dockerfile", "FROM scratch\n"), ("app.txt", "0\n")):
+        with open(os.path.join(template_clone, name), "w") as handle:
+            handle.write(content)
+    git("add", "-A", cwd=template_clone)
+    git("commit", "-q", "-m", "Initial commit", cwd=template_clone)
+    git("push", "-q", "-u", "origin", "main", cwd=template_clone)
+
+    for index in range(count):
+        name = f"repo-{index:04d}"
+        remote = os.path.join(root, "remotes", f"{name}.git")
+        shutil.copytree(template_remote, remote, symlinks=True)
+        for folder in ("authors", "projects"):
+            clone = os.path.join(root, folder, name)
+            shutil.copytree(template_clone, clone, symlinks=True)
+            git("remote", "set-url", "origin", remote, cwd=clone)
+        repo = os.path.join(fixture.project_folder, name)
+        fixture.repos.append(repo)
+        fixture.authors[repo] = os.path.join(root, "authors", name)
+    return fixture
+
+def push_commit(author: str, number: int) -> str:
+    """Commit a change to the app and push it, returning the new SHA."""
+    with open(os.path.join(author, "app.txt"), "w") as handle:
+        handle.write(f"{number}\n")
+    git("commit", "-q", "-am", f"Change {number}", cwd=author)
+    git("push", "-q", "origin", "main", cwd=author)
+    return git("rev-parse", "HEAD", cwd=author)
+
+async def push_commits(fixture: Fixture, rate: float, rng: random.Random,
+                       pushes: List[Tuple[str, str, float]]) -> None:
+    """Push commits to random repositories at rate pushes per second, until cancelled."""
+    if rate <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    next_push = loop.time()
+    number = 0
+    while True:
+        number += 1
+        repo = rng.choice(fixture.repos)
+        sha = await asyncio.to_thread(push_commit, fixture.authors[repo], number)
+        pushes.append((repo, sha, time.monotonic()))
+        next_push += 1 / rate
+        await asyncio.sleep(max(next_push - loop.time(), 0))
+
+def get_deploy_latencies(pushes: List[Tuple[str, str, float]],
+                         deploys: List[Tuple[str, str, float]]) -> Tuple[List[float], int]:
+    """
+    Match every push to the first deploy of its repository that includes it.
+
+    A deploy includes a push when the deployed commit was pushed at the same time or later,
+    so pushes merged into a later deploy are charged until that deploy finished.
+    """
+    pushed_at = {(repo, sha): at for repo, sha, at in pushes}
+    latencies, undeployed = [], 0
+    for repo, sha, at in pushes:
+        finished = [done for deployed_repo, deployed_sha, done in deploys
+                    if deployed_repo == repo and pushed_at.get((repo, deployed_sha), -1) >= at]
+        if finished:
+            latencies.append(min(finished) - at)
+        else:
+            undeployed += 1
+    return latencies, undeployed
+
+async def run_benchmark(count: int, duration: float, push_rate: float, run_frequency: int,
+                        settings: Settings, seed: int) -> Result:
+    root = tempfile.mkdtemp(prefix=f"syncatron-bench-{count}-")
+    try:
+        setup_started = time.monotonic()
+        fixture = await asyncio.to_thread(create_fixture, root, count)
+        setup_seconds = time.monotonic() - setup_started
+
+        settings.state_path = os.path.join(root, "state.db")
+        state_store = StateStore(settings.state_path)
+        cycles: List[float] = []
+        polled = [0]
+        deploys: List[Tuple[str, str, float]] = []
+        pushes: List[Tuple[str, str, float]] = []
+
+        sync_repositories = syncatron.sync_repositories
+        poll_due_repositories = syncatron.poll_due_repositories
+        deploy_repository = syncatron.deploy_repository
+
+        async def counted_sync(repos, *args, **kwargs):
+            polled[0] += len(repos)
+            return await sync_repositories(repos, *args, **kwargs)
+
+        async def timed_poll(*args, **kwargs):
+            before, started = polled[0], time.monotonic()
+            await poll_due_repositories(*args, **kwargs)
+            if polled[0] > before:
+                cycles.append(time.monotonic() - started)
+
+        async def timed_deploy(repo, revision, *args, **kwargs):
+            report = await deploy_repository(repo, revision, *args, **kwargs)
+            if report.success and revision is not None:
+                deploys.append((repo, revision, time.monotonic()))
+            return report
+
+        syncatron.sync_repositories = counted_sync
+        syncatron.poll_due_repositories = timed_poll
+        syncatron.deploy_repository = timed_deploy
+        triggers = asyncio.Queue()
+        queue = syncatron.create_deploy_queue(settings, state_store, triggers.put_nowait)
+        pusher = asyncio.create_task(push_commits(fixture, push_rate, random.Random(seed), pushes))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(syncatron.scheduler(run_frequency, fixture.project_folder, "", settings,
+                                                       state_store, None, triggers, queue), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            elapsed = time.monotonic() - started
+            pusher.cancel()
+            await asyncio.gather(pusher, return_exceptions=True)
+            await queue.close()
+            state_store.close()
+            syncatron.sync_repositories = sync_repositories
+            syncatron.poll_due_repositories = poll_due_repositories
+            syncatron.deploy_repository = deploy_repository
+
+        latencies, undeployed = get_deploy_latencies(pushes, deploys)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return Result(
+            repos=count, duration=elapsed, cycles=len(cycles),
+            cycle_p50=percentile(cycles, 0.5) or 0.0, cycle_p95=percentile(cycles, 0.95) or 0.0,
+            cycle_max=max(cycles, default=0.0), polls_per_second=polled[0] / elapsed if elapsed else 0.0,
+            pushes=len(pushes), deploys=len(deploys), undeployed_pushes=undeployed,
+            deploy_latency_p50=percentile(latencies, 0.5), deploy_latency_p95=percentile(latencies, 0.95),
+            deploy_latency_max=max(latencies, default=None), peak_rss_mb=peak_rss, setup_seconds=setup_seconds,
+        )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+def print_results(results: List[Result]) -> None:
+    header = ("repos", "cycles", "cycle p50", "cycle p95", "cycle max", "polls/s", "pushes", "deploys",
+              "deploy p50", "deploy p95", "undeployed", "peak RSS")
+    rows = [(str(r.repos), str(r.cycles), format_seconds(r.cycle_p50), format_seconds(r.cycle_p95),
+             format_seconds(r.cycle_max), f"{r.polls_per_second:.1f}", str(r.pushes), str(r.deploys),
+             format_seconds(r.deploy_latency_p50), format_seconds(r.deploy_latency_p95),
+             str(r.undeployed_pushes), f"{r.peak_rss_mb:.0f} MB") for r in results]
+    widths = [max(len(cell) for cell in column) for column in zip(header, *rows)]
+    for row in (header, *rows):
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Syncatron against synthetic repositories.")
+    parser.add_argument("--repos", default="10,100", help="Comma separated repository counts. Default is 10,100.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds each run lasts. Default is 30.")
+    parser.add_argument("--push-rate", type=float, default=1, help="Pushes per second across all repositories.")
+    parser.add_argument("--run-frequency", type=int, default=5, help="RUN_FREQUENCY of the scheduler. Default is 5.")
+    parser.add_argument("--build-seconds", type=float, default=2, help="Time the stub docker takes to build.")
+    parser.add_argument("--up-seconds", type=float, default=0.5, help="Time the stub docker takes to start services.")
+    parser.add_argument("--pull-workers", type=int, default=Settings.pull_workers, help="PULL_WORKERS of the run.")
+    parser.add_argument("--deploy-workers", type=int, default=Settings.deploy_workers,
+                        help="DEPLOY_WORKERS of the run. Default is the CPU count.")
+    parser.add_argument("--update-mode", default=Settings.update_mode, choices=("pull", "ff-only", "reset"),
+                        help="UPDATE_MODE of the run.")
+    parser.add_argument("--fetch-depth", type=int, default=Settings.fetch_depth, help="FETCH_DEPTH of the run.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the push order.")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to this file as JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Show Syncatron's log output.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+    os.environ["PATH"] = FAKE_DOCKER_DIR + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FAKE_DOCKER_BUILD_SECONDS"] = str(args.build_seconds)
+    os.environ["FAKE_DOCKER_UP_SECONDS"] = str(args.up_seconds)
+    socket_dir = tempfile.mkdtemp(prefix="syncatron-bench-engine-")
+    engine = FakeEngine(os.path.join(socket_dir, "docker.sock")).start()
+    os.environ["DOCKER_HOST"] = f"unix://{os.path.join(socket_dir, 'docker.sock')}"
+
+    results = []
+    try:
+        for count in (int(value) for value in args.repos.split(",") if value.strip()):
+            settings = Settings(pull_workers=args.pull_workers, deploy_workers=args.deploy_workers,
+                                update_mode=args.update_mode, fetch_depth=args.fetch_depth)
+            result = asyncio.run(run_benchmark(count, args.duration, args.push_rate, args.run_frequency, settings,
+                                               args.seed))
+            results.append(result)
+            print_results([result])
+    finally:
+        close_client()
+        engine.stop()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+    if len(results) > 1:
+        print()
+        print_results(results)
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump([asdict(result) for result in results], handle, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Stand-in for the Docker engine API used by the benchmarks.
+
+Serves the few endpoints Syncatron calls over a Unix socket: the version probe,
+engine info, image and build cache prune and the container list, which is always empty.
+"""
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        return "fake-engine"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith("/version"):
+            self.reply({"ApiVersion": "1.41", "Version": "24.0.0"})
+        elif path.endswith("/info"):
+            self.reply({"DockerRootDir": "/nonexistent/docker"})
+        else:
+            self.reply([])
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.reply({"ImagesDeleted": [], "SpaceReclaimed": 0, "CachesDeleted": []})
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        super().__init__(socket_path, FakeEngineHandler)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self) -> "FakeEngine":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,92 @@
+import heapq
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Weight of the newest sample in the moving average
+DEFAULT_ALPHA = 0.3
+# Most recent samples kept for the percentiles
+WINDOW = 32
+# Phase under which the duration of a whole deploy is recorded
+PHASE_DEPLOY = "deploy"
+
+@dataclass
+class DurationStats:
+    """
+    A compact rolling history of how long a deploy phase took.
+
+    Attributes:
+        ewma (float): Exponentially weighted moving average of the durations, in seconds.
+        count (int): The number of durations recorded.
+        samples (List[float]): The most recent durations, oldest first, at most WINDOW of them.
+    """
+    ewma: float = 0.0
+    count: int = 0
+    samples: List[float] = field(default_factory=list)
+
+    def add(self, duration: float, alpha: float = DEFAULT_ALPHA) -> None:
+        """
+        Add a duration to the history.
+
+        Args:
+            duration (float): The seconds the phase took.
+            alpha (float): Weight of the new duration in the moving average.
+        """
+        self.ewma = duration if not self.count else alpha * duration + (1 - alpha) * self.ewma
+        self.count += 1
+        self.samples = (self.samples + [duration])[-WINDOW:]
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Get a percentile of the recent durations, using the nearest rank.
+
+        Args:
+            percent (float): The percentile, between 0 and 100.
+
+        Returns:
+            Optional[float]: The duration, None if nothing was recorded.
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+def get_priority(expected: Optional[float], waited: float, default: float) -> float:
+    """
+    Rank a waiting deploy for shortest expected job first with aging, lower runs first.
+
+    The rank is the expected duration less the time already waited, which orders deploys
+    by when they arrived plus how long they take. Among deploys that just arrived the
+    shortest runs first, and a deploy that has waited as long as it is expected to take
+    goes ahead of every deploy that arrives after that, so long builds are not starved.
+
+    Args:
+        expected (Optional[float]): Seconds the deploy is expected to take, None if unknown.
+        waited (float): Seconds the deploy has been waiting.
+        default (float): Seconds assumed for a deploy without history.
+
+    Returns:
+        float: The rank of the deploy.
+    """
+    return (expected if expected is not None else default) - waited
+
+def estimate_finish_times(running: Dict[str, float], pending: Dict[str, float], workers: int) -> Dict[str, float]:
+    """
+    Estimate when queued and running deploys finish, assuming pending deploys start shortest first.
+
+    Args:
+        running (Dict[str, float]): Seconds each running deploy still needs.
+        pending (Dict[str, float]): Seconds each pending deploy is expected to take.
+        workers (int): Most deploys running at once.
+
+    Returns:
+        Dict[str, float]: Seconds from now until each deploy is expected to finish.
+    """
+    finish = {repo: max(remaining, 0.0) for repo, remaining in running.items()}
+    slots = sorted(finish.values())[:max(workers, 1)]
+    slots += [0.0] * (max(workers, 1) - len(slots))
+    heapq.heapify(slots)
+    for repo, expected in sorted(pending.items(), key=lambda item: (item[1], item[0])):
+        finish[repo] = heapq.heappop(slots) + expected
+        heapq.heappush(slots, finish[repo])
+    return finish
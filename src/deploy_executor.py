@@ -0,0 +1,199 @@
+import os
+import time
+import asyncio
+import logging
+import statistics
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from src.build_history import get_priority
+from src.metrics import DEPLOYS_RUNNING
+
+logger = logging.getLogger(__name__)
+
+# Memory a single build is assumed to need when no other amount is configured
+DEFAULT_MEMORY_PER_DEPLOY = 1024 * 1024 * 1024
+# Seconds a started build is assumed not to show up in MemAvailable yet, so its share stays reserved
+RAMP_SECONDS = 30
+# Seconds between re-reads of /proc while deploys wait for room on the host
+RECHECK_SECONDS = 5
+# Seconds a deploy is assumed to take when no deploy has a duration history yet
+DEFAULT_EXPECTED_SECONDS = 60
+
+T = TypeVar("T")
+
+@dataclass
+class HostResources:
+    """
+    A snapshot of the resources of the host.
+
+    Attributes:
+        cpu_count (int): The CPUs this process may run on.
+        memory_available (Optional[int]): Bytes of memory available without swapping, None if unknown.
+        load_average (Optional[float]): The one minute load average, None if unknown.
+    """
+    cpu_count: int
+    memory_available: Optional[int] = None
+    load_average: Optional[float] = None
+
+def get_cpu_count() -> int:
+    """
+    Get the number of CPUs this process may run on, honouring CPU affinity.
+
+    Returns:
+        int: The CPU count, at least 1.
+    """
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+def read_host_resources(proc_root: str = "/proc") -> HostResources:
+    """
+    Read the available memory and load average from /proc.
+
+    Args:
+        proc_root (str): Where procfs is mounted.
+
+    Returns:
+        HostResources: The resources, with None for anything that could not be read.
+    """
+    resources = HostResources(cpu_count=get_cpu_count())
+    try:
+        with open(os.path.join(proc_root, "meminfo")) as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    resources.memory_available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        with open(os.path.join(proc_root, "loadavg")) as f:
+            resources.load_average = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return resources
+
+class DeployExecutor:
+    """
+    Runs deploys concurrently while the host has room for them.
+
+    A deploy is admitted when fewer than max_workers are running, the available memory
+    covers its share on top of the shares of builds that only just started, and the load
+    average is below the CPU count. One deploy is always admitted when none is running,
+    so a busy host slows deploys down without stopping them. Deploys of the same
+    repository never run at the same time.
+
+    When deploys wait for room, the one expected to be shortest starts first, so a quick
+    configuration change does not sit behind a long image build. Waiting ages a deploy,
+    so a long one still starts once it has waited long enough relative to its length.
+    Deploys without a duration history are assumed to take as long as the median of
+    the others.
+    """
+
+    def __init__(self, max_workers: int = 0, memory_per_deploy: int = DEFAULT_MEMORY_PER_DEPLOY,
+                 read_resources: Callable[[], HostResources] = read_host_resources, shortest_first: bool = True):
+        """
+        Args:
+            max_workers (int): Most deploys running at once. 0 uses the CPU count.
+            memory_per_deploy (int): Bytes of memory a single build is assumed to need.
+            read_resources (Callable[[], HostResources]): Reads the current host resources.
+            shortest_first (bool): Start the waiting deploy expected to be shortest first, instead of the oldest.
+        """
+        self.max_workers = max_workers or get_cpu_count()
+        self.memory_per_deploy = memory_per_deploy
+        self.read_resources = read_resources
+        self.shortest_first = shortest_first
+
+        self._repo_locks: Dict[str, asyncio.Lock] = {}
+        self._started: Dict[str, float] = {}
+        self._waiting: Dict[str, Tuple[Optional[float], float]] = {}
+        self._changed: Optional[asyncio.Condition] = None
+
+    @property
+    def running(self) -> int:
+        """The number of deploys currently running."""
+        return len(self._started)
+
+    def next_in_line(self) -> Optional[str]:
+        """
+        Get the waiting deploy that starts next once the host has room.
+
+        Returns:
+            Optional[str]: The repository, None if no deploy is waiting.
+        """
+        if not self._waiting:
+            return None
+        if not self.shortest_first:
+            return min(self._waiting, key=lambda repo: self._waiting[repo][1])
+
+        now = time.monotonic()
+        known = [expected for expected, _ in self._waiting.values() if expected is not None]
+        default = statistics.median(known) if known else DEFAULT_EXPECTED_SECONDS
+        return min(self._waiting, key=lambda repo: (get_priority(self._waiting[repo][0], now - self._waiting[repo][1],
+                                                                 default), self._waiting[repo][1]))
+
+    def can_admit(self, resources: HostResources) -> bool:
+        """
+        Decide whether another deploy fits on the host.
+
+        Args:
+            resources (HostResources): The current host resources.
+
+        Returns:
+            bool: True if another deploy may start.
+        """
+        if not self._started:
+            return True
+        if len(self._started) >= self.max_workers:
+            return False
+        if resources.memory_available is not None:
+            now = time.monotonic()
+            ramping = sum(1 for started in self._started.values() if now - started < RAMP_SECONDS)
+            if resources.memory_available - ramping * self.memory_per_deploy < self.memory_per_deploy:
+                return False
+        if resources.load_average is not None and resources.load_average >= resources.cpu_count:
+            return False
+        return True
+
+    async def run(self, repo: str, operation: Callable[[], Awaitable[T]], expected: Optional[float] = None) -> T:
+        """
+        Run a deploy of a repository once the repository is free, the host has room and it is next in line.
+
+        Args:
+            repo (str): The repository directory being deployed.
+            operation (Callable[[], Awaitable[T]]): Starts the deploy.
+            expected (Optional[float]): Seconds the deploy is expected to take, None if unknown.
+
+        Returns:
+            T: The result of the deploy.
+        """
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        lock = self._repo_locks.setdefault(repo, asyncio.Lock())
+
+        async with lock:
+            async with self._changed:
+                self._waiting[repo] = (expected, time.monotonic())
+                try:
+                    while self.next_in_line() != repo or not self.can_admit(
+                            await asyncio.to_thread(self.read_resources)):
+                        if self.next_in_line() == repo:
+                            logger.info(f"Deploy of {repo} waits for resources, {self.running} deploys running.")
+                        try:
+                            await asyncio.wait_for(self._changed.wait(), RECHECK_SECONDS)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    del self._waiting[repo]
+                    # The deploy after this one may fit as well
+                    self._changed.notify_all()
+                self._started[repo] = time.monotonic()
+                DEPLOYS_RUNNING.inc()
+
+            try:
+                return await operation()
+            finally:
+                async with self._changed:
+                    del self._started[repo]
+                    DEPLOYS_RUNNING.dec()
+                    self._changed.notify_all()
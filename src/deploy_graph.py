@@ -0,0 +1,94 @@
+import os
+import logging
+from graphlib import CycleError, TopologicalSorter
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+from src.repo_config import load_repo_config
+
+logger = logging.getLogger(__name__)
+
+Graph = Dict[str, Set[str]]
+
+def get_dependencies(repo: str) -> List[str]:
+    """
+    Get the repositories a repository declares in the depends_on list of its .syncatron.json.
+
+    Entries are paths relative to the folder holding the repository, so sibling
+    repositories are named by their directory name, or absolute paths.
+
+    Args:
+        repo (str): The repository directory.
+
+    Returns:
+        List[str]: The normalised directories of the dependencies.
+    """
+    depends_on = load_repo_config(repo).depends_on
+    if isinstance(depends_on, str):
+        depends_on = [depends_on]
+    if not isinstance(depends_on, list) or not all(isinstance(name, str) for name in depends_on):
+        logger.warning(f"Ignoring depends_on of {repo}: expected a list of repository names.")
+        return []
+
+    parent = os.path.dirname(os.path.normpath(repo))
+    dependencies = [os.path.normpath(os.path.join(parent, name)) for name in depends_on if name]
+    return [dependency for dependency in dependencies if dependency != os.path.normpath(repo)]
+
+def build_graph(repos: Iterable[str], get_repo_dependencies: Callable[[str], List[str]] = get_dependencies) -> Graph:
+    """
+    Build the dependency graph of a set of repositories, leaving out dependencies outside the set.
+
+    Args:
+        repos (Iterable[str]): The repository directories.
+        get_repo_dependencies (Callable[[str], List[str]]): Gets the dependencies of a repository.
+
+    Returns:
+        Graph: The dependencies of each repository within the set.
+    """
+    repos = set(repos)
+    return {repo: {dependency for dependency in get_repo_dependencies(repo) if dependency in repos} for repo in repos}
+
+def break_cycles(graph: Graph) -> Tuple[Graph, List[List[str]]]:
+    """
+    Remove the dependencies that close a cycle, so the rest of the graph can still be ordered.
+
+    Args:
+        graph (Graph): The dependencies of each repository.
+
+    Returns:
+        Tuple[Graph, List[List[str]]]: The graph without cycles, and every cycle that was broken,
+        as repositories that each depend on the next, starting and ending with the same one.
+    """
+    graph = {repo: set(dependencies) for repo, dependencies in graph.items()}
+    cycles = []
+    while True:
+        try:
+            # Sorted, so every caller breaks the same cycle at the same dependency
+            TopologicalSorter({repo: sorted(graph[repo]) for repo in sorted(graph)}).prepare()
+            return graph, cycles
+        except CycleError as e:
+            # The sorter lists each repository before one that depends on it
+            cycle = list(reversed(e.args[1]))
+            cycles.append(cycle)
+            graph[cycle[0]].discard(cycle[1])
+
+def get_deploy_levels(graph: Graph) -> List[List[str]]:
+    """
+    Group repositories into levels that only depend on earlier levels.
+
+    Repositories in the same level are independent of each other and can deploy in
+    parallel. Cycles are broken first, see break_cycles.
+
+    Args:
+        graph (Graph): The dependencies of each repository.
+
+    Returns:
+        List[List[str]]: The levels in deploy order, each sorted by directory.
+    """
+    graph, _ = break_cycles(graph)
+    sorter = TopologicalSorter(graph)
+    sorter.prepare()
+    levels = []
+    while sorter.is_active():
+        level = sorted(sorter.get_ready())
+        levels.append(level)
+        sorter.done(*level)
+    return levels
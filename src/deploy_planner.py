@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from git import GitCommandError
+from src.docker_handler import compose_command, get_docker_compose_file, run_command
+from src.git_handler import get_changed_files
+from src.process_runner import log_sink
+
+logger = logging.getLogger(__name__)
+
+# Files next to the compose file that change how every service is configured
+COMPOSE_CONFIG_FILES = ("docker-compose.yml", ".env")
+
+@dataclass
+class ServiceSources:
+    """
+    The local files a compose service is built or configured from.
+
+    Attributes:
+        name (str): The service name.
+        build_context (Optional[str]): Absolute path of the build context, None for image-only or remote contexts.
+        dockerfile (Optional[str]): Absolute path of the Dockerfile.
+        bind_sources (List[str]): Absolute paths bind mounted into the service.
+    """
+    name: str
+    build_context: Optional[str] = None
+    dockerfile: Optional[str] = None
+    bind_sources: List[str] = field(default_factory=list)
+
+@dataclass
+class DeployPlan:
+    """
+    What a deploy has to do to bring a compose project from one commit to another.
+
+    Attributes:
+        full (bool): Tear down, rebuild and start the whole project.
+        build_services (List[str]): Services whose image has to be rebuilt.
+        restart_services (List[str]): Services to restart because a bind mounted file changed.
+        recreate (bool): Run 'up -d' for the whole project so compose recreates changed services.
+        reason (str): Why this plan was chosen, for the logs.
+    """
+    full: bool = False
+    build_services: List[str] = field(default_factory=list)
+    restart_services: List[str] = field(default_factory=list)
+    recreate: bool = False
+    reason: str = ""
+
+    @property
+    def is_empty(self) -> bool:
+        """True if the change does not affect any service."""
+        return not (self.full or self.build_services or self.restart_services or self.recreate)
+
+def is_within(path: str, directory: str) -> bool:
+    """
+    Check whether a path is a directory or lies inside it.
+
+    Args:
+        path (str): The path to check.
+        directory (str): The directory.
+
+    Returns:
+        bool: True if path is directory or is below it.
+    """
+    return path == directory or path.startswith(os.path.join(directory, ""))
+
+async def load_compose_services(path: str) -> Dict[str, ServiceSources]:
+    """
+    Resolve the compose file of a project with 'docker compose config' and map each service to its sources.
+
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+
+    Returns:
+        Dict[str, ServiceSources]: The sources of each service, keyed by service name.
+
+    Raises:
+        ValueError: If the compose configuration cannot be resolved.
+    """
+    docker_compose_file = get_docker_compose_file(path)
+    # The result only keeps the tail of stdout and stderr mixed, so the whole of stdout is collected separately
+    stdout: List[str] = []
+
+    def collect(stream: str, line: str) -> None:
+        if stream == "stdout":
+            stdout.append(line)
+        else:
+            log_sink(stream, line)
+
+    result = await run_command(compose_command(docker_compose_file, "config", "--format", "json"), sink=collect)
+    if result.exit_code != 0:
+        raise ValueError(f"Could not resolve compose configuration: {result.output}")
+    try:
+        config = json.loads("\n".join(stdout))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Could not parse compose configuration: {e}") from e
+
+    services = {}
+    for name, service in config.get("services", {}).items():
+        sources = ServiceSources(name=name)
+
+        build = service.get("build")
+        if isinstance(build, str):
+            build = {"context": build}
+        context = (build or {}).get("context")
+        # Remote contexts such as git URLs are not part of this checkout
+        if context and "://" not in context and not context.startswith("git@"):
+            sources.build_context = os.path.normpath(os.path.join(path, context))
+            sources.dockerfile = os.path.normpath(os.path.join(sources.build_context,
+                                                               build.get("dockerfile") or "Dockerfile"))
+
+        for volume in service.get("volumes") or []:
+            if isinstance(volume, dict) and volume.get("type") == "bind" and volume.get("source"):
+                sources.bind_sources.append(os.path.normpath(os.path.join(path, volume["source"])))
+
+        services[name] = sources
+    return services
+
+def plan_changes(path: str, changed_files: List[str], services: Dict[str, ServiceSources]) -> DeployPlan:
+    """
+    Work out which services a set of changed files affects.
+
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        changed_files (List[str]): Absolute paths of the changed files.
+        services (Dict[str, ServiceSources]): The sources of each service.
+
+    Returns:
+        DeployPlan: The services to rebuild and restart.
+    """
+    plan = DeployPlan()
+    config_files = {os.path.join(path, name) for name in COMPOSE_CONFIG_FILES}
+
+    for changed_file in changed_files:
+        # The compose file and .env may change build arguments and targets, not just how containers run
+        is_config = changed_file in config_files
+        if is_config:
+            plan.recreate = True
+        for service in services.values():
+            if service.build_context and (is_config or is_within(changed_file, service.build_context)
+                                          or changed_file == service.dockerfile):
+                if service.name not in plan.build_services:
+                    plan.build_services.append(service.name)
+            elif any(is_within(changed_file, source) for source in service.bind_sources):
+                if service.name not in plan.restart_services:
+                    plan.restart_services.append(service.name)
+
+    # Rebuilt services are recreated anyway, restarting them as well would be redundant
+    plan.restart_services = [name for name in plan.restart_services if name not in plan.build_services]
+    plan.reason = (f"{len(changed_files)} changed files: rebuild {plan.build_services or 'none'}, "
+                   f"restart {plan.restart_services or 'none'}, recreate project: {plan.recreate}")
+    return plan
+
+async def plan_deploy(path: str, old_sha: Optional[str], new_sha: Optional[str]) -> DeployPlan:
+    """
+    Plan the deploy of a compose project from the previously deployed commit to a new one.
+
+    Falls back to a full deploy whenever the difference cannot be worked out, for
+    instance when nothing was deployed before or the compose file does not resolve.
+
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        old_sha (Optional[str]): The previously deployed commit.
+        new_sha (Optional[str]): The commit to deploy.
+
+    Returns:
+        DeployPlan: The deploy plan.
+    """
+    if not old_sha or not new_sha:
+        return DeployPlan(full=True, reason="no previously deployed commit")
+    if old_sha == new_sha:
+        return DeployPlan(full=True, reason="redeploy of the same commit")
+
+    try:
+        changed_files = await asyncio.to_thread(get_changed_files, path, old_sha, new_sha)
+        services = await load_compose_services(path)
+    except (GitCommandError, ValueError, FileNotFoundError) as e:
+        logger.info(f"Falling back to a full deploy of {path}: {e}")
+        return DeployPlan(full=True, reason=str(e))
+
+    plan = plan_changes(path, changed_files, services)
+    logger.info(f"Deploy plan for {path}: {plan.reason}")
+    return plan
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from src.deploy_executor import DeployExecutor
+from src.deploy_graph import break_cycles
+from src.metrics import DEPLOY_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+DeployFunction = Callable[[str, Optional[str]], Awaitable[object]]
+
+class DeployQueue:
+    """
+    Queues deploys keyed by repository, so a burst of triggers costs a single build.
+
+    Each repository has at most one pending deploy, and submitting again replaces
+    its revision with the newer one. A pending deploy starts once no new revision
+    was submitted for the debounce window. A revision submitted while the repository
+    is being deployed waits for that deploy to finish, unless the running deploy is
+    cancelled as superseded.
+
+    A deploy also waits for the queued and running deploys of the repositories it
+    depends on, and nothing else, so independent repositories deploy in parallel.
+    Dependencies that form a cycle are reported and ignored. Deploys that wait for
+    room on the host are passed to the executor with their expected duration, so it
+    can start the shortest first.
+    """
+
+    def __init__(self, deploy: DeployFunction, executor: Optional[DeployExecutor] = None,
+                 debounce: float = 0.0, on_deferred: Optional[Callable[[str], None]] = None,
+                 get_dependencies: Optional[Callable[[str], List[str]]] = None,
+                 estimate_duration: Optional[Callable[[str], Optional[float]]] = None):
+        """
+        Args:
+            deploy (DeployFunction): Deploys a repository directory at a revision.
+            executor (Optional[DeployExecutor]): Runs the deploys. None creates one with default limits.
+            debounce (float): Seconds a repository must go without new submissions before it is deployed.
+            on_deferred (Optional[Callable[[str], None]]): Called with a repository whose sync was deferred
+                while it was being deployed, once that deploy is over.
+            get_dependencies (Optional[Callable[[str], List[str]]]): Gets the repositories a repository
+                depends on. None deploys every repository independently.
+            estimate_duration (Optional[Callable[[str], Optional[float]]]): Gets the seconds a deploy of
+                a repository is expected to take, None if unknown.
+        """
+        self.deploy = deploy
+        self.executor = executor or DeployExecutor()
+        self.debounce = debounce
+        self.on_deferred = on_deferred
+        self.get_dependencies = get_dependencies
+        self.estimate_duration = estimate_duration
+
+        self._pending: Dict[str, Optional[str]] = {}
+        self._due: Dict[str, float] = {}
+        self._contexts: Dict[str, contextvars.Context] = {}
+        self._running: Dict[str, Optional[str]] = {}
+        self._deploys: Dict[str, asyncio.Task] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._superseded: Set[str] = set()
+        self._deferred: Set[str] = set()
+        self._dependencies: Dict[str, List[str]] = {}
+        self._reported_cycles: Set[Tuple[str, ...]] = set()
+        self._progress: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+
+    def is_deploying(self, repo: str) -> bool:
+        """Whether a deploy of the repository is running."""
+        return repo in self._running
+
+    def deploying_revision(self, repo: str) -> Optional[str]:
+        """The revision of the repository being deployed, None if it is not being deployed or the revision is unknown."""
+        return self._running.get(repo)
+
+    def pending_revision(self, repo: str) -> Optional[str]:
+        """The revision of the repository waiting to be deployed, None if none is waiting."""
+        return self._pending.get(repo)
+
+    def submit(self, repo: str, revision: Optional[str] = None) -> None:
+        """
+        Queue a deploy of a repository, merging it with a deploy already waiting.
+
+        Args:
+            repo (str): The repository directory.
+            revision (Optional[str]): The commit to deploy.
+        """
+        if repo in self._running and repo not in self._pending and revision is not None \
+                and self._running[repo] == revision:
+            logger.debug(f"Revision {revision} of {repo} is already being deployed.")
+            return
+
+        if repo in self._pending:
+            if revision is not None and self._pending[repo] == revision:
+                return
+            logger.info(f"Merging queued deploys of {repo}.")
+        if repo not in self._pending:
+            DEPLOY_QUEUE_DEPTH.inc()
+        self._pending[repo] = revision
+        if self.get_dependencies is not None:
+            self._dependencies[repo] = self.get_dependencies(repo)
+        # The deploy runs in the context of the latest submission, so it is traced with the cycle that queued it
+        self._contexts[repo] = contextvars.copy_context()
+        self._due[repo] = asyncio.get_running_loop().time() + self.debounce
+        self._idle_event().clear()
+        if repo not in self._workers:
+            self._workers[repo] = asyncio.create_task(self._work(repo))
+
+    def defer(self, repo: str) -> None:
+        """Remember that a sync of a repository was skipped because it is being deployed."""
+        self._deferred.add(repo)
+
+    async def cancel(self, repo: str) -> bool:
+        """
+        Cancel the running deploy of a repository because a newer revision superseded it.
+
+        Args:
+            repo (str): The repository directory.
+
+        Returns:
+            bool: True if a running deploy was cancelled.
+        """
+        task = self._deploys.get(repo)
+        if task is None or task.done():
+            return False
+
+        logger.info(f"Cancelling superseded deploy of revision {self._running.get(repo)} of {repo}.")
+        self._superseded.add(repo)
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        return True
+
+    async def join(self) -> None:
+        """Wait until every queued deploy has finished."""
+        await self._idle_event().wait()
+
+    async def close(self) -> None:
+        """Cancel every queued and running deploy."""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def blocking_dependencies(self, repo: str) -> List[str]:
+        """
+        Get the dependencies of a repository whose deploys are queued or running.
+
+        Args:
+            repo (str): The repository directory.
+
+        Returns:
+            List[str]: The dependencies the deploy of the repository has to wait for.
+        """
+        active = set(self._pending) | set(self._running)
+        graph = {active_repo: {dependency for dependency in self._dependencies.get(active_repo, ())
+                               if dependency in active}
+                 for active_repo in active | {repo}}
+        graph, cycles = break_cycles(graph)
+        for cycle in cycles:
+            if tuple(cycle) not in self._reported_cycles:
+                self._reported_cycles.add(tuple(cycle))
+                logger.error(f"Dependency cycle between repositories: {' -> '.join(cycle)}. "
+                             f"Deploying {cycle[0]} without waiting for {cycle[1]}.")
+        return sorted(graph[repo])
+
+    def _progress_event(self) -> asyncio.Event:
+        if self._progress is None:
+            self._progress = asyncio.Event()
+        return self._progress
+
+    def _notify_progress(self) -> None:
+        """Wake the deploys waiting for their dependencies."""
+        if self._progress is not None:
+            self._progress.set()
+            self._progress = None
+
+    def _idle_event(self) -> asyncio.Event:
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._idle
+
+    async def _work(self, repo: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while repo in self._pending:
+                waiting_for = []
+                while True:
+                    while (delay := self._due[repo] - loop.time()) > 0:
+                        await asyncio.sleep(delay)
+                    blocking = self.blocking_dependencies(repo)
+                    if not blocking:
+                        break
+                    if blocking != waiting_for:
+                        logger.info(f"Deploy of {repo} waits for the deploys of {', '.join(blocking)}.")
+                        waiting_for = blocking
+                    await self._progress_event().wait()
+
+                revision = self._pending.pop(repo)
+                DEPLOY_QUEUE_DEPTH.dec()
+                del self._due[repo]
+                self._running[repo] = revision
+                expected = self.estimate_duration(repo) if self.estimate_duration is not None else None
+                task = self._deploys[repo] = asyncio.create_task(
+                    self.executor.run(repo, lambda: self.deploy(repo, revision), expected),
+                    context=self._contexts.pop(repo))
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    if repo not in self._superseded:
+                        raise
+                except Exception:
+                    logger.exception(f"Deploy of {repo} failed")
+                finally:
+                    self._superseded.discard(repo)
+                    del self._deploys[repo]
+                    del self._running[repo]
+                    self._notify_progress()
+
+                if repo in self._deferred:
+                    self._deferred.discard(repo)
+                    if self.on_deferred is not None:
+                        self.on_deferred(repo)
+        finally:
+            if repo in self._pending:
+                del self._pending[repo]
+                DEPLOY_QUEUE_DEPTH.dec()
+            self._due.pop(repo, None)
+            self._contexts.pop(repo, None)
+            self._dependencies.pop(repo, None)
+            del self._workers[repo]
+            self._notify_progress()
+            if not self._workers:
+                self._idle_event().set()
@@ -0,0 +1,103 @@
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+from src.build_history import PHASE_DEPLOY, estimate_finish_times
+from src.state_store import STATUS_DEPLOYING, STATUS_PENDING, StateStore
+
+@dataclass
+class RepoStatus:
+    """
+    The deploy state of a repository with its expected durations.
+
+    Attributes:
+        path (str): The repository directory.
+        deploy_status (Optional[str]): One of pending, deploying, deployed or failed.
+        revision (Optional[str]): The commit being deployed, waiting to be deployed, or last deployed.
+        expected (Optional[float]): Seconds a deploy is expected to take, the moving average of the last ones.
+        p50 (Optional[float]): Median seconds of the recent deploys.
+        p90 (Optional[float]): 90th percentile seconds of the recent deploys.
+        build (Optional[float]): Seconds a build is expected to take.
+        eta (Optional[float]): Seconds until a pending or running deploy is expected to finish.
+    """
+    path: str
+    deploy_status: Optional[str] = None
+    revision: Optional[str] = None
+    expected: Optional[float] = None
+    p50: Optional[float] = None
+    p90: Optional[float] = None
+    build: Optional[float] = None
+    eta: Optional[float] = None
+
+def get_status(state_store: StateStore, workers: int, now: Optional[float] = None) -> List[RepoStatus]:
+    """
+    Get the deploy state of every known repository, with ETAs for pending and running deploys.
+
+    The ETAs assume pending deploys start shortest first on the given number of workers.
+    Repositories without a duration history count as taking the median of the others.
+
+    Args:
+        state_store (StateStore): The store holding the deploy state and duration history.
+        workers (int): Most deploys running at once.
+        now (Optional[float]): The current Unix time. None uses the clock.
+
+    Returns:
+        List[RepoStatus]: The state of each repository, ordered by directory.
+    """
+    now = time.time() if now is None else now
+    statuses, running, pending = [], {}, {}
+    for state in state_store.list_states():
+        durations = state_store.get_durations(state.path)
+        deploy, build = durations.get(PHASE_DEPLOY), durations.get("rebuild")
+        active = state.deploy_status in (STATUS_PENDING, STATUS_DEPLOYING)
+        status = RepoStatus(path=state.path, deploy_status=state.deploy_status,
+                            revision=state.target_sha if active else state.deployed_sha,
+                            expected=deploy.ewma if deploy else None,
+                            p50=deploy.percentile(50) if deploy else None,
+                            p90=deploy.percentile(90) if deploy else None,
+                            build=build.ewma if build else None)
+        statuses.append(status)
+        if state.deploy_status == STATUS_DEPLOYING:
+            running[state.path] = status
+        elif state.deploy_status == STATUS_PENDING:
+            pending[state.path] = status
+
+    known = sorted(status.expected for status in statuses if status.expected is not None)
+    default = known[len(known) // 2] if known else 0.0
+    started = {status.path: state_store.get(status.path).deploy_started_at for status in running.values()}
+    finish = estimate_finish_times(
+        {path: (status.expected if status.expected is not None else default) - (now - (started[path] or now))
+         for path, status in running.items()},
+        {path: status.expected if status.expected is not None else default for path, status in pending.items()},
+        workers)
+    for path, eta in finish.items():
+        (running.get(path) or pending[path]).eta = eta
+    return statuses
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Format seconds as 1h02m, 3m05s or 12s, or a dash when unknown."""
+    if seconds is None:
+        return "-"
+    seconds = round(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def format_status(statuses: List[RepoStatus]) -> str:
+    """
+    Format repository states as a table.
+
+    Args:
+        statuses (List[RepoStatus]): The states to show.
+
+    Returns:
+        str: The table, one repository per line below a header.
+    """
+    rows = [("REPOSITORY", "STATUS", "REVISION", "DEPLOY", "P50", "P90", "BUILD", "ETA")]
+    for status in statuses:
+        rows.append((status.path, status.deploy_status or "-", (status.revision or "-")[:12],
+                     format_duration(status.expected), format_duration(status.p50), format_duration(status.p90),
+                     format_duration(status.build), format_duration(status.eta)))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
@@ -0,0 +1,247 @@
+import os
+import re
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+import docker
+from docker.errors import DockerException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCKER_HOST = "unix:///var/run/docker.sock"
+# Connections kept open to the engine, shared by every worker thread
+POOL_SIZE = 10
+
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+
+# Tag that keeps the images a deploy replaces, so a failed deploy can go back to them without a rebuild
+ROLLBACK_TAG = "syncatron-previous"
+
+# Health as shown in the status text of the container list, e.g. "Up 2 minutes (health: starting)"
+HEALTH_IN_STATUS = re.compile(r"\((?:health: )?(healthy|unhealthy|starting)\)")
+# Exit code as shown in the status text of the container list, e.g. "Exited (1) 5 seconds ago"
+EXIT_CODE_IN_STATUS = re.compile(r"^Exited \((-?\d+)\)")
+
+_client: Optional[docker.DockerClient] = None
+_client_lock = threading.Lock()
+
+@dataclass
+class ContainerStatus:
+    """
+    The state of a single container as reported by the engine.
+
+    Attributes:
+        id (str): The container ID.
+        name (str): The container name.
+        service (Optional[str]): The compose service the container belongs to.
+        status (str): The container status, such as running or exited.
+        health (Optional[str]): The health check status, None if the container has no health check.
+        image_id (str): The ID of the image the container runs.
+        image (str): The image reference the container was created from, such as shop-api or postgres:16.
+        exit_code (Optional[int]): The exit code of a container that exited, None while it runs.
+    """
+    id: str
+    name: str
+    service: Optional[str]
+    status: str
+    health: Optional[str]
+    image_id: str
+    image: str = ""
+    exit_code: Optional[int] = None
+
+def get_client() -> docker.DockerClient:
+    """
+    Get the shared engine API client, creating it on first use.
+
+    The client is long-lived and keeps a pool of connections to the engine socket,
+    so repeated calls do not reconnect or fork a CLI process.
+
+    Returns:
+        docker.DockerClient: The shared client.
+
+    Raises:
+        DockerException: If the engine cannot be reached.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            base_url = os.getenv("DOCKER_HOST") or DEFAULT_DOCKER_HOST
+            _client = docker.DockerClient(base_url=base_url, version="auto", max_pool_size=POOL_SIZE)
+            logger.info(f"Connected to Docker engine at {base_url}")
+        return _client
+
+def close_client() -> None:
+    """Close the shared engine API client and its connections."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def get_compose_project_name(path: str) -> str:
+    """
+    Get the compose project name docker compose derives for a project directory.
+
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+
+    Returns:
+        str: The project name, honouring COMPOSE_PROJECT_NAME when it is set.
+    """
+    name = os.getenv("COMPOSE_PROJECT_NAME") or os.path.basename(os.path.normpath(path))
+    return re.sub(r"[^a-z0-9_-]", "", name.lower())
+
+def prune_images(filters: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    """
+    Remove unused images, dangling ones only unless other filters are given.
+
+    Args:
+        filters (Optional[Dict[str, object]]): Engine prune filters such as until or label.
+
+    Returns:
+        Dict[str, object]: The deleted images and the space reclaimed in bytes.
+
+    Raises:
+        DockerException: If the engine request fails.
+    """
+    result = get_client().images.prune(filters=filters or {"dangling": True})
+    deleted = result.get("ImagesDeleted") or []
+    logger.info(f"Pruned {len(deleted)} images, reclaimed {result.get('SpaceReclaimed', 0)} bytes")
+    return {"ImagesDeleted": deleted, "SpaceReclaimed": result.get("SpaceReclaimed", 0)}
+
+def prune_tagged_images(filters: Optional[Dict[str, object]] = None,
+                        keep_tag: Optional[str] = None) -> Dict[str, object]:
+    """
+    Remove unused tagged images, except the ones that also carry keep_tag.
+
+    The engine's own prune cannot leave out images by tag, so the images no container
+    uses are listed and their references removed one by one.
+
+    Args:
+        filters (Optional[Dict[str, object]]): Only until is understood, in hours such as '24h'. Images
+            created more recently are kept.
+        keep_tag (Optional[str]): Images with a reference of this tag are kept.
+
+    Returns:
+        Dict[str, object]: The deleted images and the space reclaimed in bytes.
+
+    Raises:
+        DockerException: If the images or containers cannot be listed.
+    """
+    until = (filters or {}).get("until")
+    cutoff = time.time() - float(str(until).rstrip("h")) * 3600 if until else None
+    client = get_client()
+    used = {container.get("ImageID") for container in client.api.containers(all=True)}
+    deleted, reclaimed = [], 0
+    for image in client.api.images():
+        references = [reference for reference in image.get("RepoTags") or [] if reference != "<none>:<none>"]
+        if not references or image.get("Id") in used:
+            continue
+        if keep_tag and any(reference.rpartition(":")[2] == keep_tag for reference in references):
+            continue
+        if cutoff is not None and image.get("Created", 0) > cutoff:
+            continue
+        try:
+            for reference in references:
+                deleted.extend(client.api.remove_image(reference) or [])
+        except DockerException as e:
+            # Such as an image another one is built on
+            logger.debug(f"Could not remove {', '.join(references)}: {e}")
+            continue
+        reclaimed += image.get("Size", 0)
+    logger.info(f"Pruned {len(deleted)} tagged images, reclaimed {reclaimed} bytes")
+    return {"ImagesDeleted": deleted, "SpaceReclaimed": reclaimed}
+
+def prune_build_cache(filters: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    """
+    Remove unused build cache entries.
+
+    Args:
+        filters (Optional[Dict[str, object]]): Engine prune filters such as until.
+
+    Returns:
+        Dict[str, object]: The deleted cache entries and the space reclaimed in bytes.
+
+    Raises:
+        DockerException: If the engine request fails.
+    """
+    result = get_client().api.prune_builds(filters=filters)
+    deleted = result.get("CachesDeleted") or []
+    logger.info(f"Pruned {len(deleted)} build cache entries, reclaimed {result.get('SpaceReclaimed', 0)} bytes")
+    return {"CachesDeleted": deleted, "SpaceReclaimed": result.get("SpaceReclaimed", 0)}
+
+def get_docker_root() -> str:
+    """
+    Get the directory the engine keeps its images, containers and build cache in.
+
+    Returns:
+        str: The engine's root directory, as seen by the engine.
+
+    Raises:
+        DockerException: If the engine request fails.
+    """
+    return get_client().info().get("DockerRootDir") or "/var/lib/docker"
+
+def to_container_status(attributes: dict) -> ContainerStatus:
+    """
+    Convert the engine's container list attributes to a ContainerStatus.
+
+    Args:
+        attributes (dict): The attributes returned by the engine.
+
+    Returns:
+        ContainerStatus: The container state.
+    """
+    # The list endpoint only has the plain state and folds health and exit code into the status text
+    match = HEALTH_IN_STATUS.search(attributes.get("Status") or "")
+    health = match.group(1) if match else None
+    match = EXIT_CODE_IN_STATUS.search(attributes.get("Status") or "")
+    exit_code = int(match.group(1)) if match else None
+
+    names = attributes.get("Names") or []
+    return ContainerStatus(
+        id=attributes.get("Id", ""),
+        name=names[0].lstrip("/") if names else "",
+        service=(attributes.get("Labels") or {}).get(COMPOSE_SERVICE_LABEL),
+        status=attributes.get("State") or "",
+        health=health,
+        image_id=attributes.get("ImageID", ""),
+        image=attributes.get("Image", ""),
+        exit_code=exit_code,
+    )
+
+def get_project_containers(project: str) -> List[ContainerStatus]:
+    """
+    List the containers of a compose project, running or not.
+
+    Args:
+        project (str): The compose project name.
+
+    Returns:
+        List[ContainerStatus]: The state of each container.
+
+    Raises:
+        DockerException: If the engine request fails.
+    """
+    containers = get_client().api.containers(all=True, filters={"label": f"{COMPOSE_PROJECT_LABEL}={project}"})
+    return [to_container_status(container) for container in containers]
+
+def tag_image(image: str, repository: str, tag: str) -> bool:
+    """
+    Tag an image.
+
+    Args:
+        image (str): The image ID or reference to tag.
+        repository (str): The repository part of the new reference.
+        tag (str): The tag part of the new reference.
+
+    Returns:
+        bool: True if the image was tagged.
+
+    Raises:
+        DockerException: If the engine request fails.
+    """
+    return bool(get_client().api.tag(image, repository, tag, force=True))
@@ -1,11 +1,38 @@
 # docker_operations.py
 
 import os
-import subprocess
+import asyncio
+import hashlib
 import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from src.docker_engine import (
+    ROLLBACK_TAG,
+    ContainerStatus,
+    DockerException,
+    get_compose_project_name,
+    get_project_containers,
+    tag_image,
+)
+from src.build_history import PHASE_DEPLOY
+from src.image_gc import IMAGE_GC
+from src.log_setup import log_context
+from src.process_runner import ProcessResult, Sink, run_process
+from src.repo_config import load_repo_config
+from src.metrics import DEPLOY_DOWNTIME, DEPLOY_PHASE_DURATION, DEPLOYS
+from src.profiler import span
+from src.state_store import StateStore, STATUS_DEPLOYED
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+if TYPE_CHECKING:
+    from src.deploy_planner import DeployPlan
+
+# Deploy modes: rolling builds while the old containers keep serving, recreate tears them down first
+DEPLOY_MODE_ROLLING = "rolling"
+DEPLOY_MODE_RECREATE = "recreate"
+
+# Seconds between container health checks while a deploy is being verified
+HEALTH_POLL_INTERVAL = 2
 
 def get_docker_compose_file(path: str) -> str:
     """Get the path to the docker-compose.yml file.
@@ -31,11 +58,24 @@ def get_docker_compose_file(path: str) -> str:
 
     return docker_compose_file
 
-def teardown_container(path: str) -> bool:
+def compose_command(docker_compose_file: str, *args: str) -> List[str]:
+    """Build a docker compose command line for a compose file.
+    
+    Args:
+        docker_compose_file (str): The path to the docker-compose.yml file.
+        *args (str): The compose subcommand and its arguments.
+    
+    Returns:
+        List[str]: The program and its arguments.
+    """
+    return ["docker", "compose", "-f", docker_compose_file, *args]
+
+async def teardown_container(path: str, timeout: Optional[float] = None) -> bool:
     """Stop and remove the Docker container.
     
     Args:
         path (str): The path to the directory containing the docker-compose.yml file.
+        timeout (Optional[float]): Seconds the command may run. None waits forever.
     
     Returns:
         bool: True if the container was successfully stopped and removed, False otherwise.
@@ -43,24 +83,27 @@ def teardown_container(path: str) -> bool:
     try:
         docker_compose_file = get_docker_compose_file(path)
 
-        command = f"docker compose -f \"{docker_compose_file}\" down"
-        output, error, exit_code = run_command(command)
+        result = await run_command(compose_command(docker_compose_file, "down"), timeout)
 
-        if exit_code == 0:
+        if result.exit_code == 0:
             logging.info("Container stopped and removed successfully")
             return True
 
-        logging.error(f"Failed to stop and remove container: {error}")
+        logging.error(f"Failed to stop and remove container:\n{result.output}")
         return False
     except (ValueError, FileNotFoundError) as e:
         logging.error(e)
         return False
 
-def rebuild_container(path: str) -> bool:
+async def rebuild_container(path: str, services: Optional[List[str]] = None, no_cache: bool = False,
+                            timeout: Optional[float] = None) -> bool:
     """Rebuild the Docker container.
     
     Args:
         path (str): The path to the directory containing the docker-compose.yml file.
+        services (Optional[List[str]]): Only rebuild these services. None rebuilds all of them.
+        no_cache (bool): Build without the layer cache.
+        timeout (Optional[float]): Seconds the command may run. None waits forever.
     
     Returns:
         bool: True if the container was successfully rebuilt, False otherwise.
@@ -68,24 +111,29 @@ def rebuild_container(path: str) -> bool:
     try:
         docker_compose_file = get_docker_compose_file(path)
 
-        command = f"docker compose -f \"{docker_compose_file}\" build --no-cache"
-        output, error, exit_code = run_command(command)
+        no_cache_flag = ["--no-cache"] if no_cache else []
+        command = compose_command(docker_compose_file, "build", *no_cache_flag, *(services or []))
+        with IMAGE_GC.building():
+            result = await run_command(command, timeout)
 
-        if exit_code == 0:
+        if result.exit_code == 0:
             logging.info("Container rebuilt successfully")
             return True
 
-        logging.error(f"Failed to rebuild container: {error}")
+        logging.error(f"Failed to rebuild container:\n{result.output}")
         return False
     except (ValueError, FileNotFoundError) as e:
         logging.error(e)
         return False
 
-def start_container(path: str) -> bool:
+async def start_container(path: str, services: Optional[List[str]] = None, timeout: Optional[float] = None) -> bool:
     """Start the Docker container.
     
     Args:
         path (str): The path to the directory containing the docker-compose.yml file.
+        services (Optional[List[str]]): Only start or recreate these services, without their dependencies.
+            None starts all of them.
+        timeout (Optional[float]): Seconds the command may run. None waits forever.
     
     Returns:
         bool: True if the container was successfully started, False otherwise.
@@ -93,93 +141,464 @@ def start_container(path: str) -> bool:
     try:
         docker_compose_file = get_docker_compose_file(path)
 
-        command = f"docker compose -f \"{docker_compose_file}\" up -d"
-        output, error, exit_code = run_command(command)
+        no_deps = ["--no-deps"] if services else []
+        command = compose_command(docker_compose_file, "up", "-d", *no_deps, *(services or []))
+        result = await run_command(command, timeout)
 
-        if exit_code == 0:
+        if result.exit_code == 0:
             logging.info("Container started successfully")
             return True
 
-        logging.error(f"Failed to start container: {error}")
+        logging.error(f"Failed to start container:\n{result.output}")
         return False
     except (ValueError, FileNotFoundError) as e:
         logging.error(e)
         return False
 
-def remove_unused_images() -> bool:
-    """Remove unused Docker images.
+async def restart_container(path: str, services: List[str], timeout: Optional[float] = None) -> bool:
+    """Restart Docker containers in place.
+    
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        services (List[str]): The services to restart.
+        timeout (Optional[float]): Seconds the command may run. None waits forever.
     
     Returns:
-        bool: True if the unused images were successfully removed, False otherwise.
+        bool: True if the containers were successfully restarted, False otherwise.
     """
-    command = "docker image prune -f"
-    output, error, exit_code = run_command(command)
+    try:
+        docker_compose_file = get_docker_compose_file(path)
 
-    if exit_code == 0:
-        logging.info("Unused images removed successfully")
-        return True
+        result = await run_command(compose_command(docker_compose_file, "restart", *services), timeout)
 
-    logging.error(f"Failed to remove unused images: {error}")
-    return False
+        if result.exit_code == 0:
+            logging.info("Containers restarted successfully")
+            return True
 
-def run_command(command: str):
-    """Run a shell command and return the output, error (if any), and exit status.
+        logging.error(f"Failed to restart containers:\n{result.output}")
+        return False
+    except (ValueError, FileNotFoundError) as e:
+        logging.error(e)
+        return False
+
+async def run_command(args: List[str], timeout: Optional[float] = None, sink: Optional[Sink] = None) -> ProcessResult:
+    """Run a command without a shell, streaming its output line by line to the log.
     
     Args:
-        command (str): The command to be executed.
+        args (List[str]): The program and its arguments.
+        timeout (Optional[float]): Seconds the command may run. None waits forever.
+        sink (Optional[Sink]): Called with the stream name and each line instead of logging it.
 
     Returns:
-        tuple: A tuple containing the output, error, and exit code.
+        ProcessResult: The exit code and the last lines of output.
     
     Raises:
         ValueError: If the command is empty.
     """
-    if not command:
+    if not args:
         raise ValueError("Command cannot be empty")
     
-    logging.info(f"Running command: {command}")
-
+    logging.info(f"Running command: {' '.join(args)}")
+    result = await run_process(args, timeout=timeout, sink=sink)
+    if result.timed_out:
+        logging.error(f"Command timed out after {timeout} seconds: {' '.join(args)}")
+    return result
+    
+async def get_container_statuses(path: str) -> List[ContainerStatus]:
+    """Get the state of a compose project's containers from the engine API.
+    
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+    
+    Returns:
+        List[ContainerStatus]: The state of each container, empty if the engine cannot be reached.
+    """
     try:
-        # Running the command and capturing output & error with explicit encoding
-        result = subprocess.run(command, shell=True, text=True, capture_output=True, encoding='utf-8', errors='replace')
+        return await asyncio.to_thread(get_project_containers, get_compose_project_name(path))
+    except DockerException as e:
+        logging.warning(f"Could not read container status for {path}: {e}")
+        return []
 
-        # Logging the output and error
-        if result.stdout:
-            logging.info(f"Output:\n{result.stdout}")
-        
-        if result.stderr:
-            logging.error(f"Error:\n{result.stderr}")
+def split_image_reference(reference: str) -> Tuple[str, str]:
+    """Split an image reference into its repository and tag.
+    
+    Args:
+        reference (str): The image reference, such as shop-api, postgres:16 or registry:5000/team/app:1.2.
+    
+    Returns:
+        Tuple[str, str]: The repository and the tag, latest when the reference has none.
+    """
+    reference = reference.split("@", 1)[0]
+    repository, _, tag = reference.rpartition(":")
+    if not repository or "/" in tag:
+        return reference, "latest"
+    return repository, tag
 
-        return result.stdout, result.stderr, result.returncode
+async def keep_previous_images(path: str) -> Dict[str, ContainerStatus]:
+    """Tag the images the running containers of a project use, so a deploy can roll back to them.
+    
+    The image collector leaves images with this tag alone, also when the disk runs full,
+    so they stay around once the deploy replaced them until the next deploy moves the tag.
+    
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+    
+    Returns:
+        Dict[str, ContainerStatus]: The running container of each service whose image was tagged.
+    """
+    previous = {}
+    for container in await get_container_statuses(path):
+        if container.status != "running" or not container.service or not container.image:
+            continue
+        repository, _ = split_image_reference(container.image)
+        try:
+            await asyncio.to_thread(tag_image, container.image_id, repository, ROLLBACK_TAG)
+        except DockerException as e:
+            logging.warning(f"Could not keep the image of {container.service} for a rollback: {e}")
+            continue
+        previous[container.service] = container
+    return previous
 
-    except Exception as e:
-        logging.error(f"An exception occurred: {str(e)}")
-        return None, str(e), -1
+def is_container_healthy(container: ContainerStatus) -> bool:
+    """Check whether a container runs and passes its health check if it has one, or finished successfully."""
+    if container.status == "exited":
+        return container.exit_code == 0
+    return container.status == "running" and container.health in (None, "healthy")
+
+def has_container_failed(container: ContainerStatus) -> bool:
+    """Check whether a container exited with an error, died or failed its health check."""
+    return (container.status == "exited" and container.exit_code != 0) or container.status == "dead" \
+        or container.health == "unhealthy"
+
+async def wait_until_healthy(path: str, services: Optional[List[str]], timeout: float) -> bool:
+    """Wait for the containers of a project to run and pass their health checks.
     
-def handle_docker_operations(path: str) -> None:
-    """Handle Docker operations for the specified path.
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        services (Optional[List[str]]): Only check the containers of these services. None checks all of them.
+        timeout (float): Seconds the containers have to become healthy.
+    
+    Returns:
+        bool: True if every container became healthy, False if one failed or the deadline passed.
+            A project or service without containers, or an engine that cannot be reached, is not healthy.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        containers = [container for container in await get_container_statuses(path)
+                      if services is None or container.service in services]
+        failed = [container.name for container in containers if has_container_failed(container)]
+        if failed:
+            logging.error(f"Containers of {path} failed after the deploy: {', '.join(failed)}")
+            return False
+        missing = sorted(set(services) - {container.service for container in containers}) if services else []
+        if containers and not missing and all(is_container_healthy(container) for container in containers):
+            return True
+        if loop.time() >= deadline:
+            waiting = [container.name for container in containers if not is_container_healthy(container)]
+            waiting += [f"{service} (no container)" for service in missing]
+            logging.error(f"Containers of {path} did not become healthy within {timeout}s: "
+                          f"{', '.join(waiting) or 'no containers found'}")
+            return False
+        await asyncio.sleep(min(HEALTH_POLL_INTERVAL, max(deadline - loop.time(), 0)))
+
+async def roll_back(path: str, previous: Dict[str, ContainerStatus], services: Optional[List[str]] = None,
+                    timeout: Optional[float] = None) -> bool:
+    """Put back the images the deploy replaced and recreate their containers, without building.
     
     Args:
         path (str): The path to the directory containing the docker-compose.yml file.
+        previous (Dict[str, ContainerStatus]): The container each service ran before the deploy.
+        services (Optional[List[str]]): Only roll back these services. None rolls back all of them.
+        timeout (Optional[float]): Seconds the command may run. None waits forever.
+    
+    Returns:
+        bool: True if the changed services were recreated from their previous images.
     """
-    if not path:
-        logging.error("Invalid path provided. Exiting.")
-        return
+    current = {container.service: container for container in await get_container_statuses(path)}
+    changed = sorted(service for service, container in previous.items()
+                     if (services is None or service in services)
+                     and (service not in current or current[service].image_id != container.image_id))
+    if not changed:
+        logging.error(f"No previous images of {path} to roll back to.")
+        return False
+
+    try:
+        for service in changed:
+            # Compose starts the service from this reference, which the deploy pointed at the new image
+            await asyncio.to_thread(tag_image, previous[service].image_id,
+                                    *split_image_reference(previous[service].image))
+        docker_compose_file = get_docker_compose_file(path)
+    except (DockerException, ValueError, FileNotFoundError) as e:
+        logging.error(f"Failed to roll back {path}: {e}")
+        return False
+
+    command = compose_command(docker_compose_file, "up", "-d", "--no-build", "--no-deps", "--force-recreate", *changed)
+    result = await run_command(command, timeout)
+    if result.exit_code == 0:
+        logging.warning(f"Rolled back {', '.join(changed)} of {path} to the previous images")
+        return True
+
+    logging.error(f"Failed to roll back {path}:\n{result.output}")
+    return False
+
+def get_compose_file_hash(path: str) -> Optional[str]:
+    """Get a hash of the docker-compose.yml file content.
     
-    if not teardown_container(path):
-        logging.error("Failed to stop and remove the container. Exiting.")
-        return
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
     
-    if not rebuild_container(path):
-        logging.error("Failed to rebuild the container. Exiting.")
-        return
+    Returns:
+        Optional[str]: The SHA-256 hex digest of the file, or None if it cannot be read.
+    """
+    try:
+        with open(os.path.join(path, "docker-compose.yml"), "rb") as compose_file:
+            return hashlib.sha256(compose_file.read()).hexdigest()
+    except OSError:
+        return None
+
+class DeployStep(NamedTuple):
+    """A single step of a deploy.
+
+    Attributes:
+        name (str): The step name, recorded so an interrupted deploy can resume after it.
+        operation (Callable[[], Awaitable[bool]]): Runs the step and returns whether it succeeded.
+        failure_message (str): Logged when the step fails.
+        downtime (bool): Whether the services are unavailable while the step runs.
+        services (Optional[List[str]]): The services the step covers, None if it covers the whole project.
+    """
+    name: str
+    operation: Callable[[], Awaitable[bool]]
+    failure_message: str
+    downtime: bool = False
+    services: Optional[List[str]] = None
+
+@dataclass
+class DeployReport:
+    """The outcome and timings of a deploy.
+
+    Attributes:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        success (bool): Whether every step succeeded and the containers came up healthy.
+        skipped (bool): Whether the deploy was skipped because nothing had to change.
+        mode (str): The deploy mode, rolling or recreate.
+        no_cache (bool): Whether the images were built without the layer cache.
+        build_duration (Optional[float]): Seconds the build took, None if nothing was built.
+        downtime (float): Seconds during which the services were stopped or being recreated.
+        duration (float): Seconds the whole deploy took.
+        containers (List[ContainerStatus]): The state of the project's containers after the deploy.
+        rolled_back (bool): Whether unhealthy containers were put back on their previous images.
+    """
+    path: str
+    success: bool = False
+    skipped: bool = False
+    mode: str = DEPLOY_MODE_ROLLING
+    no_cache: bool = False
+    build_duration: Optional[float] = None
+    downtime: float = 0.0
+    duration: float = 0.0
+    containers: List[ContainerStatus] = field(default_factory=list)
+    rolled_back: bool = False
+
+def should_build_without_cache(path: str, state_store: Optional[StateStore] = None,
+                               no_cache_interval: int = 0) -> bool:
+    """Decide whether the next build of a repository skips the layer cache.
     
-    if not start_container(path):
-        logging.error("Failed to start the container. Exiting.")
-        return
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        state_store (Optional[StateStore]): Store that records when the last build without cache ran.
+        no_cache_interval (int): Hours after which a build without cache is forced. 0 never forces one.
     
-    if not remove_unused_images():
-        logging.error("Failed to remove unused images. Exiting.")
-        return
+    Returns:
+        bool: True if the repository opts in with no_cache in its .syncatron.json, or the interval elapsed.
+    """
+    if load_repo_config(path).no_cache:
+        return True
+    if not no_cache_interval or state_store is None:
+        return False
+
+    state = state_store.get(path)
+    last_build = state.no_cache_built_at if state is not None else None
+    return last_build is None or time.time() - last_build >= no_cache_interval * 3600
+
+def get_deploy_steps(path: str, plan: Optional['DeployPlan'] = None, mode: str = DEPLOY_MODE_ROLLING,
+                     no_cache: bool = False, timeout: Optional[float] = None) -> List[DeployStep]:
+    """Get the steps that carry out a deploy plan.
+
+    In rolling mode the images are built while the old containers keep serving, and
+    'up -d' then swaps in the new containers. In recreate mode the project is torn
+    down before the build, as it used to be.
     
-    logging.info("Docker operations completed successfully")
\ No newline at end of file
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        plan (Optional[DeployPlan]): The deploy plan. None deploys the whole project.
+        mode (str): The deploy mode, rolling or recreate.
+        no_cache (bool): Build without the layer cache.
+        timeout (Optional[float]): Seconds each step may run. None waits forever.
+    
+    Returns:
+        List[DeployStep]: The steps in the order they run.
+    """
+    if plan is None or plan.full:
+        recreate = mode == DEPLOY_MODE_RECREATE
+        steps = [
+            DeployStep("rebuild", lambda: rebuild_container(path, no_cache=no_cache, timeout=timeout),
+                       "Failed to rebuild the container. Exiting.", downtime=recreate),
+            DeployStep("start", lambda: start_container(path, timeout=timeout), "Failed to start the container. Exiting.",
+                       downtime=True),
+        ]
+        if recreate:
+            steps.insert(0, DeployStep("teardown", lambda: teardown_container(path, timeout),
+                                       "Failed to stop and remove the container. Exiting.", downtime=True))
+        return steps
+
+    steps = []
+    if plan.build_services:
+        steps.append(DeployStep("rebuild", lambda: rebuild_container(path, plan.build_services, no_cache, timeout),
+                                "Failed to rebuild the container. Exiting.", services=plan.build_services))
+    if plan.recreate or plan.build_services:
+        services = None if plan.recreate else plan.build_services
+        steps.append(DeployStep("start", lambda: start_container(path, services, timeout),
+                                "Failed to start the container. Exiting.", downtime=True, services=services))
+    if plan.restart_services:
+        steps.append(DeployStep("restart", lambda: restart_container(path, plan.restart_services, timeout),
+                                "Failed to restart the containers. Exiting.", downtime=True,
+                                services=plan.restart_services))
+    return steps
+
+def record_deploy_metrics(report: DeployReport) -> None:
+    """Record the outcome and downtime of a finished deploy."""
+    outcome = "success" if report.success else "rolled_back" if report.rolled_back else "failure"
+    DEPLOYS.inc(repo=report.path, outcome=outcome)
+    if report.downtime:
+        DEPLOY_DOWNTIME.observe(report.downtime, repo=report.path)
+
+async def handle_docker_operations(path: str, state_store: Optional[StateStore] = None,
+                                   revision: Optional[str] = None, plan: Optional['DeployPlan'] = None,
+                                   mode: str = DEPLOY_MODE_ROLLING, no_cache: bool = False,
+                                   timeout: Optional[float] = None,
+                                   health_timeout: Optional[float] = None) -> DeployReport:
+    """Handle Docker operations for the specified path.
+
+    When a state store is given, a deploy of a revision and compose file that are
+    already deployed is skipped, every finished step is recorded, and a deploy of
+    the same revision that was interrupted resumes after its last finished step.
+
+    With a health timeout, the images of the running containers are tagged before the
+    deploy, and the containers it started must run and pass their health checks within
+    the timeout. If they do not, or a step fails after services were stopped, such as a
+    build after the teardown in recreate mode, the services go back to the tagged images
+    right away, without a rebuild, and the deploy counts as failed.
+    
+    Args:
+        path (str): The path to the directory containing the docker-compose.yml file.
+        state_store (Optional[StateStore]): Store that records the deploy state of the path.
+        revision (Optional[str]): The commit being deployed.
+        plan (Optional[DeployPlan]): Which services to rebuild and restart. None deploys the whole project.
+        mode (str): The deploy mode, rolling builds before replacing containers, recreate tears down first.
+        no_cache (bool): Build without the layer cache.
+        timeout (Optional[float]): Seconds each Docker command may run. None waits forever.
+        health_timeout (Optional[float]): Seconds the started containers have to become healthy.
+            None does not wait for them and never rolls back.
+
+    Returns:
+        DeployReport: The outcome and timings of the deploy.
+    """
+    report = DeployReport(path=path, mode=mode, no_cache=no_cache)
+    if not path:
+        logging.error("Invalid path provided. Exiting.")
+        return report
+
+    steps = get_deploy_steps(path, plan, mode, no_cache, timeout)
+    if not steps:
+        logging.info(f"No service of {path} is affected by the change. Skipping Docker operations.")
+        report.skipped = True
+    step_names = [step.name for step in steps]
+
+    compose_hash = None
+    completed_steps = []
+    if state_store is not None:
+        compose_hash = get_compose_file_hash(path)
+        state = state_store.get(path)
+        if (state is not None and state.deploy_status == STATUS_DEPLOYED and revision is not None
+                and state.deployed_sha == revision and state.compose_hash == compose_hash):
+            logging.info(f"Revision {revision} of {path} is already deployed. Skipping Docker operations.")
+            report.success = report.skipped = True
+            DEPLOYS.inc(repo=path, outcome="skipped")
+            return report
+
+        state_store.mark_deploying(path, revision, compose_hash)
+        completed_step = state_store.get(path).completed_step
+        if completed_step in step_names:
+            completed_steps = step_names[:step_names.index(completed_step) + 1]
+            logging.info(f"Resuming interrupted deploy of {path} after step '{completed_step}'.")
+
+    deploy_started = time.monotonic()
+    previous = await keep_previous_images(path) if health_timeout else {}
+    downtime_started = None
+    for step in steps:
+        if step.name in completed_steps:
+            continue
+
+        started = time.monotonic()
+        if step.downtime and downtime_started is None:
+            downtime_started = started
+        with span(step.name, "docker", repo=path), log_context(phase=step.name):
+            succeeded = await step.operation()
+        finished = time.monotonic()
+        DEPLOY_PHASE_DURATION.observe(finished - started, repo=path, phase=step.name)
+        # Downtime spans from the first step that stops the services to the end of the last one
+        if downtime_started is not None and (step.downtime or not succeeded):
+            report.downtime = finished - downtime_started
+
+        if not succeeded:
+            logging.error(step.failure_message)
+            # Services that were stopped or being replaced go back to the images they ran before
+            if downtime_started is not None and previous:
+                with span("rollback", "docker", repo=path), log_context(phase="rollback"):
+                    report.rolled_back = await roll_back(path, previous, timeout=timeout)
+            if state_store is not None:
+                state_store.mark_failed(path)
+            report.duration = finished - deploy_started
+            record_deploy_metrics(report)
+            return report
+
+        if step.name == "rebuild":
+            report.build_duration = finished - started
+            if no_cache and state_store is not None:
+                state_store.record_no_cache_build(path)
+        if state_store is not None:
+            state_store.mark_step_completed(path, step.name)
+            state_store.record_duration(path, step.name, finished - started, step.services)
+
+    # The containers of the steps that started or restarted services have to come up healthy
+    started = [step for step in steps if step.downtime and step.name != "teardown"]
+    if health_timeout and started:
+        services = None if any(step.services is None for step in started) else \
+            sorted({service for step in started for service in step.services})
+        with span("health", "docker", repo=path), log_context(phase="health"):
+            healthy = await wait_until_healthy(path, services, health_timeout)
+        if not healthy:
+            with span("rollback", "docker", repo=path), log_context(phase="rollback"):
+                report.rolled_back = await roll_back(path, previous, services, timeout)
+            if state_store is not None:
+                state_store.mark_failed(path)
+            report.duration = time.monotonic() - deploy_started
+            report.containers = await get_container_statuses(path)
+            record_deploy_metrics(report)
+            return report
+
+    report.success = True
+    report.duration = time.monotonic() - deploy_started
+    report.containers = await get_container_statuses(path)
+    if state_store is not None:
+        state_store.mark_deployed(path, revision, compose_hash, report.build_duration)
+        # A resumed deploy skipped some of its steps, so its duration says little about the next one
+        if steps and not completed_steps:
+            state_store.record_duration(path, PHASE_DEPLOY, report.duration)
+    record_deploy_metrics(report)
+    running = sum(1 for container in report.containers if container.status == "running")
+    logging.info(f"Docker operations completed successfully for {path}: mode {mode}, "
+                 f"build {report.build_duration or 0:.1f}s, downtime {report.downtime:.1f}s, "
+                 f"total {report.duration:.1f}s, {running}/{len(report.containers)} containers running")
+    return report
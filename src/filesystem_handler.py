@@ -1,16 +1,145 @@
 import os
-from typing import List
+import fnmatch
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 import logging
 
-# Setup logging configuration
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+@dataclass
+class DirectoryListing:
+    """
+    What a scan learned about a single directory, valid for as long as its mtime does not change.
+    """
+    mtime_ns: int
+    has_git: bool
+    subdirectories: List[str] = field(default_factory=list)
+
+# Files in a git directory whose changes mean a fetch happened or HEAD moved
+WATCHED_GIT_FILES = ("HEAD", "FETCH_HEAD")
+
+# Directory listings from previous scans, keyed by directory path
+_scan_cache: Dict[str, DirectoryListing] = {}
+
+def is_git_marker(entry: os.DirEntry) -> bool:
+    """
+    Check whether a directory entry marks its parent as a git repository.
+
+    :param entry: The directory entry to check
+    :return: True for a .git directory, or a .git file pointing at a git dir (worktrees and submodules)
+    """
+    if entry.name != '.git':
+        return False
+    if entry.is_dir():
+        return True
+    if entry.is_file():
+        try:
+            with open(entry.path, 'r', encoding='utf-8', errors='replace') as git_file:
+                return git_file.read(8) == 'gitdir: '
+        except OSError:
+            return False
+    return False
+
+def list_directory(path: str) -> Optional[DirectoryListing]:
+    """
+    List a directory, reusing the cached listing when its mtime has not changed.
+
+    :param path: Path to the directory to list
+    :return: The directory listing, or None if the directory cannot be read
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        _scan_cache.pop(path, None)
+        return None
+
+    cached = _scan_cache.get(path)
+    if cached is not None and cached.mtime_ns == mtime_ns:
+        return cached
+
+    has_git = False
+    subdirectories = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if is_git_marker(entry):
+                    has_git = True
+                elif entry.is_dir():
+                    subdirectories.append(entry.name)
+    except OSError as e:
+        logging.debug(f"Could not list '{path}': {e}")
+        _scan_cache.pop(path, None)
+        return None
+
+    listing = DirectoryListing(mtime_ns=mtime_ns, has_git=has_git, subdirectories=sorted(subdirectories))
+    _scan_cache[path] = listing
+    return listing
+
+def get_cached_listings(path: str) -> Dict[str, DirectoryListing]:
+    """
+    Get the cached listings of the directories the last scan of path visited.
+
+    :param path: Path that was scanned
+    :return: Directory listings keyed by directory path, including path itself
+    """
+    prefix = os.path.join(path, '')
+    return {cached: listing for cached, listing in _scan_cache.items() if cached == path or cached.startswith(prefix)}
 
-def scan_for_git_repos(path: str) -> List[str]:
+def resolve_git_dir(repo_path: str) -> Optional[str]:
     """
-    Scan the given path for folders containing git repositories one level deep.
+    Resolve the git directory of a repository, following a .git file to the directory it points at.
+
+    :param repo_path: Path to the repository working tree
+    :return: Path to the git directory, or None if it cannot be resolved
+    """
+    git_path = os.path.join(repo_path, '.git')
+    if os.path.isdir(git_path):
+        return git_path
+    try:
+        with open(git_path, 'r', encoding='utf-8', errors='replace') as git_file:
+            content = git_file.readline().strip()
+    except OSError:
+        return None
+    if not content.startswith('gitdir: '):
+        return None
+    return os.path.normpath(os.path.join(repo_path, content[len('gitdir: '):]))
+
+def get_git_file_mtimes(repo_path: str) -> Tuple[Optional[int], ...]:
+    """
+    Get the modification times of the watched git files of a repository.
+
+    :param repo_path: Path to the repository working tree
+    :return: The mtime in nanoseconds of each of WATCHED_GIT_FILES, None for files that do not exist
+    """
+    git_dir = resolve_git_dir(repo_path)
+    mtimes = []
+    for name in WATCHED_GIT_FILES:
+        try:
+            mtimes.append(os.stat(os.path.join(git_dir, name)).st_mtime_ns if git_dir else None)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+def is_excluded(relative_path: str, exclude: List[str]) -> bool:
+    """
+    Check whether a path matches any of the exclusion globs, by name or by path relative to the scan root.
+
+    :param relative_path: The path relative to the scan root, using forward slashes
+    :param exclude: The exclusion globs
+    :return: True if the path is excluded
+    """
+    name = relative_path.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in exclude)
+
+def scan_for_git_repos(path: str, max_depth: int = 1, exclude: Optional[List[str]] = None) -> List[str]:
+    """
+    Scan the given path for folders containing git repositories, up to max_depth levels deep.
+
+    Directory listings are cached by mtime, so only directories that changed since the
+    previous scan are listed again. The search does not descend into repositories.
 
     :param path: Path to the directory to scan
-    :return: List of directories containing .git folders
+    :param max_depth: How many levels below path to look for repositories, 1 means direct children only
+    :param exclude: Globs matched against folder names and paths relative to path that are skipped
+    :return: Sorted list of directories containing a .git folder or .git file
     :raises ValueError: If the input path is not a valid directory
     """
     # Validating the input directory
@@ -18,15 +147,34 @@ def scan_for_git_repos(path: str) -> List[str]:
         logging.error(f"The path '{path}' is not a valid directory.")
         raise ValueError(f"The path '{path}' is not a valid directory.")
 
+    exclude = exclude or []
     git_repos = []
-    # Iterating over items in the provided directory
-    for item in os.listdir(path):
-        item_path = os.path.join(path, item)
-        # Check if the item is a directory and contains a .git folder
-        if os.path.isdir(item_path):
-            if '.git' in os.listdir(item_path):
-                git_repos.append(item_path)
-                logging.info(f"Found git repository: {item_path}")
-
-    logging.info(f"Total git repositories found: {len(git_repos)}")
-    return git_repos
\ No newline at end of file
+    visited: Set[str] = set()
+    pending = [(path, '', 0)]
+    while pending:
+        directory, relative_directory, depth = pending.pop()
+        listing = list_directory(directory)
+        if listing is None:
+            continue
+        visited.add(directory)
+
+        if depth > 0 and listing.has_git:
+            git_repos.append(directory)
+            logging.debug(f"Found git repository: {directory}")
+            continue
+
+        if depth >= max_depth:
+            continue
+
+        for name in listing.subdirectories:
+            relative_path = f"{relative_directory}/{name}" if relative_directory else name
+            if not is_excluded(relative_path, exclude):
+                pending.append((os.path.join(directory, name), relative_path, depth + 1))
+
+    # Forget directories under path that no longer exist or are no longer reached
+    prefix = os.path.join(path, '')
+    for cached_path in [cached for cached in _scan_cache if cached.startswith(prefix) and cached not in visited]:
+        del _scan_cache[cached_path]
+
+    logging.debug(f"Total git repositories found: {len(git_repos)}")
+    return sorted(git_repos)
@@ -1,9 +1,8 @@
 import os
 import logging
-from typing import Tuple, Optional
+from dataclasses import dataclass, field
+from typing import List, Tuple, Optional
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def get_environment_variable(var_name: str) -> Optional[str]:
@@ -79,4 +78,218 @@ def load_environment_variables() -> Tuple[int, str, str]:
         return validate_environment_variables()
     except Exception:
         logger.exception("An error occurred while loading environment variables.")
-        raise
\ No newline at end of file
+        raise
+
+@dataclass
+class Settings:
+    """
+    Optional tuning settings. Each field is read from the environment variable
+    of the same name in upper case and falls back to the default shown here.
+
+    Attributes:
+        pull_workers (int): Maximum number of repositories pulled at the same time.
+        pull_timeout (int): Seconds a single repository pull may take before it is abandoned.
+        state_path (str): Path of the sync state database. Empty uses a file inside the project folder.
+        scan_depth (int): How many levels below the project folder are searched for repositories.
+        scan_exclude (List[str]): Comma separated globs of folders skipped while searching for repositories.
+        watch_mode (str): 'off', or 'auto', 'inotify' or 'poll' to watch the project folder instead of scanning it every cycle.
+        watch_poll_interval (int): Seconds between polls when the watch mode falls back to polling.
+        webhook_port (int): Port of the HTTP endpoint that accepts push notifications and serves metrics. 0 disables it.
+        webhook_host (str): Address the HTTP endpoint listens on.
+        webhook_secret (str): Token push notifications must send in the X-Syncatron-Token header. Required with a webhook port.
+        webhook_insecure (bool): Accept push notifications without a secret, for endpoints only reachable from trusted networks.
+        metrics_port (int): Port of an HTTP endpoint that only serves metrics, so they can be scraped without the webhook. 0 disables it.
+        metrics_host (str): Address the metrics endpoint listens on.
+        deploy_mode (str): 'rolling' builds while the old containers keep serving, 'recreate' tears them down first.
+        no_cache_interval (int): Hours after which a build without the layer cache is forced. 0 never forces one.
+        docker_timeout (int): Seconds a single Docker command, such as a build, may run before it is killed.
+        deploy_workers (int): Most repositories deployed at the same time. 0 uses the CPU count.
+        deploy_memory_mb (int): Megabytes of memory a single build is assumed to need before another one is started.
+        deploy_debounce (int): Seconds a repository must go without new commits before it is deployed. 0 deploys at once.
+        deploy_order (str): 'shortest' starts the waiting deploy expected to take the least time first, 'fifo' the oldest.
+        log_format (str): 'text' for plain log lines, 'json' for a JSON object per line with repo, phase and cycle_id fields.
+        log_rate_limit (int): Records a single log statement may write per minute before the rest are sampled. 0 does not limit. Warnings and errors are never dropped.
+        log_sample (int): Keep one in this many of the records over the log rate limit. 0 drops them all.
+        health_timeout (int): Seconds the containers of a deploy have to run and pass their health checks before it is rolled back to the previous images. 0 does not check.
+        cancel_superseded (bool): Cancel a running deploy when a newer commit of the same repository arrives.
+        poll_max_interval (int): Longest seconds between polls an idle repository backs off to. 0 uses 8 times the run frequency.
+        update_mode (str): 'pull' fetches all branches and merges, 'ff-only' fetches only the tracked branch and fast-forwards, 'reset' fetches only the tracked branch and hard resets to it.
+        fetch_depth (int): Commits of history fetched in the 'ff-only' and 'reset' modes. 0 fetches the full history.
+        fetch_filter (str): Partial clone filter used in the 'ff-only' and 'reset' modes, such as 'blob:none'. Empty fetches all objects.
+        maintenance_interval (int): Hours between background git maintenance runs of every repository. 0 never runs it.
+        repo_cache_size (int): Most repositories whose git handles and helper processes are kept open between cycles.
+        mirror_dir (str): Folder of shared mirrors, one per remote, that checkouts fetch through and borrow objects from. Empty fetches every checkout from its remote.
+        image_gc_watermark (int): Percent of the disk under the Docker root above which unused images are collected even while builds run.
+        image_gc_keep_hours (int): Hours images and build cache are kept after they were created, so builds keep finding their layers.
+        image_gc_budget (int): Seconds an image collection may take before its remaining stages are left for the next one.
+    """
+    pull_workers: int = 8
+    pull_timeout: int = 120
+    state_path: str = ""
+    scan_depth: int = 1
+    scan_exclude: List[str] = field(default_factory=list)
+    watch_mode: str = "off"
+    watch_poll_interval: int = 5
+    webhook_port: int = 0
+    webhook_host: str = "0.0.0.0"
+    webhook_secret: str = ""
+    webhook_insecure: bool = False
+    metrics_port: int = 0
+    metrics_host: str = "0.0.0.0"
+    deploy_mode: str = "rolling"
+    no_cache_interval: int = 0
+    docker_timeout: int = 3600
+    deploy_workers: int = 0
+    deploy_memory_mb: int = 1024
+    deploy_debounce: int = 0
+    deploy_order: str = "shortest"
+    health_timeout: int = 120
+    log_format: str = "text"
+    log_rate_limit: int = 100
+    log_sample: int = 10
+    cancel_superseded: bool = False
+    poll_max_interval: int = 0
+    update_mode: str = "pull"
+    fetch_depth: int = 0
+    fetch_filter: str = ""
+    maintenance_interval: int = 0
+    repo_cache_size: int = 256
+    mirror_dir: str = ""
+    image_gc_watermark: int = 85
+    image_gc_keep_hours: int = 24
+    image_gc_budget: int = 60
+
+def get_optional_positive_integer(var_name: str, default: int) -> int:
+    """
+    Retrieve an optional positive integer environment variable.
+
+    Args:
+        var_name (str): The name of the environment variable.
+        default (int): The value used when the variable is not set.
+
+    Returns:
+        int: The validated positive integer, or the default.
+
+    Raises:
+        ValueError: If the variable is set but is not a positive integer.
+    """
+    value = get_environment_variable(var_name)
+    if value is None or value == "":
+        return default
+    return validate_positive_integer(value, var_name)
+
+def get_optional_non_negative_integer(var_name: str, default: int) -> int:
+    """
+    Retrieve an optional integer environment variable that may be 0 to turn a feature off.
+
+    Args:
+        var_name (str): The name of the environment variable.
+        default (int): The value used when the variable is not set.
+
+    Returns:
+        int: The validated integer, or the default.
+
+    Raises:
+        ValueError: If the variable is set but is not 0 or a positive integer.
+    """
+    value = get_environment_variable(var_name)
+    if value is None or value == "":
+        return default
+    if value.strip() == "0":
+        return 0
+    return validate_positive_integer(value, var_name)
+
+def get_optional_list(var_name: str, default: List[str]) -> List[str]:
+    """
+    Retrieve an optional comma separated list environment variable.
+
+    Args:
+        var_name (str): The name of the environment variable.
+        default (List[str]): The value used when the variable is not set.
+
+    Returns:
+        List[str]: The stripped, non-empty items of the list, or the default.
+    """
+    value = get_environment_variable(var_name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def get_optional_choice(var_name: str, default: str, choices: Tuple[str, ...]) -> str:
+    """
+    Retrieve an optional environment variable that must be one of a fixed set of values.
+
+    Args:
+        var_name (str): The name of the environment variable.
+        default (str): The value used when the variable is not set.
+        choices (Tuple[str, ...]): The allowed values.
+
+    Returns:
+        str: The lower cased value, or the default.
+
+    Raises:
+        ValueError: If the variable is set to a value outside the choices.
+    """
+    value = get_environment_variable(var_name)
+    if value is None or value == "":
+        return default
+
+    value = value.strip().lower()
+    if value not in choices:
+        logger.error(f"{var_name} must be one of: {', '.join(choices)}.")
+        raise ValueError(f"{var_name} must be one of: {', '.join(choices)}.")
+    return value
+
+def load_settings() -> Settings:
+    """
+    Load the optional tuning settings from the environment.
+
+    Returns:
+        Settings: The settings, with defaults for anything not set.
+
+    Raises:
+        ValueError: If a setting is invalid, or the webhook is enabled without a secret.
+    """
+    defaults = Settings()
+    settings = Settings(
+        pull_workers=get_optional_positive_integer('PULL_WORKERS', defaults.pull_workers),
+        pull_timeout=get_optional_positive_integer('PULL_TIMEOUT', defaults.pull_timeout),
+        state_path=get_environment_variable('STATE_PATH') or defaults.state_path,
+        scan_depth=get_optional_positive_integer('SCAN_DEPTH', defaults.scan_depth),
+        scan_exclude=get_optional_list('SCAN_EXCLUDE', defaults.scan_exclude),
+        watch_mode=get_optional_choice('WATCH_MODE', defaults.watch_mode, ("off", "auto", "inotify", "poll")),
+        watch_poll_interval=get_optional_positive_integer('WATCH_POLL_INTERVAL', defaults.watch_poll_interval),
+        webhook_port=get_optional_non_negative_integer('WEBHOOK_PORT', defaults.webhook_port),
+        webhook_host=get_environment_variable('WEBHOOK_HOST') or defaults.webhook_host,
+        webhook_secret=get_environment_variable('WEBHOOK_SECRET') or defaults.webhook_secret,
+        webhook_insecure=get_optional_choice('WEBHOOK_INSECURE', "false", ("true", "false")) == "true",
+        metrics_port=get_optional_non_negative_integer('METRICS_PORT', defaults.metrics_port),
+        metrics_host=get_environment_variable('METRICS_HOST') or defaults.metrics_host,
+        deploy_mode=get_optional_choice('DEPLOY_MODE', defaults.deploy_mode, ("rolling", "recreate")),
+        no_cache_interval=get_optional_non_negative_integer('NO_CACHE_INTERVAL', defaults.no_cache_interval),
+        docker_timeout=get_optional_positive_integer('DOCKER_TIMEOUT', defaults.docker_timeout),
+        deploy_workers=get_optional_non_negative_integer('DEPLOY_WORKERS', defaults.deploy_workers),
+        deploy_memory_mb=get_optional_positive_integer('DEPLOY_MEMORY_MB', defaults.deploy_memory_mb),
+        deploy_debounce=get_optional_non_negative_integer('DEPLOY_DEBOUNCE', defaults.deploy_debounce),
+        deploy_order=get_optional_choice('DEPLOY_ORDER', defaults.deploy_order, ("shortest", "fifo")),
+        health_timeout=get_optional_non_negative_integer('HEALTH_TIMEOUT', defaults.health_timeout),
+        log_format=get_optional_choice('LOG_FORMAT', defaults.log_format, ("text", "json")),
+        log_rate_limit=get_optional_non_negative_integer('LOG_RATE_LIMIT', defaults.log_rate_limit),
+        log_sample=get_optional_non_negative_integer('LOG_SAMPLE', defaults.log_sample),
+        cancel_superseded=get_optional_choice('CANCEL_SUPERSEDED', "false", ("true", "false")) == "true",
+        poll_max_interval=get_optional_non_negative_integer('POLL_MAX_INTERVAL', defaults.poll_max_interval),
+        update_mode=get_optional_choice('UPDATE_MODE', defaults.update_mode, ("pull", "ff-only", "reset")),
+        fetch_depth=get_optional_non_negative_integer('FETCH_DEPTH', defaults.fetch_depth),
+        fetch_filter=get_environment_variable('FETCH_FILTER') or defaults.fetch_filter,
+        maintenance_interval=get_optional_non_negative_integer('MAINTENANCE_INTERVAL', defaults.maintenance_interval),
+        repo_cache_size=get_optional_positive_integer('REPO_CACHE_SIZE', defaults.repo_cache_size),
+        mirror_dir=get_environment_variable('MIRROR_DIR') or defaults.mirror_dir,
+        image_gc_watermark=get_optional_positive_integer('IMAGE_GC_WATERMARK', defaults.image_gc_watermark),
+        image_gc_keep_hours=get_optional_positive_integer('IMAGE_GC_KEEP_HOURS', defaults.image_gc_keep_hours),
+        image_gc_budget=get_optional_positive_integer('IMAGE_GC_BUDGET', defaults.image_gc_budget),
+    )
+    # Anyone who can reach the endpoint could otherwise trigger syncs and deploys
+    if settings.webhook_port and not settings.webhook_secret and not settings.webhook_insecure:
+        logger.error("WEBHOOK_SECRET must be set when WEBHOOK_PORT is, or WEBHOOK_INSECURE set to true.")
+        raise ValueError("WEBHOOK_SECRET must be set when WEBHOOK_PORT is, or WEBHOOK_INSECURE set to true.")
+    return settings
@@ -1,68 +1,634 @@
+import os
+import time
+import asyncio
 import logging
-from typing import List
+import threading
+import contextlib
+import contextvars
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
 from git import Repo, GitCommandError
+from src.state_store import StateStore, STATUS_DEPLOYED
+from src.filesystem_handler import get_git_file_mtimes
+from src.repo_cache import REPO_CACHE
+from src.mirror_cache import attach_mirror, update_mirror
+from src.metrics import FETCH_DURATION, PULLS, PULLS_RUNNING
+from src.profiler import span
+from src.log_setup import log_context
 
 logger = logging.getLogger(__name__)
 
-def add_token_to_remote_url(url, token):
+# Extra seconds granted on top of the git timeout before a pull is abandoned,
+# so git's own kill_after_timeout gets the chance to fire first.
+TIMEOUT_GRACE_SECONDS = 5
+
+# Environment variable through which the credential helper receives the access token
+TOKEN_VARIABLE = "SYNCATRON_GIT_TOKEN"
+
+# Taken by whichever records the outcome of a concurrent pull first, the pull itself or its timeout
+_outcome_claim: contextvars.ContextVar[Optional[threading.Lock]] = contextvars.ContextVar("outcome_claim",
+                                                                                          default=None)
+
+# HEAD and FETCH_HEAD mtimes of each repository as the last update by Syncatron left them
+_own_git_mtimes: Dict[str, Tuple[Optional[int], ...]] = {}
+# Repositories whose working tree an update is rewriting right now
+_updating_repos: Set[str] = set()
+
+# Repositories whose lock a deploy holds, and whether a check of origin is using the handle in its place.
+# Whichever of the two finishes last releases the lock.
+_deploy_holds: Dict[str, Dict[str, bool]] = {}
+_deploy_holds_guard = threading.Lock()
+
+# Seconds between looking for a deploy whose lock can be shared while waiting for a repository lock
+LOCK_POLL_INTERVAL = 0.05
+
+# Git options for commands run while updating when garbage collection is left to run_maintenance
+NO_AUTO_GC = {"c": "gc.auto=0"}
+
+@dataclass
+class UpdateOptions:
     """
-    Add the access token to the remote URL for authentication.
+    How pull_repository brings a repository up to date with origin.
 
-    :param url: The original remote URL.
-    :param token: The access token to be added to the URL.
-    :return: The remote URL with the access token embedded.
+    Attributes:
+        mode (str): 'pull' fetches all branches and merges, 'ff-only' fetches only the tracked branch
+            and fast-forwards, 'reset' fetches only the tracked branch and hard resets to it.
+        depth (int): Commits of history fetched in the 'ff-only' and 'reset' modes. 0 fetches the full history.
+        filter (str): Partial clone filter used in the 'ff-only' and 'reset' modes, such as 'blob:none'.
+        mirror_dir (str): Folder of the mirrors that checkouts of the same remote fetch through. Empty fetches
+            every checkout from origin.
+        auto_gc (bool): Whether git may collect garbage in the middle of an update. Turned off when
+            run_maintenance takes care of it.
     """
-    protocol, base_url = url.split('://')
-    if '@' in base_url:
-        base_url = base_url.split('@')[-1]
-    
-    return f"{protocol}://{token}@{base_url}"
+    mode: str = "pull"
+    depth: int = 0
+    filter: str = ""
+    mirror_dir: str = ""
+    auto_gc: bool = True
+
+    @property
+    def git_options(self) -> Dict[str, str]:
+        """Options of the git commands run while updating."""
+        return {} if self.auto_gc else NO_AUTO_GC
 
-def pull_repositories(access_token: str, directories: List[str]) -> List[str]:
+def get_repo_lock(directory: str) -> threading.Lock:
+    """Get the lock held while a repository is updated, maintained or deployed, so none of them overlap."""
+    return REPO_CACHE.get_lock(directory)
+
+@contextlib.asynccontextmanager
+async def hold_repo_lock(directory: str) -> AsyncIterator[None]:
     """
-    Perform a git pull on a list of directories using the provided personal access token.
+    Hold the lock of a repository for the duration of the block, waiting for an update in progress first.
+
+    Deploys hold it, so a pull never rewrites the working tree under a build. The lock
+    is taken in a thread, as a pull holds it from one. A deploy does not use the cached
+    handle, so checks of origin may share the lock with it, see get_origin_head_sha.
 
     Args:
+        directory (str): The repository directory.
+    """
+    lock = get_repo_lock(directory)
+    guard = threading.Lock()
+    state = {"acquired": False, "abandoned": False}
+
+    def acquire() -> None:
+        lock.acquire()
+        with guard:
+            if state["abandoned"]:
+                lock.release()
+            else:
+                state["acquired"] = True
+
+    try:
+        await asyncio.to_thread(acquire)
+    except BaseException:
+        # The thread may still take the lock once the update is over, and then gives it back itself
+        with guard:
+            state["abandoned"] = True
+            if state["acquired"]:
+                lock.release()
+        raise
+    with _deploy_holds_guard:
+        _deploy_holds[directory] = {"deploying": True, "checking": False}
+    try:
+        yield
+    finally:
+        with _deploy_holds_guard:
+            hold = _deploy_holds[directory]
+            hold["deploying"] = False
+            if not hold["checking"]:
+                del _deploy_holds[directory]
+                lock.release()
+
+@contextlib.contextmanager
+def _checking_origin(directory: str) -> Iterator[Repo]:
+    # Hold the repository lock, or share it with the deploy holding it, which keeps pulls out the same way
+    lock = get_repo_lock(directory)
+    while True:
+        with _deploy_holds_guard:
+            hold = _deploy_holds.get(directory)
+            if hold is not None and not hold["checking"]:
+                hold["checking"] = True
+                break
+        if lock.acquire(timeout=LOCK_POLL_INTERVAL):
+            hold = None
+            break
+    try:
+        yield REPO_CACHE.get(directory)
+    finally:
+        if hold is None:
+            lock.release()
+        else:
+            with _deploy_holds_guard:
+                hold["checking"] = False
+                if not hold["deploying"]:
+                    del _deploy_holds[directory]
+                    lock.release()
+
+@contextlib.contextmanager
+def _updating(directory: str) -> Iterator[None]:
+    # Hold the repository lock and remember the git files the update leaves behind, before anyone else may write them
+    with get_repo_lock(directory):
+        _updating_repos.add(directory)
+        try:
+            yield
+        finally:
+            _own_git_mtimes[directory] = get_git_file_mtimes(directory)
+            _updating_repos.discard(directory)
+
+def is_own_git_change(directory: str) -> bool:
+    """
+    Check whether the current HEAD and FETCH_HEAD of a repository were written by Syncatron itself.
+
+    They count as its own while the repository is being updated, and afterwards for as
+    long as their mtimes match what the last update left. Watchers use this so that the
+    fetches of a pull do not trigger another pull.
+
+    Args:
+        directory (str): The repository directory.
+
+    Returns:
+        bool: True if the repository is being updated or its git files are unchanged since the last update.
+    """
+    if directory in _updating_repos:
+        return True
+    mtimes = _own_git_mtimes.get(directory)
+    return mtimes is not None and mtimes == get_git_file_mtimes(directory)
+
+def remove_credentials_from_url(url: str) -> str:
+    """
+    Remove the user information, such as an access token, from an HTTP(S) remote URL.
+
+    Other URLs, such as local paths or SSH remotes, are returned unchanged.
+
+    Args:
+        url (str): The remote URL.
+
+    Returns:
+        str: The URL without user information.
+    """
+    if not url.startswith(('http://', 'https://')):
+        return url
+    protocol, base_url = url.split('://', 1)
+    host, slash, path = base_url.partition('/')
+    return f"{protocol}://{host.rpartition('@')[2]}{slash}{path}"
+
+def get_credential_environment(url: str, access_token: str) -> Dict[str, str]:
+    """
+    Get the environment that makes git send the access token to the host of a remote.
+
+    The token is handed to git through the environment of each git process, by a
+    credential helper that only answers for the host of the remote. Nothing is
+    written to the repository, and other credential helpers are switched off so none
+    of them stores the token on disk. Prompts are disabled, so a rejected token fails
+    the command instead of waiting for input.
+
+    Args:
+        url (str): The remote URL.
         access_token (str): Personal access token for authentication.
-        directories (List[str]): List of directory paths to perform git pull on.
-        repo_url_template (str): Template for the git URL, where {token} will be replaced by the access token.
 
     Returns:
-        List[str]: List of directories where there was an update.
+        Dict[str, str]: Environment variables for git, empty for remotes that are not HTTP(S).
+    """
+    if not url.startswith(('http://', 'https://')):
+        return {}
+    protocol, base_url = remove_credentials_from_url(url).split('://', 1)
+    host = base_url.partition('/')[0]
+    helper = f'!f() {{ test "$1" = get && echo username=x-access-token && echo "password=${TOKEN_VARIABLE}"; }}; f'
+    return {
+        'GIT_CONFIG_COUNT': '2',
+        'GIT_CONFIG_KEY_0': 'credential.helper',
+        'GIT_CONFIG_VALUE_0': '',
+        'GIT_CONFIG_KEY_1': f'credential.{protocol}://{host}.helper',
+        'GIT_CONFIG_VALUE_1': helper,
+        'GIT_TERMINAL_PROMPT': '0',
+        TOKEN_VARIABLE: access_token,
+    }
+
+def clean_remote_url(repo: Repo) -> None:
+    """
+    Remove an access token that older versions wrote into the origin URL of a repository.
+
+    The URL is only written when it holds credentials, so this happens once per repository.
+
+    Args:
+        repo (Repo): The repository to clean up.
+    """
+    origin = repo.remotes.origin
+    clean_url = remove_credentials_from_url(origin.url)
+    if clean_url != origin.url:
+        logger.info(f"Removing the stored access token from the origin URL of {repo.working_tree_dir}.")
+        origin.set_url(clean_url)
+
+def get_tracked_branch(repo: Repo) -> Optional[str]:
+    """
+    Get the name of the branch on origin that the checked out branch tracks.
+
+    Args:
+        repo (Repo): The repository to inspect.
+
+    Returns:
+        Optional[str]: The remote branch name, or None if HEAD is detached.
+    """
+    try:
+        branch = repo.active_branch
+    except TypeError:
+        return None
+
+    tracking_branch = branch.tracking_branch()
+    if tracking_branch is not None:
+        return tracking_branch.remote_head
+    return branch.name
+
+def get_remote_head_sha(repo: Repo, branch: str, timeout: Optional[int] = None) -> Optional[str]:
+    """
+    Get the SHA of a branch tip on origin with a single ls-remote, without fetching any objects.
+
+    Args:
+        repo (Repo): The repository whose origin is queried.
+        branch (str): The branch name on origin.
+        timeout (Optional[int]): Seconds after which the git process is killed. None waits forever.
+
+    Returns:
+        Optional[str]: The SHA of the branch tip, or None if origin has no such branch.
+    """
+    output = repo.git.ls_remote('origin', f'refs/heads/{branch}', kill_after_timeout=timeout)
+    for line in output.splitlines():
+        sha, _, ref = line.partition('\t')
+        if ref == f'refs/heads/{branch}':
+            return sha
+    return None
+
+def get_origin_head_sha(directory: str, access_token: str, timeout: Optional[int] = None) -> Optional[str]:
+    """
+    Get the SHA of the tip of the branch a repository tracks on origin, without touching the working tree.
+
+    The cached handle is used under the repository lock, so the check never overlaps a pull.
+    While a deploy holds the lock, the check shares it instead of waiting for the deploy.
+
+    Args:
+        directory (str): The repository directory.
+        access_token (str): Personal access token for authentication.
+        timeout (Optional[int]): Seconds after which the git process is killed. None waits forever.
+
+    Returns:
+        Optional[str]: The SHA of the remote tip, or None if HEAD is detached or origin cannot be queried.
+    """
+    try:
+        with _checking_origin(directory) as repo:
+            branch = get_tracked_branch(repo)
+            if branch is None:
+                return None
+            with repo.git.custom_environment(**get_credential_environment(repo.remotes.origin.url, access_token)):
+                return get_remote_head_sha(repo, branch, timeout)
+    except Exception as e:
+        logger.info(f"Could not query origin of {directory}: {e}")
+        return None
+
+def get_remote_change(repo: Repo, timeout: Optional[int] = None, state_store: Optional[StateStore] = None,
+                      directory: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    """
+    Check whether origin has commits for the tracked branch that HEAD does not point at.
+
+    Args:
+        repo (Repo): The repository to check.
+        timeout (Optional[int]): Seconds after which the git process is killed. None waits forever.
+        state_store (Optional[StateStore]): Store in which the remote tip SHA is recorded.
+        directory (Optional[str]): The directory the state is recorded under.
+
+    Returns:
+        Tuple[bool, Optional[str]]: True if the remote tip differs from HEAD, or if it cannot be
+        determined cheaply, and the SHA of the remote tip when it is known.
+    """
+    branch = get_tracked_branch(repo)
+    if branch is None:
+        # Detached HEAD, there is no tracked branch to compare against
+        return True, None
+
+    remote_sha = get_remote_head_sha(repo, branch, timeout)
+    if remote_sha is None:
+        logger.info(f"Branch '{branch}' not found on origin of {repo.working_tree_dir}.")
+        return False, None
+
+    if state_store is not None:
+        state_store.record_remote_sha(directory, remote_sha)
+    return remote_sha != repo.head.commit.hexsha, remote_sha
+
+def has_remote_changes(repo: Repo, timeout: Optional[int] = None, state_store: Optional[StateStore] = None,
+                       directory: Optional[str] = None) -> bool:
+    """
+    Check whether origin has commits for the tracked branch that HEAD does not point at.
+
+    Returns:
+        bool: True if the remote tip differs from HEAD, or if it cannot be determined cheaply.
+    """
+    return get_remote_change(repo, timeout, state_store, directory)[0]
+
+def fetch_tracked_branch(repo: Repo, branch: str, options: UpdateOptions, timeout: Optional[int] = None,
+                         source: str = 'origin') -> str:
+    """
+    Fetch only the tracked branch from origin, without tags and within the depth and filter of the options.
+
+    Args:
+        repo (Repo): The repository to fetch into.
+        branch (str): The branch name on origin.
+        options (UpdateOptions): The depth and filter of the fetch.
+        timeout (Optional[int]): Seconds after which the git process is killed. None waits forever.
+        source (str): Where the branch is fetched from, origin or the path of a mirror of it.
+
+    Returns:
+        str: The remote-tracking ref the branch was fetched into.
+    """
+    tracking_ref = f'refs/remotes/origin/{branch}'
+    args = ['--no-tags']
+    if options.depth:
+        args.append(f'--depth={options.depth}')
+    if options.filter:
+        args.append(f'--filter={options.filter}')
+    repo.git(**options.git_options).fetch(*args, source, f'+refs/heads/{branch}:{tracking_ref}',
+                                         kill_after_timeout=timeout)
+    return tracking_ref
+
+def update_to_tracked_branch(repo: Repo, branch: str, options: UpdateOptions, timeout: Optional[int] = None,
+                             mirror_path: Optional[str] = None) -> None:
+    """
+    Fetch the tracked branch and move the checkout to its tip.
+
+    Deployment checkouts hold no commits of their own, so the 'ff-only' mode refuses
+    to merge anything that is not a fast-forward, and the 'reset' mode discards local
+    changes. A shallow fetch only fast-forwards when the commits pushed since the last
+    update fit within the depth, so a depth is best combined with 'reset'.
+
+    With a mirror, the branch is fetched from the mirror, whose objects the checkout
+    borrows, so no objects are copied and the depth and filter do not apply.
+
+    Args:
+        repo (Repo): The repository to update.
+        branch (str): The branch name on origin.
+        options (UpdateOptions): The update mode, depth and filter.
+        timeout (Optional[int]): Seconds after which each git process is killed. None waits forever.
+        mirror_path (Optional[str]): The mirror of origin to fetch from. None fetches from origin.
 
     Raises:
-        ValueError: If a directory is invalid or git operation fails.
+        GitCommandError: If the fetch fails, or the update is not a fast-forward in 'ff-only' mode.
     """
-    updated_directories = []
+    if mirror_path is None:
+        tracking_ref = fetch_tracked_branch(repo, branch, options, timeout)
+    else:
+        tracking_ref = fetch_tracked_branch(repo, branch, UpdateOptions(auto_gc=options.auto_gc), timeout,
+                                            source=mirror_path)
+    if options.mode == "reset":
+        repo.git(**options.git_options).reset('--hard', tracking_ref, kill_after_timeout=timeout)
+    elif options.mode == "ff-only":
+        repo.git(**options.git_options).merge('--ff-only', tracking_ref, kill_after_timeout=timeout)
+    else:
+        repo.git(**options.git_options).merge('--no-edit', tracking_ref, kill_after_timeout=timeout)
 
-    for directory in directories:
-        try:
-            # Get the repo and its origin URL
-            repo = Repo(directory)
+def run_maintenance(directory: str, timeout: Optional[int] = None) -> bool:
+    """
+    Run git's housekeeping on a repository, such as repacking and pruning unreachable objects.
+
+    Only the tasks whose thresholds are exceeded do any work. A repository that is being
+    updated is skipped and picked up again by the next run.
+
+    Args:
+        directory (str): The repository directory.
+        timeout (Optional[int]): Seconds after which the git process is killed. None waits forever.
+
+    Returns:
+        bool: True if the maintenance ran, False if it was skipped or failed.
+    """
+    lock = get_repo_lock(directory)
+    if not lock.acquire(blocking=False):
+        logger.info(f"Skipping maintenance of {directory}, it is being updated.")
+        return False
+    try:
+        with span("maintenance", "git", repo=directory):
+            REPO_CACHE.get(directory).git.maintenance('run', '--auto', kill_after_timeout=timeout)
+        return True
+    except Exception as e:
+        logger.info(f"Maintenance of {directory} failed: {e}")
+        return False
+    finally:
+        lock.release()
+
+def reconcile_local_head(state_store: StateStore, directory: str, head_sha: str) -> bool:
+    """
+    Compare HEAD against the deployed commit recorded for a repository that was not updated by a pull.
+
+    A repository seen for the first time has its current HEAD recorded as deployed. A
+    deployed repository whose HEAD was moved by another tool gets a pending deploy.
+
+    Args:
+        state_store (StateStore): Store holding the deploy state.
+        directory (str): The repository directory.
+        head_sha (str): The SHA HEAD points at.
+
+    Returns:
+        bool: True if HEAD moved away from the deployed commit and a deploy is now pending.
+    """
+    state = state_store.get(directory)
+    if state is None or (state.deployed_sha is None and state.deploy_status is None):
+        state_store.mark_deployed(directory, head_sha, None, None)
+        return False
+
+    if state.deploy_status == STATUS_DEPLOYED and state.deployed_sha != head_sha:
+        logger.info(f"HEAD of {directory} moved to {head_sha} outside of Syncatron.")
+        state_store.mark_pending(directory, head_sha)
+        return True
+    return False
+
+def pull_repository(access_token: str, directory: str, timeout: Optional[int] = None,
+                    state_store: Optional[StateStore] = None, options: Optional[UpdateOptions] = None) -> bool:
+    """
+    Perform a git pull on a single directory using the provided personal access token.
+
+    The remote tip of the tracked branch is compared against HEAD first, and the
+    repository is only updated when they differ. How it is updated depends on the
+    mode of the options, see UpdateOptions.
+
+    Args:
+        access_token (str): Personal access token for authentication.
+        directory (str): Directory path to perform git pull on.
+        timeout (Optional[int]): Seconds after which each git process is killed. None waits forever.
+        state_store (Optional[StateStore]): Store in which remote SHAs and pending deploys are recorded.
+        options (Optional[UpdateOptions]): How the repository is updated. None pulls.
+
+    Returns:
+        bool: True if the pull moved HEAD to new commits, False otherwise or on error.
+    """
+    options = options or UpdateOptions()
+    outcome = "error"
+    started = time.monotonic()
+    try:
+        with _updating(directory):
+            # Get the repo and hand the personal access token to the git processes of its origin
+            repo = REPO_CACHE.get(directory)
             origin = repo.remotes.origin
-            
-            # Construct the new remote URL with the personal access token
-            new_origin_url = add_token_to_remote_url(token=access_token, url=origin.url)
-            origin.set_url(new_origin_url)
-            # Perform the git pull
-            result = origin.pull()
-            
-            # Check if there were updates based on new_count
+            clean_remote_url(repo)
+            credentials = get_credential_environment(origin.url, access_token)
+
             updates_detected = False
-            for fetch_info in result:
-                if fetch_info.flags > 4:  # Check if there are new commits
-                    updated_directories.append(directory)
-                    updates_detected = True
-                    break  # We found an update, no need to check further
-                
+            with repo.git.custom_environment(**credentials):
+                with span("ls-remote", "git", repo=directory):
+                    remote_changed, remote_sha = get_remote_change(repo, timeout, state_store, directory)
+                if remote_changed:
+                    # Update the checkout and check whether it moved HEAD
+                    previous_head = repo.head.commit.hexsha
+                    branch = get_tracked_branch(repo)
+                    if options.mirror_dir and branch is not None:
+                        mirror_path = update_mirror(options.mirror_dir, remove_credentials_from_url(origin.url),
+                                                    remote_sha, credentials, timeout, options.auto_gc)
+                        attach_mirror(repo, mirror_path, timeout)
+                        with span("fetch", "git", repo=directory, mode=options.mode, mirror=mirror_path):
+                            update_to_tracked_branch(repo, branch, options, timeout, mirror_path)
+                    elif options.mode != "pull" and branch is not None:
+                        with span("fetch", "git", repo=directory, mode=options.mode):
+                            update_to_tracked_branch(repo, branch, options, timeout)
+                    else:
+                        with span("pull", "git", repo=directory):
+                            origin.pull(kill_after_timeout=timeout)
+                    updates_detected = repo.head.commit.hexsha != previous_head
+
             if updates_detected:
                 logger.info(f"Updates detected in {directory}.")
+                if state_store is not None:
+                    state_store.mark_pending(directory, repo.head.commit.hexsha)
+            elif state_store is not None and reconcile_local_head(state_store, directory, repo.head.commit.hexsha):
+                updates_detected = True
             else:
                 logger.info(f"No updates detected in {directory}.")
-            
-        except GitCommandError as e:
-            logger.info(f"Git command error in {directory}: {e}")
-        except Exception as e:
-            logger.info(f"Error in {directory}: {e}")
+            outcome = "updated" if updates_detected else "unchanged"
+            return updates_detected
+        
+    except GitCommandError as e:
+        logger.info(f"Git command error in {directory}: {e}")
+    except Exception as e:
+        logger.info(f"Error in {directory}: {e}")
+    finally:
+        FETCH_DURATION.observe(time.monotonic() - started, repo=directory)
+        claim = _outcome_claim.get()
+        if claim is None or claim.acquire(blocking=False):
+            PULLS.inc(repo=directory, outcome=outcome)
+    return False
+
+def get_changed_files(directory: str, old_sha: str, new_sha: str) -> List[str]:
+    """
+    List the files that differ between two commits of a repository.
+
+    Args:
+        directory (str): The repository directory.
+        old_sha (str): The older commit.
+        new_sha (str): The newer commit.
+
+    Returns:
+        List[str]: Absolute paths of the added, modified, renamed and deleted files.
+
+    Raises:
+        GitCommandError: If either commit is unknown to the repository.
+    """
+    repo = Repo(directory)
+    output = repo.git.diff('--name-only', '--no-renames', old_sha, new_sha)
+    return [os.path.join(repo.working_tree_dir, name) for name in output.splitlines() if name]
+
+def pull_repositories(access_token: str, directories: List[str],
+                      state_store: Optional[StateStore] = None, options: Optional[UpdateOptions] = None) -> List[str]:
+    """
+    Perform a git pull on a list of directories, one after another, using the provided personal access token.
+
+    Args:
+        access_token (str): Personal access token for authentication.
+        directories (List[str]): List of directory paths to perform git pull on.
+        state_store (Optional[StateStore]): Store in which remote SHAs and pending deploys are recorded.
+        options (Optional[UpdateOptions]): How the repositories are updated. None pulls.
+
+    Returns:
+        List[str]: List of directories where there was an update.
+    """
+    return [directory for directory in directories
+            if pull_repository(access_token, directory, state_store=state_store, options=options)]
+
+async def pull_repositories_concurrently(access_token: str, directories: List[str], max_workers: int = 8,
+                                         timeout: Optional[int] = None,
+                                         state_store: Optional[StateStore] = None,
+                                         options: Optional[UpdateOptions] = None) -> AsyncIterator[Tuple[str, bool]]:
+    """
+    Pull a list of directories concurrently and yield each result as soon as it finishes.
+
+    At most max_workers pulls run at once. A pull that exceeds the timeout is
+    reported as not updated, so one hanging remote cannot hold up the others.
+
+    Args:
+        access_token (str): Personal access token for authentication.
+        directories (List[str]): List of directory paths to perform git pull on.
+        max_workers (int): Maximum number of pulls running at the same time.
+        timeout (Optional[int]): Seconds a single pull may take. None waits forever.
+        state_store (Optional[StateStore]): Store in which remote SHAs and pending deploys are recorded.
+        options (Optional[UpdateOptions]): How the repositories are updated. None pulls.
+
+    Yields:
+        Tuple[str, bool]: The directory and whether the pull brought in new commits, in completion order.
+    """
+    if not directories:
+        return
+
+    loop = asyncio.get_running_loop()
+    # Pulls that timed out keep their thread until git gives up, so there are threads to spare for them
+    executor = ThreadPoolExecutor(max_workers=max_workers * 2, thread_name_prefix="git-pull")
+    slots = asyncio.Semaphore(max_workers)
+    # Counts the threads that are busy, including those of abandoned pulls, so the timeout of a
+    # pull only starts counting once a thread is free to pick it up
+    threads = asyncio.Semaphore(max_workers * 2)
+    wait_limit = timeout + TIMEOUT_GRACE_SECONDS if timeout else None
+
+    async def pull_one(directory: str) -> Tuple[str, bool]:
+        with log_context(repo=directory, phase="pull"):
+            async with slots:
+                await threads.acquire()
+                claim = threading.Lock()
+                # Run the pull in a copy of this task's context, so it is profiled and logged with its cycle
+                context = contextvars.copy_context()
+                context.run(_outcome_claim.set, claim)
+                future = loop.run_in_executor(executor, context.run, pull_repository, access_token,
+                                              directory, timeout, state_store, options)
+                future.add_done_callback(lambda _: threads.release())
+                PULLS_RUNNING.inc()
+                try:
+                    return directory, await asyncio.wait_for(asyncio.shield(future), wait_limit)
+                except asyncio.TimeoutError:
+                    logger.info(f"Timed out pulling {directory} after {timeout} seconds.")
+                    if claim.acquire(blocking=False):
+                        PULLS.inc(repo=directory, outcome="timeout")
+                    return directory, False
+                finally:
+                    PULLS_RUNNING.dec()
 
-    return updated_directories
\ No newline at end of file
+    tasks = [asyncio.ensure_future(pull_one(directory)) for directory in directories]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
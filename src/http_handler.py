@@ -0,0 +1,234 @@
+import os
+import json
+import hmac
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Requests larger than this are rejected before the body is read
+MAX_BODY_BYTES = 1024 * 1024
+# Seconds a client gets to send a complete request
+REQUEST_TIMEOUT = 10
+
+@dataclass
+class HttpRequest:
+    """A parsed HTTP request."""
+    method: str
+    path: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+@dataclass
+class HttpResponse:
+    """An HTTP response to send back."""
+    status: int
+    body: bytes = b""
+    content_type: str = "application/json"
+
+RouteHandler = Callable[[HttpRequest], Union[HttpResponse, Awaitable[HttpResponse]]]
+
+def json_response(status: int, payload: dict) -> HttpResponse:
+    """
+    Build a JSON response.
+
+    Args:
+        status (int): The HTTP status code.
+        payload (dict): The object to serialise as the body.
+
+    Returns:
+        HttpResponse: The response.
+    """
+    return HttpResponse(status, json.dumps(payload).encode("utf-8"))
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+    """
+    Read a single HTTP/1.x request from a stream.
+
+    Args:
+        reader (asyncio.StreamReader): The client stream.
+
+    Returns:
+        Optional[HttpRequest]: The request, or None if the client closed the connection first.
+
+    Raises:
+        ValueError: If the request is malformed or its body is too large.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, path, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", "0") or 0)
+    if length < 0 or length > MAX_BODY_BYTES:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return HttpRequest(method.upper(), path.split("?", 1)[0], headers, body)
+
+async def write_response(writer: asyncio.StreamWriter, response: HttpResponse) -> None:
+    """
+    Write a response and close the connection.
+
+    Args:
+        writer (asyncio.StreamWriter): The client stream.
+        response (HttpResponse): The response to send.
+    """
+    reason = HTTPStatus(response.status).phrase
+    head = (f"HTTP/1.1 {response.status} {reason}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            "Connection: close\r\n\r\n")
+    writer.write(head.encode("latin-1") + response.body)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def start_http_server(host: str, port: int, routes: Dict[Tuple[str, str], RouteHandler]) -> asyncio.AbstractServer:
+    """
+    Start a minimal HTTP server that answers one request per connection.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 picks a free one.
+        routes (Dict[Tuple[str, str], RouteHandler]): Handlers keyed by method and path.
+
+    Returns:
+        asyncio.AbstractServer: The running server.
+    """
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(read_request(reader), REQUEST_TIMEOUT)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            await write_response(writer, json_response(400, {"error": str(e) or "Bad request"}))
+            return
+        if request is None:
+            writer.close()
+            return
+
+        handler = routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in routes)
+            status = 405 if known_path else 404
+            await write_response(writer, json_response(status, {"error": HTTPStatus(status).phrase}))
+            return
+
+        try:
+            response = handler(request)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception:
+            logger.exception(f"Error handling {request.method} {request.path}")
+            response = json_response(500, {"error": "Internal server error"})
+        await write_response(writer, response)
+
+    server = await asyncio.start_server(handle_connection, host, port)
+    logger.info(f"Listening for HTTP requests on {host}:{server.sockets[0].getsockname()[1]}")
+    return server
+
+def make_metrics_handler(render: Callable[[], str]) -> RouteHandler:
+    """
+    Build the handler that serves metrics in the Prometheus text format.
+
+    Args:
+        render (Callable[[], str]): Returns the current metrics.
+
+    Returns:
+        RouteHandler: The handler.
+    """
+    def handle_metrics(request: HttpRequest) -> HttpResponse:
+        return HttpResponse(200, render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+
+    return handle_metrics
+
+def get_repository_name(payload: dict) -> Optional[str]:
+    """
+    Get the repository named in a push notification.
+
+    The generic format is {"repository": "<name>"}. The nested repository and project
+    objects sent by GitHub, Gitea and GitLab push webhooks are understood as well.
+
+    Args:
+        payload (dict): The decoded JSON body.
+
+    Returns:
+        Optional[str]: The repository name, or None if the payload names none.
+    """
+    for key in ("repository", "project"):
+        value = payload.get(key)
+        if isinstance(value, str) and value:
+            return value
+        if isinstance(value, dict):
+            for name_key in ("name", "path"):
+                if isinstance(value.get(name_key), str) and value[name_key]:
+                    return value[name_key]
+    return None
+
+def match_repository(name: str, repos: list) -> Optional[str]:
+    """
+    Find the repository directory a notification refers to.
+
+    Args:
+        name (str): A directory name, a path relative to the project folder, or a full path.
+        repos (list): The known repository directories.
+
+    Returns:
+        Optional[str]: The matching repository directory, or None.
+    """
+    name = name.rstrip("/")
+    for repo in repos:
+        if repo == name or repo.endswith(os.sep + name) or os.path.basename(repo) == name:
+            return repo
+    return None
+
+def make_webhook_handler(get_repos: Callable[[], list], trigger: Callable[[str], None],
+                         secret: str = "") -> RouteHandler:
+    """
+    Build the handler for push notifications.
+
+    Args:
+        get_repos (Callable[[], list]): Returns the known repository directories.
+        trigger (Callable[[str], None]): Queues a sync of a repository directory.
+        secret (str): Token expected in the X-Syncatron-Token header. Empty accepts every request.
+
+    Returns:
+        RouteHandler: The handler.
+    """
+    def handle_webhook(request: HttpRequest) -> HttpResponse:
+        if secret and not hmac.compare_digest(request.headers.get("x-syncatron-token", ""), secret):
+            return json_response(401, {"error": "Invalid token"})
+
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return json_response(400, {"error": "Body is not valid JSON"})
+
+        name = get_repository_name(payload) if isinstance(payload, dict) else None
+        if name is None:
+            return json_response(400, {"error": "No repository named"})
+
+        repo = match_repository(name, get_repos())
+        if repo is None:
+            logger.info(f"Push notification for unknown repository '{name}'.")
+            return json_response(404, {"error": f"Unknown repository: {name}"})
+
+        logger.info(f"Push notification received for {repo}.")
+        trigger(repo)
+        return json_response(202, {"queued": repo})
+
+    return handle_webhook
@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+import functools
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from src.docker_engine import (ROLLBACK_TAG, DockerException, get_docker_root, prune_build_cache, prune_images,
+                               prune_tagged_images)
+from src.metrics import DOCKER_DISK_USAGE, IMAGE_GC_DURATION, IMAGE_GC_RECLAIMED
+from src.profiler import span
+
+logger = logging.getLogger(__name__)
+
+# Percent of the disk under the Docker root above which unused images are collected even while builds run
+DEFAULT_WATERMARK = 85
+# Hours images and build cache are kept after they were created, so the next builds find their layers
+DEFAULT_KEEP_HOURS = 24
+# Seconds a collection may take before its remaining stages are skipped
+DEFAULT_BUDGET = 60
+
+def read_disk_usage(path: str) -> Optional[float]:
+    """
+    Read how full the filesystem holding a path is.
+
+    Args:
+        path (str): A path on the filesystem.
+
+    Returns:
+        Optional[float]: The percent of the filesystem in use, None if it cannot be read.
+    """
+    try:
+        stats = os.statvfs(path)
+    except OSError:
+        return None
+    if not stats.f_blocks:
+        return None
+    return 100.0 * (1 - stats.f_bavail / stats.f_blocks)
+
+class ImageCollector:
+    """
+    Removes unused images and build cache at most once per cycle, instead of after every deploy.
+
+    A collection runs at the end of a cycle in which builds finished, once no build is
+    running, so it never removes layers a build is about to use. When the disk under the
+    Docker root is fuller than the watermark, it runs regardless and also removes unused
+    tagged images, except the ones kept for rollbacks. Images and build cache younger than keep_hours are always kept, so the
+    layer cache stays warm. Stages that do not fit in the time budget are left for the
+    next collection.
+    """
+
+    def __init__(self, watermark: float = DEFAULT_WATERMARK, keep_hours: int = DEFAULT_KEEP_HOURS,
+                 budget: float = DEFAULT_BUDGET, read_usage: Callable[[str], Optional[float]] = read_disk_usage):
+        """
+        Args:
+            watermark (float): Percent of disk usage above which a collection is forced.
+            keep_hours (int): Hours images and build cache are kept after they were created. 0 keeps none.
+            budget (float): Seconds a collection may take.
+            read_usage (Callable[[str], Optional[float]]): Reads the percent of a filesystem in use.
+        """
+        self.watermark = watermark
+        self.keep_hours = keep_hours
+        self.budget = budget
+        self.read_usage = read_usage
+        self.builds_running = 0
+        self.builds_finished = 0
+        self._docker_root: Optional[str] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def configure(self, watermark: float, keep_hours: int, budget: float) -> None:
+        """Change the watermark, keep-recent policy and time budget."""
+        self.watermark = watermark
+        self.keep_hours = keep_hours
+        self.budget = budget
+
+    @contextlib.contextmanager
+    def building(self) -> Iterator[None]:
+        """Mark a build as running for the duration of the block."""
+        self.builds_running += 1
+        try:
+            yield
+        finally:
+            self.builds_running -= 1
+            self.builds_finished += 1
+
+    def get_disk_usage(self) -> Optional[float]:
+        """
+        Get how full the disk under the Docker root is.
+
+        Returns:
+            Optional[float]: The percent in use, None if the Docker root is not reachable from here.
+        """
+        if self._docker_root is None:
+            try:
+                self._docker_root = get_docker_root()
+            except DockerException as e:
+                logger.debug(f"Could not look up the Docker root: {e}")
+                return None
+        usage = self.read_usage(self._docker_root)
+        if usage is not None:
+            DOCKER_DISK_USAGE.set(usage)
+        return usage
+
+    def get_stages(self, pressure: bool) -> List[Tuple[str, Callable[[Dict[str, object]], Dict[str, object]],
+                                                       Dict[str, object]]]:
+        """
+        Get the prunes a collection runs, in order.
+
+        Args:
+            pressure (bool): Whether the disk is fuller than the watermark.
+
+        Returns:
+            List[Tuple[str, Callable, Dict[str, object]]]: The name, prune function and filters of each stage.
+        """
+        keep = {"until": f"{self.keep_hours}h"} if self.keep_hours else {}
+        stages = [("images", prune_images, {"dangling": True, **keep})]
+        if pressure:
+            # Unused tagged images are only removed when the disk runs full, and never the ones a
+            # deploy may still roll back to, which the engine's prune cannot leave out
+            stages.append(("tagged_images", functools.partial(prune_tagged_images, keep_tag=ROLLBACK_TAG), keep))
+        stages.append(("build_cache", prune_build_cache, keep))
+        return stages
+
+    async def collect_if_needed(self) -> bool:
+        """
+        Collect unused images when builds finished and none is running, or the disk is too full.
+
+        Returns:
+            bool: True if a collection ran.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return False
+
+        async with self._lock:
+            usage = await asyncio.to_thread(self.get_disk_usage)
+            pressure = usage is not None and usage >= self.watermark
+            if pressure:
+                logger.info(f"Disk under the Docker root is {usage:.0f}% full. Collecting unused images.")
+            elif not self.builds_finished or self.builds_running:
+                return False
+
+            await self.collect(pressure)
+            return True
+
+    async def collect(self, pressure: bool = False) -> int:
+        """
+        Run the prune stages within the time budget.
+
+        Args:
+            pressure (bool): Whether the disk is fuller than the watermark.
+
+        Returns:
+            int: The bytes reclaimed.
+        """
+        self.builds_finished = 0
+        deadline = time.monotonic() + self.budget
+        reclaimed = 0
+        with span("image-gc", "docker", pressure=pressure):
+            for name, prune, filters in self.get_stages(pressure):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.info(f"Image collection ran out of its {self.budget}s budget. Skipping {name}.")
+                    break
+                started = time.monotonic()
+                try:
+                    result = await asyncio.wait_for(asyncio.to_thread(prune, filters), remaining)
+                except asyncio.TimeoutError:
+                    # The engine finishes the prune on its own, the next stages wait for the next collection
+                    logger.warning(f"Pruning {name} did not finish within the {self.budget}s budget.")
+                    break
+                except DockerException as e:
+                    logger.error(f"Failed to prune {name}: {e}")
+                    continue
+                finally:
+                    IMAGE_GC_DURATION.observe(time.monotonic() - started, stage=name)
+                space = int(result.get("SpaceReclaimed") or 0)
+                IMAGE_GC_RECLAIMED.inc(space, stage=name)
+                reclaimed += space
+        logger.info(f"Image collection reclaimed {reclaimed} bytes.")
+        return reclaimed
+
+IMAGE_GC = ImageCollector()
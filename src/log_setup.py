@@ -0,0 +1,183 @@
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+import contextlib
+import contextvars
+import logging.handlers
+from typing import Dict, Iterator, Optional, Tuple
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Fields taken from the log context and attached to every record
+CONTEXT_FIELDS = ("repo", "phase", "cycle_id")
+# Seconds over which the records of a single call site are counted for the rate limit
+RATE_WINDOW = 60
+
+# The repository, phase and cycle the current task or thread works on
+_log_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("log_context", default={})
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+def new_cycle_id() -> str:
+    """Get a short random id that tells the records of one cycle apart from the others."""
+    return uuid.uuid4().hex[:8]
+
+@contextlib.contextmanager
+def log_context(**fields: Optional[str]) -> Iterator[None]:
+    """
+    Attach fields such as repo, phase or cycle_id to the records logged in the block.
+
+    The fields carry over to the tasks and threads started with a copy of the context,
+    and fields set further out are kept unless the block sets them again.
+
+    Args:
+        **fields (Optional[str]): The fields to set. None leaves a field out.
+    """
+    token = _log_context.set({**_log_context.get(), **{key: value for key, value in fields.items()
+                                                        if value is not None}})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+class ContextFilter(logging.Filter):
+    """Copies the log context onto each record, in the thread that logs it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        for name in CONTEXT_FIELDS:
+            if not hasattr(record, name):
+                setattr(record, name, context.get(name))
+        return True
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits how often a single call site logs, so a message repeated for every repository does not flood the log.
+
+    Each call site may log rate_limit records per minute. Beyond that, one record in
+    sample is kept and the others are dropped, and the next record that is kept says
+    how many were dropped. Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rate_limit: int, sample: int = 0, clock=time.monotonic):
+        """
+        Args:
+            rate_limit (int): Records a call site may log per minute before sampling starts. 0 does not limit.
+            sample (int): Keep one in this many of the records over the limit. 0 drops them all.
+            clock: Returns the current time in seconds.
+        """
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.sample = sample
+        self.clock = clock
+        self._sites: Dict[Tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rate_limit or record.levelno >= logging.WARNING:
+            return True
+
+        now = self.clock()
+        with self._lock:
+            # Window start, records in the window, records dropped since the last one kept
+            site = self._sites.setdefault((record.pathname, record.lineno), [now, 0, 0])
+            if now - site[0] >= RATE_WINDOW:
+                site[0], site[1] = now, 0
+            site[1] += 1
+            over = site[1] - self.rate_limit
+            if over > 0 and not (self.sample and over % self.sample == 0):
+                site[2] += 1
+                return False
+            dropped, site[2] = site[2], 0
+
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar messages dropped)"
+            record.args = None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single JSON line, with the log context fields that are set."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with their context fields and exception text, but leaves the formatting to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message is merged with its arguments here, as those may change once the record is queued
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(log_format: str = "text", level: int = logging.INFO, rate_limit: int = 0,
+                  sample: int = 0) -> Optional[logging.handlers.QueueListener]:
+    """
+    Send every log record through a queue, so the event loop and worker threads never wait on log output.
+
+    A listener thread takes the records off the queue and writes them to stderr. Like
+    logging.basicConfig, nothing is changed when the root logger already has handlers.
+
+    Args:
+        log_format (str): 'text' for plain lines, 'json' for a JSON object per line with the context fields.
+        level (int): The lowest level logged.
+        rate_limit (int): Records a single call site may log per minute before sampling starts. 0 does not limit.
+        sample (int): Keep one in this many of the records over the rate limit. 0 drops them all.
+
+    Returns:
+        Optional[logging.handlers.QueueListener]: The started listener, None if logging was configured already.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    global _listener, _queue_handler
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _queue_handler = ContextQueueHandler(records)
+    _queue_handler.addFilter(ContextFilter())
+    if rate_limit:
+        _queue_handler.addFilter(RateLimitFilter(rate_limit, sample))
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging() -> None:
+    """Write out the queued records and remove the handler setup_logging installed."""
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
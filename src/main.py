@@ -1,49 +1,383 @@
 import asyncio
 import logging
-from typing import List, Optional
-from src.get_env import load_environment_variables
+from typing import Callable, Dict, List, Optional, Tuple
+from src.get_env import (Settings, get_environment_variable, get_optional_non_negative_integer,
+                         load_environment_variables, load_settings)
 from src.filesystem_handler import scan_for_git_repos
-from src.git_handler import pull_repositories
-from src.docker_handler import handle_docker_operations
+from src.git_handler import (UpdateOptions, get_origin_head_sha, hold_repo_lock, is_own_git_change,
+                             pull_repositories_concurrently, run_maintenance)
+from src.docker_handler import DeployReport, handle_docker_operations, should_build_without_cache
+from src.deploy_planner import plan_deploy
+from src.docker_engine import close_client
+from src.deploy_executor import DeployExecutor
+from src.deploy_queue import DeployQueue
+from src.deploy_graph import build_graph, get_dependencies, get_deploy_levels
+from src.deploy_status import format_status, get_status
+from src.build_history import PHASE_DEPLOY
+from src.poll_scheduler import PollScheduler
+from src.repo_config import load_repo_config
+from src.repo_cache import REPO_CACHE
+from src.image_gc import IMAGE_GC
+from src.mirror_cache import list_mirrors
+from src.profiler import cycle as profiled_cycle, enable_profiling, span
+from src.log_setup import log_context, new_cycle_id, setup_logging, stop_logging
+from src.state_store import StateStore, get_default_state_path
+from src.watch_handler import RepoWatcher
+from src.http_handler import RouteHandler, make_metrics_handler, make_webhook_handler, start_http_server
+from src.metrics import (CYCLE_DURATION, CYCLE_OVERRUNS, REGISTRY, RUN_FREQUENCY, SCAN_DURATION, Timer,
+                         monitor_event_loop_lag)
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def create_deploy_queue(settings: Settings, state_store: Optional[StateStore] = None,
+                        on_deferred: Optional[Callable[[str], None]] = None) -> DeployQueue:
+    """Create the queue that runs deploys concurrently within the limits of the settings."""
+    executor = DeployExecutor(settings.deploy_workers, settings.deploy_memory_mb * 1024 * 1024,
+                              shortest_first=settings.deploy_order == "shortest")
+    estimate = (lambda repo: get_expected_duration(repo, state_store)) if state_store is not None else None
+    return DeployQueue(lambda repo, revision: deploy_repository(repo, revision, settings, state_store),
+                       executor, settings.deploy_debounce, on_deferred, get_dependencies, estimate)
 
-async def log_scheduled_task(run_frequency: int, project_folder: str, access_key: str) -> None:
-    """Logs the scheduled task execution."""
-    logging.info(f"Scanning project folder '{project_folder}' for git repositories.")
-    found_repos = scan_for_git_repos(project_folder)
+def get_expected_duration(repo: str, state_store: StateStore) -> Optional[float]:
+    """Get the seconds a deploy of a repository is expected to take from its history, None if it has none."""
+    history = state_store.get_durations(repo).get(PHASE_DEPLOY)
+    return history.ewma if history is not None else None
 
-    logging.info(f"Found {len(found_repos)} git repositories. Trying updates")
-    updated_repos = await asyncio.to_thread(pull_repositories, access_key, found_repos)
+def show_status(project_folder: Optional[str] = None) -> str:
+    """
+    Describe the deploy state of every repository, with the expected deploy durations and ETAs.
+
+    Reads the state database a running instance writes, so it works from a second process.
+    Only the settings it needs are read, so it neither needs the access key nor fails on
+    settings of the running instance that do not concern it.
+    """
+    state_path = get_environment_variable('STATE_PATH')
+    if not state_path:
+        project_folder = project_folder or get_environment_variable('PROJECT_FOLDER')
+        if not project_folder:
+            raise EnvironmentError("STATE_PATH or PROJECT_FOLDER must be set.")
+        state_path = get_default_state_path(project_folder)
+    deploy_workers = get_optional_non_negative_integer('DEPLOY_WORKERS', Settings().deploy_workers)
+    state_store = StateStore(state_path)
+    try:
+        workers = DeployExecutor(deploy_workers).max_workers
+        return format_status(get_status(state_store, workers))
+    finally:
+        state_store.close()
+
+async def deploy_repository(repo: str, revision: Optional[str], settings: Settings,
+                            state_store: Optional[StateStore] = None) -> DeployReport:
+    """Plan and run the deploy of a single repository, while no pull may change its working tree."""
+    with span("deploy", "deploy", repo=repo, revision=revision), log_context(repo=repo, phase="deploy"):
+        # A pull that was queued before the deploy started may still be running, the lock waits for it
+        async with hold_repo_lock(repo):
+            plan = None
+            if state_store is not None:
+                state = state_store.get(repo)
+                with span("plan", "deploy", repo=repo):
+                    plan = await plan_deploy(repo, state.deployed_sha if state else None, revision)
+            no_cache = should_build_without_cache(repo, state_store, settings.no_cache_interval)
+            return await handle_docker_operations(repo, state_store, revision, plan, settings.deploy_mode,
+                                                  no_cache, settings.docker_timeout, settings.health_timeout)
+
+def get_http_routes(settings: Settings, webhook: RouteHandler,
+                    metrics: RouteHandler) -> Dict[Tuple[str, int], Dict[Tuple[str, str], RouteHandler]]:
+    """
+    Group the HTTP routes by the address they are served on.
+
+    The webhook port serves push notifications and metrics, the metrics port only metrics,
+    so metrics can be scraped without exposing the webhook.
+    """
+    servers = {}
+    if settings.webhook_port:
+        servers[(settings.webhook_host, settings.webhook_port)] = {("POST", "/webhook"): webhook,
+                                                                   ("GET", "/metrics"): metrics}
+    if settings.metrics_port:
+        servers.setdefault((settings.metrics_host, settings.metrics_port), {})[("GET", "/metrics")] = metrics
+    return servers
+
+async def skip_deploying_repositories(repos: List[str], access_key: str, settings: Settings,
+                                     queue: DeployQueue) -> List[str]:
+    """
+    Leave out repositories that are being deployed, so their working tree does not change under the build.
+
+    With cancel_superseded set, a deploy whose revision is no longer the tip on origin is
+    cancelled instead and the repository is pulled right away. Skipped repositories are
+    synced again once their deploy is over.
+    """
+    pullable = []
+    for repo in repos:
+        if queue.is_deploying(repo) and settings.cancel_superseded:
+            remote_sha = await asyncio.to_thread(get_origin_head_sha, repo, access_key, settings.pull_timeout)
+            revision = queue.deploying_revision(repo)
+            if remote_sha is not None and revision is not None and remote_sha != revision:
+                await queue.cancel(repo)
+
+        if queue.is_deploying(repo):
+            logging.info(f"Deploy of {repo} is in progress. Syncing it once the deploy is over.")
+            queue.defer(repo)
+        else:
+            pullable.append(repo)
+    return pullable
+
+def get_update_options(settings: Settings) -> UpdateOptions:
+    """Get how repositories are brought up to date with origin."""
+    # Without background maintenance, git's automatic garbage collection is left on
+    return UpdateOptions(settings.update_mode, settings.fetch_depth, settings.fetch_filter, settings.mirror_dir,
+                         auto_gc=not settings.maintenance_interval)
+
+async def maintain_repositories(get_repos: Callable[[], List[str]], settings: Settings) -> None:
+    """
+    Run git maintenance on every repository and mirror once per maintenance interval, until cancelled.
+
+    While it runs, updates skip git's automatic garbage collection, which would otherwise
+    run in the middle of a pull. The repositories are maintained one at a time, so the
+    housekeeping stays out of the way of pulls and builds.
+    """
+    while True:
+        await asyncio.sleep(settings.maintenance_interval * 3600)
+        repos = get_repos() + (list_mirrors(settings.mirror_dir) if settings.mirror_dir else [])
+        logging.info(f"Running git maintenance on {len(repos)} repositories.")
+        for repo in repos:
+            await asyncio.to_thread(run_maintenance, repo)
+
+async def sync_repositories(repos: List[str], access_key: str, settings: Settings,
+                            state_store: Optional[StateStore] = None,
+                            queue: Optional[DeployQueue] = None) -> List[str]:
+    """
+    Pull the given repositories and queue deploys of the ones that changed.
+
+    Without a queue, a temporary one is used and the deploys are waited for.
+    Returns the repositories whose pull brought new commits.
+    """
+    if queue is None:
+        queue = create_deploy_queue(settings, state_store)
+        updated_repos = await sync_repositories(repos, access_key, settings, state_store, queue)
+        await queue.join()
+        return updated_repos
+
+    repos = await skip_deploying_repositories(repos, access_key, settings, queue)
+    updated_repos = []
+    async for repo, updated in pull_repositories_concurrently(access_key, repos,
+                                                              max_workers=settings.pull_workers,
+                                                              timeout=settings.pull_timeout,
+                                                              state_store=state_store,
+                                                              options=get_update_options(settings)):
+        if updated:
+            updated_repos.append(repo)
+
+    # Deploys that were pending or interrupted, for instance by a restart, are picked up again
+    revisions = {}
+    if state_store is not None:
+        for state in state_store.pending_deploys(repos):
+            revisions[state.path] = state.target_sha
+            if state.path not in updated_repos:
+                logging.info(f"Resuming pending deploy of {state.path}.")
+                updated_repos.append(state.path)
 
     if not updated_repos:
         logging.info("No git repositories with changes. Skipping Docker container rebuild.")
     else:
-        logging.info(f"{len(updated_repos)} git repositories with changes. Rebuilding Docker containers.")
-        for repo in updated_repos:
-            await asyncio.to_thread(handle_docker_operations, repo)
+        logging.info(f"{len(updated_repos)} git repositories with changes. Queueing Docker container rebuilds.")
+        levels = get_deploy_levels(build_graph(updated_repos))
+        if len(levels) > 1:
+            logging.info(f"Deploy order: {' then '.join(', '.join(level) for level in levels)}")
+        for level in levels:
+            for repo in level:
+                queue.submit(repo, revisions.get(repo))
+    return updated_repos
 
-async def scheduler(run_frequency: int, project_folder: str, access_key: str) -> None:
-    while True:
-        await log_scheduled_task(run_frequency, project_folder, access_key)
-        await asyncio.sleep(run_frequency)  # Use asyncio sleep to avoid blocking
+def find_repositories(project_folder: str, settings: Settings, watcher: Optional[RepoWatcher] = None) -> List[str]:
+    """Get the repositories under the project folder, from the watcher when there is one."""
+    if watcher is not None:
+        return watcher.repos
+    logging.info(f"Scanning project folder '{project_folder}' for git repositories.")
+    with Timer(SCAN_DURATION), span("scan", "scan"):
+        return scan_for_git_repos(project_folder, max_depth=settings.scan_depth, exclude=settings.scan_exclude)
+
+async def log_scheduled_task(run_frequency: int, project_folder: str, access_key: str,
+                             settings: Optional[Settings] = None, state_store: Optional[StateStore] = None,
+                             watcher: Optional[RepoWatcher] = None,
+                             queue: Optional[DeployQueue] = None) -> None:
+    """Logs the scheduled task execution."""
+    settings = settings or Settings()
+    found_repos = find_repositories(project_folder, settings, watcher)
+    logging.info(f"Found {len(found_repos)} git repositories. Trying updates")
+    await sync_repositories(found_repos, access_key, settings, state_store, queue)
+
+async def wait_for_triggers(triggers: asyncio.Queue, timeout: float) -> List[str]:
+    """Wait up to timeout seconds for triggered repositories and return all of them, without duplicates."""
+    repos = []
+    # Only wait on an empty queue, as wait_for with no time left gives up even when a trigger is queued
+    if triggers.empty():
+        try:
+            repos.append(await asyncio.wait_for(triggers.get(), timeout))
+        except asyncio.TimeoutError:
+            return []
+
+    while not triggers.empty():
+        repo = triggers.get_nowait()
+        if repo not in repos:
+            repos.append(repo)
+    return repos
+
+def get_poll_interval_override(repo: str) -> Optional[float]:
+    """Get the poll interval a repository fixes in its .syncatron.json, None to keep it adaptive."""
+    interval = load_repo_config(repo).poll_interval
+    if isinstance(interval, (int, float)) and not isinstance(interval, bool) and interval > 0:
+        return float(interval)
+    return None
+
+def create_poll_scheduler(run_frequency: int, settings: Settings) -> PollScheduler:
+    """Create the scheduler that decides when each repository is polled."""
+    max_interval = settings.poll_max_interval or run_frequency * 8
+    return PollScheduler(run_frequency, max_interval, get_override=get_poll_interval_override)
+
+async def poll_due_repositories(run_frequency: int, access_key: str, settings: Settings,
+                                state_store: Optional[StateStore], queue: DeployQueue, polls: PollScheduler) -> None:
+    """Pull the repositories that are due and schedule their next poll."""
+    loop = asyncio.get_running_loop()
+    due_repos = polls.pop_due(loop.time())
+    if not due_repos:
+        return
+
+    logging.info(f"Polling {len(due_repos)} of {len(polls.repos)} git repositories.")
+    updated_repos = []
+    cycle = Timer(CYCLE_DURATION)
+    try:
+        with cycle:
+            updated_repos = await sync_repositories(due_repos, access_key, settings, state_store, queue)
+    finally:
+        for repo in due_repos:
+            polls.reschedule(repo, repo in updated_repos, loop.time())
+    if cycle.elapsed > run_frequency:
+        CYCLE_OVERRUNS.inc()
+        logging.warning(f"Polling took {cycle.elapsed:.1f}s, longer than the run frequency of {run_frequency}s.")
+
+def start_image_collection(running: Optional[asyncio.Task]) -> Optional[asyncio.Task]:
+    """
+    Start collecting unused images in the background at the end of a cycle, unless a collection is still running.
+
+    Returns the task of the running collection.
+    """
+    if running is not None and not running.done():
+        return running
+    return asyncio.create_task(IMAGE_GC.collect_if_needed())
+
+async def scheduler(run_frequency: int, project_folder: str, access_key: str,
+                    settings: Optional[Settings] = None, state_store: Optional[StateStore] = None,
+                    watcher: Optional[RepoWatcher] = None, triggers: Optional[asyncio.Queue] = None,
+                    queue: Optional[DeployQueue] = None) -> None:
+    """
+    Poll every repository when it is due and sync triggered repositories in between.
+
+    The project folder is rescanned every run_frequency seconds. Each repository has its
+    own poll interval, which backs off while it stays idle. Unused images are collected
+    after a cycle when builds finished.
+    """
+    settings = settings or Settings()
+    queue = queue or create_deploy_queue(settings, state_store, triggers.put_nowait if triggers else None)
+    polls = create_poll_scheduler(run_frequency, settings)
+    RUN_FREQUENCY.set(run_frequency)
+    loop = asyncio.get_running_loop()
+    next_scan = loop.time()
+    collection = None
+
+    try:
+        while True:
+            next_due = polls.next_due()
+            if loop.time() >= next_scan or (next_due is not None and next_due <= loop.time()):
+                with profiled_cycle("poll"), log_context(cycle_id=new_cycle_id()):
+                    if loop.time() >= next_scan:
+                        polls.update_repos(find_repositories(project_folder, settings, watcher), loop.time())
+                        next_scan = max(next_scan + run_frequency, loop.time())
+                    await poll_due_repositories(run_frequency, access_key, settings, state_store, queue, polls)
+                collection = start_image_collection(collection)
+
+            next_due = polls.next_due()
+            wake = next_scan if next_due is None else min(next_due, next_scan)
+            if triggers is None:
+                await asyncio.sleep(max(wake - loop.time(), 0))
+                continue
+
+            triggered_repos = await wait_for_triggers(triggers, max(wake - loop.time(), 0))
+            if triggered_repos:
+                logging.info(f"Syncing triggered repositories: {', '.join(triggered_repos)}")
+                with profiled_cycle("trigger"), log_context(cycle_id=new_cycle_id()):
+                    updated_repos = await sync_repositories(triggered_repos, access_key, settings, state_store, queue)
+                for repo in triggered_repos:
+                    polls.reschedule(repo, repo in updated_repos, loop.time())
+                collection = start_image_collection(collection)
+    finally:
+        if collection is not None:
+            collection.cancel()
 
 async def main(run_frequency: Optional[int] = None, project_folder: Optional[str] = None,
-         access_key: Optional[str] = None) -> None:
+         access_key: Optional[str] = None, profile_dir: Optional[str] = None, cprofile_every: int = 0) -> None:
     """
     Main function that orchestrates the program operations.
+
+    With a profile_dir, a Chrome trace of every cycle is written there, and every
+    cprofile_every-th cycle is also profiled with cProfile.
     """
+    settings = load_settings()
+    listener = setup_logging(settings.log_format, rate_limit=settings.log_rate_limit, sample=settings.log_sample)
     # Load environment variables if not provided
     if run_frequency is None or project_folder is None or access_key is None:
         run_frequency, project_folder, access_key = load_environment_variables()
+    if profile_dir:
+        enable_profiling(profile_dir, cprofile_every)
 
     logging.info(f"Run Frequency: {run_frequency}")
     logging.info(f"Project Folder: {project_folder}")
     logging.info(f"Git Access Key: {access_key}")
+    logging.info(f"Pull Workers: {settings.pull_workers}, Pull Timeout: {settings.pull_timeout}")
+
+    state_store = StateStore(settings.state_path or get_default_state_path(project_folder))
+    REPO_CACHE.resize(settings.repo_cache_size)
+    IMAGE_GC.configure(settings.image_gc_watermark, settings.image_gc_keep_hours, settings.image_gc_budget)
+
+    watcher = None
+    triggers = asyncio.Queue()
+    if settings.watch_mode != "off":
+        watcher = RepoWatcher(project_folder, triggers.put_nowait, max_depth=settings.scan_depth,
+                              exclude=settings.scan_exclude, mode=settings.watch_mode,
+                              poll_interval=settings.watch_poll_interval, ignore=is_own_git_change)
+        await watcher.start()
+
+    def get_repos() -> List[str]:
+        if watcher is not None:
+            return watcher.repos
+        return scan_for_git_repos(project_folder, max_depth=settings.scan_depth, exclude=settings.scan_exclude)
+
+    if settings.webhook_port and not settings.webhook_secret:
+        logging.warning(f"Accepting push notifications on port {settings.webhook_port} without a secret.")
+    webhook = make_webhook_handler(get_repos, triggers.put_nowait, settings.webhook_secret)
+    servers = [await start_http_server(host, port, routes)
+               for (host, port), routes in get_http_routes(settings, webhook,
+                                                           make_metrics_handler(REGISTRY.render)).items()]
+
+    queue = create_deploy_queue(settings, state_store, triggers.put_nowait)
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    maintenance = None
+    if settings.maintenance_interval:
+        maintenance = asyncio.create_task(maintain_repositories(get_repos, settings))
 
     # Start the scheduler
-    await scheduler(run_frequency, project_folder, access_key)
+    try:
+        await scheduler(run_frequency, project_folder, access_key, settings, state_store, watcher, triggers, queue)
+    finally:
+        lag_monitor.cancel()
+        if maintenance is not None:
+            maintenance.cancel()
+        for server in servers:
+            server.close()
+        if watcher is not None:
+            await watcher.stop()
+        await queue.close()
+        state_store.close()
+        REPO_CACHE.clear()
+        close_client()
+        if listener is not None:
+            stop_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())  # Execute the main function using asyncio's event loop
\ No newline at end of file
@@ -0,0 +1,264 @@
+import math
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bucket bounds in seconds, wide enough for an ls-remote as well as a full image build
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+# Bucket bounds in seconds for the event loop lag, which should stay in the milliseconds
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Seconds between event loop lag measurements
+LAG_INTERVAL = 0.5
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    """
+    A named metric with optional labels, safe to update from worker threads.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        """
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            labels (Sequence[str]): The names of the labels every sample carries.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {', '.join(self.label_names) or 'none'}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """The name suffix, formatted labels and value of every sample."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """The metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """A value that only goes up."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add to the counter."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        """The current value."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [("", _format_labels(self.label_names, key), value) for key, value in sorted(self._values.items())]
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add to the gauge."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Subtract from the gauge."""
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        """The current value."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [("", _format_labels(self.label_names, key), value) for key, value in sorted(self._values.items())]
+
+class Histogram(Metric):
+    """Counts observations in cumulative buckets, along with their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation."""
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    def get_count(self, **labels: str) -> int:
+        """The number of observations."""
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), []))
+
+    def get_sum(self, **labels: str) -> float:
+        """The sum of the observations."""
+        with self._lock:
+            return self._sums.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            for key in sorted(self._counts):
+                cumulative = 0
+                for bound, count in zip(self.buckets, self._counts[key]):
+                    cumulative += count
+                    labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+                    samples.append(("_bucket", labels, cumulative))
+                labels = _format_labels(self.label_names, key)
+                samples.append(("_sum", labels, self._sums[key]))
+                samples.append(("_count", labels, cumulative))
+        return samples
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric.
+
+        Raises:
+            ValueError: If a metric with the same name is registered already.
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is registered already")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+REGISTRY = Registry()
+
+SCAN_DURATION = REGISTRY.register(Histogram(
+    "syncatron_scan_duration_seconds", "Time taken to search the project folder for repositories."))
+FETCH_DURATION = REGISTRY.register(Histogram(
+    "syncatron_fetch_duration_seconds", "Time taken to check and pull a repository.", ["repo"]))
+PULLS = REGISTRY.register(Counter(
+    "syncatron_pulls_total", "Pulls by outcome: updated, unchanged, error or timeout.", ["repo", "outcome"]))
+REPO_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "syncatron_repo_cache_lookups_total", "Repository handle lookups by result: hit, miss or stale.", ["result"]))
+PULLS_RUNNING = REGISTRY.register(Gauge(
+    "syncatron_pulls_running", "Pulls currently running."))
+DEPLOY_PHASE_DURATION = REGISTRY.register(Histogram(
+    "syncatron_deploy_phase_duration_seconds", "Time taken by each deploy step, such as rebuild or start.",
+    ["repo", "phase"]))
+DEPLOY_DOWNTIME = REGISTRY.register(Histogram(
+    "syncatron_deploy_downtime_seconds", "Time the services of a repository were down during a deploy.", ["repo"]))
+DEPLOYS = REGISTRY.register(Counter(
+    "syncatron_deploys_total", "Deploys by outcome: success, failure, rolled_back or skipped.", ["repo", "outcome"]))
+IMAGE_GC_DURATION = REGISTRY.register(Histogram(
+    "syncatron_image_gc_duration_seconds", "Time taken by each stage of an image collection.", ["stage"]))
+IMAGE_GC_RECLAIMED = REGISTRY.register(Counter(
+    "syncatron_image_gc_reclaimed_bytes_total", "Bytes reclaimed by each stage of image collections.", ["stage"]))
+DOCKER_DISK_USAGE = REGISTRY.register(Gauge(
+    "syncatron_docker_disk_usage_percent", "How full the disk under the Docker root is."))
+DEPLOY_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "syncatron_deploy_queue_depth", "Deploys waiting to start."))
+DEPLOYS_RUNNING = REGISTRY.register(Gauge(
+    "syncatron_deploys_running", "Deploys currently running."))
+CYCLE_DURATION = REGISTRY.register(Histogram(
+    "syncatron_cycle_duration_seconds", "Time taken to pull a batch of due repositories."))
+CYCLE_OVERRUNS = REGISTRY.register(Counter(
+    "syncatron_cycle_overruns_total", "Batches of pulls that took longer than the run frequency."))
+RUN_FREQUENCY = REGISTRY.register(Gauge(
+    "syncatron_run_frequency_seconds", "The configured run frequency."))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "syncatron_event_loop_lag_seconds", "How late the event loop ran a timer.", buckets=LAG_BUCKETS))
+
+class Timer:
+    """
+    Context manager that observes the seconds its block took in a histogram.
+    """
+
+    def __init__(self, histogram: Histogram, **labels: str):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.elapsed = time.monotonic() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+
+async def monitor_event_loop_lag(interval: float = LAG_INTERVAL) -> None:
+    """
+    Measure how late the event loop wakes up from a sleep, until cancelled.
+
+    Lag means something blocked the loop, such as synchronous work that belongs in a thread.
+
+    Args:
+        interval (float): Seconds between measurements.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - expected, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag > 1:
+            logger.warning(f"Event loop was blocked for {lag:.1f}s.")
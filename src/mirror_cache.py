@@ -0,0 +1,124 @@
+import os
+import hashlib
+import logging
+from typing import Dict, List, Optional
+from git import Git, GitCommandError, Repo
+from src.repo_cache import REPO_CACHE
+from src.profiler import span
+
+logger = logging.getLogger(__name__)
+
+def get_mirror_path(mirror_dir: str, url: str) -> str:
+    """
+    Get where the mirror of a remote is kept.
+
+    Args:
+        mirror_dir (str): The folder holding the mirrors.
+        url (str): The remote URL, without credentials.
+
+    Returns:
+        str: The path of the bare mirror repository.
+    """
+    key = hashlib.sha256(url.rstrip('/').encode()).hexdigest()[:16]
+    name = os.path.basename(url.rstrip('/')).removesuffix('.git') or 'mirror'
+    return os.path.join(mirror_dir, f"{name}-{key}.git")
+
+def list_mirrors(mirror_dir: str) -> List[str]:
+    """
+    List the mirrors in the mirror folder.
+
+    Args:
+        mirror_dir (str): The folder holding the mirrors.
+
+    Returns:
+        List[str]: The paths of the mirror repositories.
+    """
+    try:
+        names = sorted(os.listdir(mirror_dir))
+    except OSError:
+        return []
+    return [os.path.join(mirror_dir, name) for name in names if name.endswith('.git')]
+
+def has_commit(repo: Repo, sha: str) -> bool:
+    """Check whether a repository holds a commit."""
+    try:
+        repo.git.cat_file('-e', f'{sha}^{{commit}}')
+        return True
+    except GitCommandError:
+        return False
+
+def update_mirror(mirror_dir: str, url: str, sha: Optional[str], environment: Dict[str, str],
+                  timeout: Optional[int] = None, auto_gc: bool = True) -> str:
+    """
+    Make sure the mirror of a remote holds a commit, cloning or fetching it when it does not.
+
+    Checkouts of the same remote share the mirror, so the first one that needs a new commit
+    fetches it, and the others find it there. The mirror never prunes unreachable objects,
+    since checkouts borrow objects from it that origin may have dropped after a force push.
+
+    Args:
+        mirror_dir (str): The folder holding the mirrors.
+        url (str): The remote URL, without credentials.
+        sha (Optional[str]): The commit that is needed. None always fetches.
+        environment (Dict[str, str]): Environment of the git processes, with their credentials.
+        timeout (Optional[int]): Seconds after which each git process is killed. None waits forever.
+        auto_gc (bool): Whether the fetch may collect garbage. Turned off when maintenance runs on the mirrors.
+
+    Returns:
+        str: The path of the mirror.
+
+    Raises:
+        GitCommandError: If the clone or fetch fails.
+    """
+    path = get_mirror_path(mirror_dir, url)
+    with REPO_CACHE.get_lock(path):
+        if not os.path.isdir(path):
+            logger.info(f"Creating mirror of {url} in {path}.")
+            os.makedirs(mirror_dir, exist_ok=True)
+            with span("mirror-clone", "git", url=url):
+                Git(mirror_dir).clone('--mirror', '--config', 'gc.pruneExpire=never', url, path,
+                                      env=environment, kill_after_timeout=timeout)
+            return path
+
+        mirror = REPO_CACHE.get(path)
+        if sha is not None and has_commit(mirror, sha):
+            return path
+        git_options = {} if auto_gc else {'c': 'gc.auto=0'}
+        with span("mirror-fetch", "git", url=url):
+            with mirror.git.custom_environment(**environment):
+                mirror.git(**git_options).fetch('--prune', 'origin', kill_after_timeout=timeout)
+        return path
+
+def attach_mirror(repo: Repo, mirror_path: str, timeout: Optional[int] = None) -> bool:
+    """
+    Let a checkout borrow objects from a mirror through its alternates.
+
+    The first time, the objects the checkout shares with the mirror are dropped from
+    its own packs. The mirror must stay in place as long as the checkout uses it.
+
+    Args:
+        repo (Repo): The checkout.
+        mirror_path (str): The path of the mirror.
+        timeout (Optional[int]): Seconds after which the repack is killed. None waits forever.
+
+    Returns:
+        bool: True if the mirror was attached now, False if it was attached already.
+    """
+    objects = os.path.abspath(os.path.join(mirror_path, 'objects'))
+    alternates = os.path.join(repo.common_dir, 'objects', 'info', 'alternates')
+    try:
+        with open(alternates) as f:
+            if objects in (line.strip() for line in f):
+                return False
+    except FileNotFoundError:
+        pass
+
+    logger.info(f"Sharing objects of {repo.working_tree_dir} with the mirror in {mirror_path}.")
+    os.makedirs(os.path.dirname(alternates), exist_ok=True)
+    with open(alternates, 'a') as f:
+        f.write(objects + '\n')
+    # Persistent cat-file processes only read the alternates when they start
+    repo.git.clear_cache()
+    with span("repack", "git", repo=repo.working_tree_dir):
+        repo.git.repack('-a', '-d', '-l', '-q', kill_after_timeout=timeout)
+    return True
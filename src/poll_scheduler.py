@@ -0,0 +1,154 @@
+import heapq
+import random
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Factor the interval of a repository grows by after each poll that found nothing new
+BACKOFF_FACTOR = 2.0
+# Share of the interval by which each due time is moved at random, to spread polls out
+DEFAULT_JITTER = 0.1
+
+@dataclass
+class PollState:
+    """
+    When a repository is polled next, and how often.
+
+    Attributes:
+        interval (float): Seconds between polls of the repository.
+        tick (float): The loop time of the next poll before jitter, which later ticks advance from.
+        due (float): The loop time of the next poll.
+        generation (int): Changes whenever the repository is rescheduled, so stale heap entries are skipped.
+    """
+    interval: float
+    tick: float
+    due: float
+    generation: int = 0
+
+class PollScheduler:
+    """
+    Keeps a next-due time for every repository in a heap, so each one is polled at its own rate.
+
+    Repositories start at the base interval. Every poll that finds nothing new doubles
+    the interval up to max_interval, and a poll that finds changes drops it back to the
+    base interval. Due times advance from the previous tick rather than from the
+    end of the poll, so the period does not drift by the time polling takes.
+    """
+
+    def __init__(self, base_interval: float, max_interval: Optional[float] = None, jitter: float = DEFAULT_JITTER,
+                 get_override: Optional[Callable[[str], Optional[float]]] = None,
+                 rng: Optional[random.Random] = None):
+        """
+        Args:
+            base_interval (float): Seconds between polls of a repository that changed recently.
+            max_interval (Optional[float]): Longest interval an idle repository backs off to. None disables backing off.
+            jitter (float): Share of the interval each due time is moved by at random, in either direction.
+            get_override (Optional[Callable[[str], Optional[float]]]): Returns a fixed interval for a repository, or None.
+            rng (Optional[random.Random]): Source of the jitter.
+        """
+        self.base_interval = base_interval
+        self.max_interval = max(max_interval or base_interval, base_interval)
+        self.jitter = jitter
+        self.get_override = get_override
+        self.rng = rng or random.Random()
+
+        self._states: Dict[str, PollState] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._generations = itertools.count(1)
+
+    @property
+    def repos(self) -> List[str]:
+        """The scheduled repositories, sorted by path."""
+        return sorted(self._states)
+
+    def get_state(self, repo: str) -> Optional[PollState]:
+        """The schedule of a repository, None if it is not scheduled."""
+        return self._states.get(repo)
+
+    def update_repos(self, repos: Iterable[str], now: float) -> None:
+        """
+        Schedule repositories that are new, due right away, and forget the ones that are gone.
+
+        Args:
+            repos (Iterable[str]): The repositories that exist now.
+            now (float): The current loop time.
+        """
+        repos = set(repos)
+        for repo in set(self._states) - repos:
+            del self._states[repo]
+        for repo in repos - set(self._states):
+            self._states[repo] = PollState(interval=self.base_interval, tick=now, due=now)
+            self._push(repo)
+
+    def next_due(self) -> Optional[float]:
+        """The loop time at which the next repository is due, None if none is scheduled."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[str]:
+        """
+        Take every repository that is due.
+
+        The repositories stay scheduled but are not returned again until they are rescheduled.
+
+        Args:
+            now (float): The current loop time.
+
+        Returns:
+            List[str]: The due repositories, earliest first.
+        """
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, repo = heapq.heappop(self._heap)
+            due.append(repo)
+            self._drop_stale()
+        return due
+
+    def reschedule(self, repo: str, changed: bool, now: float) -> None:
+        """
+        Schedule the next poll of a repository after it was polled.
+
+        Args:
+            repo (str): The repository that was polled.
+            changed (bool): Whether the poll found changes.
+            now (float): The current loop time.
+        """
+        state = self._states.get(repo)
+        if state is None:
+            return
+
+        override = self.get_override(repo) if self.get_override is not None else None
+        if override:
+            state.interval = float(override)
+        elif changed:
+            state.interval = self.base_interval
+        else:
+            state.interval = min(state.interval * BACKOFF_FACTOR, self.max_interval)
+
+        if state.due <= now < state.tick + state.interval:
+            # A poll on time advances from its tick rather than its jittered due time, so neither
+            # the jitter nor the time polling takes adds up
+            state.tick += state.interval
+        else:
+            # An early poll, such as a triggered one, or a poll that overran its interval starts afresh
+            state.tick = now + state.interval
+        state.due = state.tick + state.interval * self.rng.uniform(-self.jitter, self.jitter)
+        logger.debug(f"Next poll of {repo} in {state.due - now:.1f}s.")
+        self._push(repo)
+
+    def _push(self, repo: str) -> None:
+        state = self._states[repo]
+        state.generation = next(self._generations)
+        heapq.heappush(self._heap, (state.due, state.generation, repo))
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            due, generation, repo = self._heap[0]
+            state = self._states.get(repo)
+            if state is not None and state.generation == generation:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,132 @@
+import os
+import signal
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Lines kept for error reports when a caller does not ask for another amount
+DEFAULT_TAIL_LINES = 200
+# Longest line read in one piece, longer lines are cut
+MAX_LINE_BYTES = 1024 * 1024
+
+Sink = Callable[[str, str], None]
+
+@dataclass
+class ProcessResult:
+    """
+    The outcome of a process run.
+
+    Attributes:
+        args (List[str]): The program and its arguments.
+        exit_code (int): The exit status, -1 if the process could not be started or was killed.
+        tail (List[str]): The last lines of stdout and stderr, interleaved in the order they arrived.
+        timed_out (bool): Whether the process was killed because it ran past its timeout.
+    """
+    args: List[str]
+    exit_code: int = -1
+    tail: List[str] = field(default_factory=list)
+    timed_out: bool = False
+
+    @property
+    def output(self) -> str:
+        """The retained output as a single string."""
+        return "\n".join(self.tail)
+
+def log_sink(stream: str, line: str) -> None:
+    """
+    Default sink that logs every line at DEBUG level.
+
+    Args:
+        stream (str): 'stdout' or 'stderr'.
+        line (str): The line, without its trailing newline.
+    """
+    # Builds print thousands of lines, so they are not even formatted unless DEBUG is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[{stream}] {line}")
+
+async def _pump(reader: asyncio.StreamReader, stream: str, sink: Sink, tail: Deque[str]) -> None:
+    while True:
+        try:
+            raw = await reader.readline()
+        except ValueError:
+            # The line was longer than the reader limit, asyncio dropped it
+            raw = b"[line too long, truncated]\n"
+        if not raw:
+            return
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        tail.append(line)
+        sink(stream, line)
+
+def _kill(process: asyncio.subprocess.Process) -> None:
+    # The process leads its own session, so this also stops children such as compose build workers
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+async def run_process(args: Sequence[str], timeout: Optional[float] = None, sink: Optional[Sink] = None,
+                      tail_lines: int = DEFAULT_TAIL_LINES, cwd: Optional[str] = None,
+                      env: Optional[Dict[str, str]] = None) -> ProcessResult:
+    """
+    Run a program without a shell and stream its output line by line.
+
+    Only the last tail_lines lines are kept in memory, however much the program
+    prints. When the timeout passes, or the awaiting task is cancelled, the program
+    and everything it started are killed.
+
+    Args:
+        args (Sequence[str]): The program and its arguments.
+        timeout (Optional[float]): Seconds the program may run. None waits forever.
+        sink (Optional[Sink]): Called with the stream name and each line as it arrives. Defaults to DEBUG logging.
+        tail_lines (int): How many of the last lines to keep for the result.
+        cwd (Optional[str]): Working directory of the program.
+        env (Optional[Dict[str, str]]): Environment of the program. None inherits this process' environment.
+
+    Returns:
+        ProcessResult: The exit status and the last lines of output.
+
+    Raises:
+        ValueError: If args is empty.
+        asyncio.CancelledError: If the awaiting task is cancelled, after the program was killed.
+    """
+    if not args:
+        raise ValueError("Command cannot be empty")
+
+    sink = sink or log_sink
+    result = ProcessResult(args=list(args))
+    tail: Deque[str] = deque(maxlen=tail_lines)
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, cwd=cwd, env=env, start_new_session=True, limit=MAX_LINE_BYTES)
+    except OSError as e:
+        logger.error(f"Could not start {args[0]}: {e}")
+        result.tail = [str(e)]
+        return result
+
+    async def communicate() -> int:
+        await asyncio.gather(_pump(process.stdout, "stdout", sink, tail), _pump(process.stderr, "stderr", sink, tail))
+        return await process.wait()
+
+    try:
+        result.exit_code = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        result.timed_out = True
+        tail.append(f"Killed after running for more than {timeout} seconds")
+    except asyncio.CancelledError:
+        _kill(process)
+        await process.wait()
+        raise
+
+    result.tail = list(tail)
+    return result
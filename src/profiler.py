@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import asyncio
+import cProfile
+import itertools
+import logging
+import threading
+import contextlib
+import contextvars
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The cycle that spans started in the current task or thread belong to
+_current_cycle: contextvars.ContextVar[Optional["CycleTrace"]] = contextvars.ContextVar("cycle_trace", default=None)
+
+_profiler: Optional["Profiler"] = None
+
+def _now_us() -> float:
+    return time.monotonic_ns() / 1000
+
+class CycleTrace:
+    """
+    The spans recorded for one cycle.
+
+    The trace is written when the cycle ends. Deploys queued in the cycle keep running
+    after it, so the trace is written again whenever their spans have all finished.
+    """
+
+    def __init__(self, profiler: "Profiler", number: int, label: str):
+        self.profiler = profiler
+        self.number = number
+        self.label = label
+        self.events: List[dict] = []
+        self.open_spans = 0
+        self.ended = False
+        self._lock = threading.Lock()
+
+    def span_started(self) -> None:
+        with self._lock:
+            self.open_spans += 1
+
+    def span_finished(self, event: dict) -> None:
+        with self._lock:
+            self.events.append(event)
+            self.open_spans -= 1
+            complete = self.ended and self.open_spans == 0
+        if complete:
+            self.profiler.write_trace(self)
+
+    def end(self) -> None:
+        with self._lock:
+            self.ended = True
+            complete = self.open_spans == 0
+        if complete:
+            self.profiler.write_trace(self)
+
+class Span:
+    """
+    Context manager that records how long its block took as a complete trace event.
+    """
+
+    def __init__(self, cycle: CycleTrace, name: str, category: str, args: Dict[str, object]):
+        self.cycle = cycle
+        self.name = name
+        self.category = category
+        self.args = args
+        self.started = 0.0
+
+    def __enter__(self) -> "Span":
+        self.cycle.span_started()
+        self.started = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        finished = _now_us()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        pid, tid = self.cycle.profiler.get_track()
+        self.cycle.span_finished({"name": self.name, "cat": self.category, "ph": "X", "ts": self.started,
+                                  "dur": finished - self.started, "pid": pid, "tid": tid, "args": self.args})
+
+class Profiler:
+    """
+    Records a timeline of spans for every cycle and writes it as a Chrome trace-event
+    file, which chrome://tracing and Perfetto open. Every cprofile_every-th cycle is
+    also profiled with cProfile.
+    """
+
+    def __init__(self, directory: str, cprofile_every: int = 0):
+        """
+        Args:
+            directory (str): Where the trace and profile files are written.
+            cprofile_every (int): Profile every this many cycles with cProfile. 0 never does.
+        """
+        self.directory = directory
+        self.cprofile_every = cprofile_every
+        self.cycles = 0
+        self._tracks: Dict[object, Tuple[int, str]] = {}
+        self._track_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_track(self) -> Tuple[int, int]:
+        """
+        Get the process and track id for the running task, or for the thread outside of tasks.
+
+        Concurrent tasks get tracks of their own, so their spans do not overlap on one row.
+        """
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = task if task is not None else threading.get_ident()
+        with self._lock:
+            if key not in self._tracks:
+                name = task.get_name() if task is not None else threading.current_thread().name
+                self._tracks[key] = (next(self._track_ids), name)
+            return os.getpid(), self._tracks[key][0]
+
+    @contextlib.contextmanager
+    def cycle(self, label: str) -> Iterator[CycleTrace]:
+        """
+        Record the spans of a cycle, and of the tasks and threads started in it.
+
+        Args:
+            label (str): What the cycle does, such as 'poll' or 'trigger'.
+
+        Yields:
+            CycleTrace: The trace of the cycle.
+        """
+        self.cycles += 1
+        trace = CycleTrace(self, self.cycles, label)
+        token = _current_cycle.set(trace)
+        profile = None
+        if self.cprofile_every and self.cycles % self.cprofile_every == 0:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            with Span(trace, f"cycle {self.cycles}", "cycle", {"label": label}):
+                yield trace
+        finally:
+            if profile is not None:
+                profile.disable()
+                path = os.path.join(self.directory, f"cycle-{trace.number:06d}.prof")
+                profile.dump_stats(path)
+                logger.info(f"Wrote cProfile of cycle {trace.number} to {path}")
+            _current_cycle.reset(token)
+            trace.end()
+
+    def write_trace(self, trace: CycleTrace) -> None:
+        """Write the trace of a finished cycle to a Chrome trace-event JSON file."""
+        with self._lock:
+            tracks = {tid: name for tid, name in self._tracks.values()}
+            # Tasks that finished record no more spans, so their tracks are dropped
+            self._tracks = {key: value for key, value in self._tracks.items()
+                            if not (isinstance(key, asyncio.Task) and key.done())}
+        used = {event["tid"] for event in trace.events}
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": tracks[tid]}}
+                    for tid in sorted(used) if tid in tracks]
+        path = os.path.join(self.directory, f"cycle-{trace.number:06d}.trace.json")
+        try:
+            with open(path, "w", encoding="utf-8") as handle:
+                json.dump({"traceEvents": metadata + sorted(trace.events, key=lambda event: event["ts"]),
+                           "displayTimeUnit": "ms"}, handle)
+        except OSError as e:
+            logger.warning(f"Could not write trace of cycle {trace.number}: {e}")
+
+def enable_profiling(directory: str, cprofile_every: int = 0) -> Profiler:
+    """
+    Turn on profiling for the rest of the process.
+
+    Args:
+        directory (str): Where the trace and profile files are written.
+        cprofile_every (int): Profile every this many cycles with cProfile. 0 never does.
+
+    Returns:
+        Profiler: The profiler.
+    """
+    global _profiler
+    _profiler = Profiler(directory, cprofile_every)
+    logger.info(f"Profiling enabled, writing traces to {directory}")
+    return _profiler
+
+def disable_profiling() -> None:
+    """Turn profiling off again."""
+    global _profiler
+    _profiler = None
+
+def cycle(label: str):
+    """
+    Record a cycle when profiling is enabled, otherwise do nothing.
+
+    Args:
+        label (str): What the cycle does, such as 'poll' or 'trigger'.
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.cycle(label)
+
+def span(name: str, category: str = "syncatron", **args: object):
+    """
+    Record a span in the current cycle. Outside of a profiled cycle this costs a context variable lookup.
+
+    Args:
+        name (str): The span name, such as 'pull' or 'rebuild'.
+        category (str): The span category, such as 'git' or 'docker'.
+        **args (object): Details shown with the span, such as the repository.
+    """
+    trace = _current_cycle.get()
+    if trace is None:
+        return contextlib.nullcontext()
+    return Span(trace, name, category, args)
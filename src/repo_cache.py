@@ -0,0 +1,136 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from git import Repo
+from src.metrics import REPO_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Most repository handles kept open when no other size is configured
+DEFAULT_MAX_SIZE = 256
+
+# Identity of the git directory, the config and the alternates a handle was opened with
+Signature = Tuple[Optional[Tuple[int, int]], Optional[int], Optional[int]]
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def get_signature(directory: str) -> Signature:
+    """
+    Get what a handle of a repository depends on: its .git entry, config and alternates.
+
+    Args:
+        directory (str): The repository directory.
+
+    Returns:
+        Signature: The device and inode of .git and the modification times of the config and
+        alternates files, None for anything missing.
+    """
+    git_dir = os.path.join(directory, '.git')
+    git_entry = _stat(git_dir)
+    config = _stat(os.path.join(git_dir, 'config'))
+    alternates = _stat(os.path.join(git_dir, 'objects', 'info', 'alternates'))
+    return ((git_entry.st_dev, git_entry.st_ino) if git_entry else None,
+            config.st_mtime_ns if config else None,
+            alternates.st_mtime_ns if alternates else None)
+
+class RepoCache:
+    """
+    Keeps Repo handles open across cycles, so the git directory is not discovered again
+    and GitPython's persistent cat-file processes are reused.
+
+    A handle is reopened when the .git entry of its repository was replaced or its config
+    or alternates changed, and dropped when the repository disappeared. At most max_size
+    handles are kept. The least recently used handle is closed first, skipping handles of
+    repositories whose lock is held, since their handle is in use.
+
+    Handles are not thread safe. Only use one while holding the lock of its repository.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Args:
+            max_size (int): Most handles kept open.
+        """
+        self.max_size = max_size
+        self._handles: "OrderedDict[str, Tuple[Repo, Signature]]" = OrderedDict()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def get_lock(self, directory: str) -> threading.Lock:
+        """Get the lock held while a repository is used."""
+        with self._guard:
+            return self._locks.setdefault(directory, threading.Lock())
+
+    def get(self, directory: str) -> Repo:
+        """
+        Get an open handle of a repository, opening one when there is none or it went stale.
+
+        Args:
+            directory (str): The repository directory.
+
+        Returns:
+            Repo: The handle.
+
+        Raises:
+            InvalidGitRepositoryError: If the directory is not a git repository.
+            NoSuchPathError: If the directory does not exist.
+        """
+        signature = get_signature(directory)
+        with self._guard:
+            cached = self._handles.get(directory)
+            if cached is not None and cached[1] == signature:
+                self._handles.move_to_end(directory)
+                REPO_CACHE_LOOKUPS.inc(result="hit")
+                return cached[0]
+            if cached is not None:
+                del self._handles[directory]
+                cached[0].close()
+                REPO_CACHE_LOOKUPS.inc(result="stale")
+            else:
+                REPO_CACHE_LOOKUPS.inc(result="miss")
+
+        repo = Repo(directory)
+        with self._guard:
+            self._handles[directory] = (repo, signature)
+            self._evict()
+        return repo
+
+    def _evict(self) -> None:
+        """Close the least recently used handles that are not in use until at most max_size are open."""
+        excess = len(self._handles) - self.max_size
+        if excess <= 0:
+            return
+        for directory in list(self._handles):
+            lock = self._locks.get(directory)
+            if lock is not None and lock.locked():
+                continue
+            repo, _ = self._handles.pop(directory)
+            repo.close()
+            excess -= 1
+            if excess == 0:
+                break
+
+    def resize(self, max_size: int) -> None:
+        """Change how many handles are kept, closing the least recently used ones if there are too many."""
+        with self._guard:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self) -> None:
+        """Close every handle."""
+        with self._guard:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for repo, _ in handles:
+            repo.close()
+
+REPO_CACHE = RepoCache()
@@ -0,0 +1,55 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field, fields
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Per repository settings are read from this file in the repository root
+REPO_CONFIG_FILE = ".syncatron.json"
+
+@dataclass
+class RepoConfig:
+    """
+    Settings a repository can declare for itself in its .syncatron.json file.
+
+    Attributes:
+        no_cache (bool): Always build the images of this repository without the layer cache.
+        poll_interval (int): Seconds between polls of this repository, instead of the adaptive interval. 0 keeps it adaptive.
+        depends_on (List[str]): Repositories whose queued deploys finish before this one starts, named by their
+            path relative to the folder holding this repository.
+    """
+    no_cache: bool = False
+    poll_interval: int = 0
+    depends_on: List[str] = field(default_factory=list)
+
+def load_repo_config(path: str) -> RepoConfig:
+    """
+    Load the settings a repository declares for itself.
+
+    Unknown keys are ignored and an unreadable file falls back to the defaults, so a
+    broken config file never stops a deploy.
+
+    Args:
+        path (str): The repository directory.
+
+    Returns:
+        RepoConfig: The repository settings.
+    """
+    config_file = os.path.join(path, REPO_CONFIG_FILE)
+    try:
+        with open(config_file, "r", encoding="utf-8") as handle:
+            values = json.load(handle)
+    except FileNotFoundError:
+        return RepoConfig()
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {config_file}: {e}")
+        return RepoConfig()
+
+    if not isinstance(values, dict):
+        logger.warning(f"Ignoring {config_file}: expected a JSON object.")
+        return RepoConfig()
+
+    known = {config_field.name for config_field in fields(RepoConfig)}
+    return RepoConfig(**{key: value for key, value in values.items() if key in known})
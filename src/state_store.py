@@ -0,0 +1,329 @@
+import os
+import sqlite3
+import logging
+import threading
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from src.build_history import DEFAULT_ALPHA, DurationStats
+
+logger = logging.getLogger(__name__)
+
+# Deploy status values stored per repository
+STATUS_PENDING = "pending"
+STATUS_DEPLOYING = "deploying"
+STATUS_DEPLOYED = "deployed"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    path TEXT PRIMARY KEY,
+    remote_sha TEXT,
+    target_sha TEXT,
+    deployed_sha TEXT,
+    compose_hash TEXT,
+    build_duration REAL,
+    deploy_status TEXT,
+    completed_step TEXT,
+    no_cache_built_at REAL,
+    deploy_started_at REAL,
+    updated_at REAL
+)
+"""
+
+# Rolling history of how long each phase of the deploys of a repository took, per service
+DURATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS durations (
+    path TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    service TEXT NOT NULL,
+    ewma REAL NOT NULL,
+    count INTEGER NOT NULL,
+    samples TEXT NOT NULL,
+    PRIMARY KEY (path, phase, service)
+)
+"""
+
+# Columns added after the first release, created on databases that predate them
+MIGRATIONS = {
+    "no_cache_built_at": "ALTER TABLE repos ADD COLUMN no_cache_built_at REAL",
+    "deploy_started_at": "ALTER TABLE repos ADD COLUMN deploy_started_at REAL",
+}
+
+@dataclass
+class RepoState:
+    """
+    The persisted sync state of a single repository.
+
+    Attributes:
+        path (str): The repository directory.
+        remote_sha (Optional[str]): The last remote tip SHA seen for the tracked branch.
+        target_sha (Optional[str]): The commit waiting to be, or being, deployed.
+        deployed_sha (Optional[str]): The commit that was last deployed successfully.
+        compose_hash (Optional[str]): Hash of the docker-compose.yml used for the last deploy.
+        build_duration (Optional[float]): Seconds the last successful build took.
+        deploy_status (Optional[str]): One of pending, deploying, deployed or failed.
+        completed_step (Optional[str]): The last deploy step that finished for target_sha.
+        no_cache_built_at (Optional[float]): Unix time of the last build without the layer cache.
+        deploy_started_at (Optional[float]): Unix time the last deploy started.
+    """
+    path: str
+    remote_sha: Optional[str] = None
+    target_sha: Optional[str] = None
+    deployed_sha: Optional[str] = None
+    compose_hash: Optional[str] = None
+    build_duration: Optional[float] = None
+    deploy_status: Optional[str] = None
+    completed_step: Optional[str] = None
+    no_cache_built_at: Optional[float] = None
+    deploy_started_at: Optional[float] = None
+
+def get_default_state_path(project_folder: str) -> str:
+    """
+    Get the default location of the state database, inside the project folder so it survives container restarts.
+
+    Args:
+        project_folder (str): The folder that holds the repositories.
+
+    Returns:
+        str: The path to the state database.
+    """
+    return os.path.join(project_folder, ".syncatron", "state.db")
+
+class StateStore:
+    """
+    SQLite backed store of per repository sync state.
+
+    The store is shared between the event loop and worker threads, so every
+    access goes through a single connection guarded by a lock.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open, and create if needed, the state database.
+
+        Args:
+            path (str): The path to the SQLite database file, or ':memory:'.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(SCHEMA)
+        self._connection.execute(DURATIONS_SCHEMA)
+        self._migrate()
+        logger.info(f"Opened sync state store at {path}")
+
+    def _migrate(self) -> None:
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(repos)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                self._connection.execute(statement)
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _upsert(self, path: str, **values) -> None:
+        values["updated_at"] = time.time()
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        assignments = ", ".join(f"{column}=excluded.{column}" for column in values)
+        self._execute(
+            f"INSERT INTO repos (path, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT(path) DO UPDATE SET {assignments}",
+            (path, *values.values()),
+        )
+
+    def get(self, path: str) -> Optional[RepoState]:
+        """
+        Get the stored state of a repository.
+
+        Args:
+            path (str): The repository directory.
+
+        Returns:
+            Optional[RepoState]: The stored state, or None if the repository has never been seen.
+        """
+        rows = self._execute("SELECT * FROM repos WHERE path = ?", (path,))
+        if not rows:
+            return None
+        return RepoState(**{key: rows[0][key] for key in rows[0].keys() if key != "updated_at"})
+
+    def record_remote_sha(self, path: str, sha: str) -> None:
+        """
+        Record the remote tip SHA seen for a repository. Nothing is written if it did not change.
+
+        Args:
+            path (str): The repository directory.
+            sha (str): The remote tip SHA.
+        """
+        self._execute(
+            "INSERT INTO repos (path, remote_sha, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET remote_sha=excluded.remote_sha, updated_at=excluded.updated_at "
+            "WHERE remote_sha IS NOT excluded.remote_sha",
+            (path, sha, time.time()),
+        )
+
+    def mark_pending(self, path: str, sha: str) -> None:
+        """
+        Record that a repository was updated to a commit that still has to be deployed.
+
+        Args:
+            path (str): The repository directory.
+            sha (str): The commit to deploy.
+        """
+        self._upsert(path, target_sha=sha, deploy_status=STATUS_PENDING, completed_step=None)
+
+    def mark_deploying(self, path: str, sha: Optional[str], compose_hash: Optional[str]) -> None:
+        """
+        Record that a deploy has started. A deploy of the same commit that was interrupted keeps its completed step.
+
+        Args:
+            path (str): The repository directory.
+            sha (Optional[str]): The commit being deployed.
+            compose_hash (Optional[str]): Hash of the docker-compose.yml being deployed.
+        """
+        state = self.get(path)
+        resuming = state is not None and state.deploy_status == STATUS_DEPLOYING and state.target_sha == sha
+        self._upsert(path, target_sha=sha, compose_hash=compose_hash, deploy_status=STATUS_DEPLOYING,
+                     completed_step=state.completed_step if resuming else None, deploy_started_at=time.time())
+
+    def mark_step_completed(self, path: str, step: str) -> None:
+        """
+        Record that a deploy step finished, so an interrupted deploy can resume after it.
+
+        Args:
+            path (str): The repository directory.
+            step (str): The name of the finished step.
+        """
+        self._upsert(path, completed_step=step)
+
+    def mark_deployed(self, path: str, sha: Optional[str], compose_hash: Optional[str],
+                      build_duration: Optional[float]) -> None:
+        """
+        Record a successful deploy.
+
+        Args:
+            path (str): The repository directory.
+            sha (Optional[str]): The commit that was deployed.
+            compose_hash (Optional[str]): Hash of the docker-compose.yml that was deployed.
+            build_duration (Optional[float]): Seconds the build took, or None to keep the previous value.
+        """
+        values = dict(deployed_sha=sha, compose_hash=compose_hash, deploy_status=STATUS_DEPLOYED, completed_step=None)
+        if build_duration is not None:
+            values["build_duration"] = build_duration
+        self._upsert(path, **values)
+
+    def record_no_cache_build(self, path: str) -> None:
+        """
+        Record that the images of a repository were just built without the layer cache.
+
+        Args:
+            path (str): The repository directory.
+        """
+        self._upsert(path, no_cache_built_at=time.time())
+
+    def mark_failed(self, path: str) -> None:
+        """
+        Record a failed deploy. It is not retried until a new commit arrives.
+
+        Args:
+            path (str): The repository directory.
+        """
+        self._upsert(path, deploy_status=STATUS_FAILED, completed_step=None)
+
+    def pending_deploys(self, paths: Optional[List[str]] = None) -> List[RepoState]:
+        """
+        Get the repositories with a deploy that is pending or was interrupted.
+
+        Args:
+            paths (Optional[List[str]]): Only consider these repositories. None considers all of them.
+
+        Returns:
+            List[RepoState]: The states of the repositories that still need a deploy.
+        """
+        rows = self._execute("SELECT path FROM repos WHERE deploy_status IN (?, ?) ORDER BY updated_at",
+                             (STATUS_PENDING, STATUS_DEPLOYING))
+        wanted = None if paths is None else set(paths)
+        return [self.get(row["path"]) for row in rows if wanted is None or row["path"] in wanted]
+
+    def list_states(self) -> List[RepoState]:
+        """
+        Get the state of every repository that was seen.
+
+        Returns:
+            List[RepoState]: The states, ordered by repository directory.
+        """
+        rows = self._execute("SELECT path FROM repos ORDER BY path")
+        return [self.get(row["path"]) for row in rows]
+
+    def record_duration(self, path: str, phase: str, duration: float, services: Optional[List[str]] = None,
+                        alpha: float = DEFAULT_ALPHA) -> None:
+        """
+        Add how long a deploy phase took to the history of a repository and of the services it covered.
+
+        Args:
+            path (str): The repository directory.
+            phase (str): The deploy phase, such as rebuild, start or deploy.
+            duration (float): The seconds the phase took.
+            services (Optional[List[str]]): The services the phase covered. None only records the repository.
+            alpha (float): Weight of the new duration in the moving average.
+        """
+        with self._lock:
+            # One transaction, so the histories of the repository and its services stay in step
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                for service in ["", *(services or [])]:
+                    row = self._connection.execute(
+                        "SELECT ewma, count, samples FROM durations WHERE path = ? AND phase = ? AND service = ?",
+                        (path, phase, service)).fetchone()
+                    stats = to_duration_stats(row) if row is not None else DurationStats()
+                    stats.add(duration, alpha)
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO durations (path, phase, service, ewma, count, samples) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, phase, service, stats.ewma, stats.count, json.dumps(stats.samples)))
+
+    def get_durations(self, path: str, service: str = "") -> Dict[str, DurationStats]:
+        """
+        Get the duration history of a repository, or of one of its services.
+
+        Args:
+            path (str): The repository directory.
+            service (str): The service name. An empty name gets the history of the whole repository.
+
+        Returns:
+            Dict[str, DurationStats]: The history of each recorded phase.
+        """
+        rows = self._execute("SELECT phase, ewma, count, samples FROM durations WHERE path = ? AND service = ?",
+                             (path, service))
+        return {row["phase"]: to_duration_stats(row) for row in rows}
+
+    def list_services(self, path: str) -> List[str]:
+        """
+        Get the services of a repository that have a duration history.
+
+        Args:
+            path (str): The repository directory.
+
+        Returns:
+            List[str]: The service names, sorted.
+        """
+        rows = self._execute("SELECT DISTINCT service FROM durations WHERE path = ? AND service != '' "
+                             "ORDER BY service", (path,))
+        return [row["service"] for row in rows]
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._connection.close()
+
+def to_duration_stats(row: sqlite3.Row) -> DurationStats:
+    """Convert a row of the durations table to its duration history."""
+    return DurationStats(ewma=row["ewma"], count=row["count"], samples=json.loads(row["samples"]))
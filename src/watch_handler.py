@@ -0,0 +1,292 @@
+import os
+import sys
+import asyncio
+import ctypes
+import ctypes.util
+import struct
+import logging
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from src.filesystem_handler import (WATCHED_GIT_FILES, get_cached_listings, get_git_file_mtimes, resolve_git_dir,
+                                    scan_for_git_repos)
+
+logger = logging.getLogger(__name__)
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+DIRECTORY_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+GIT_DIR_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Watch kinds, deciding how events on a watch descriptor are interpreted
+WATCH_DIRECTORY = "directory"
+WATCH_REPO = "repo"
+WATCH_GIT_DIR = "gitdir"
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+def is_inotify_available() -> bool:
+    """
+    Check whether Linux inotify can be used on this platform.
+
+    Returns:
+        bool: True if inotify is available.
+    """
+    return _load_libc() is not None
+
+class Inotify:
+    """
+    Minimal ctypes wrapper around a non-blocking inotify file descriptor.
+    """
+
+    def __init__(self):
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this platform")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """
+        Watch a path, returning its watch descriptor.
+
+        Raises:
+            OSError: If the watch cannot be added.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {path}: {os.strerror(errno)}")
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        """Stop watching a watch descriptor. Descriptors that are already gone are ignored."""
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """
+        Read all pending events without blocking.
+
+        Returns:
+            List[Tuple[int, int, str]]: The watch descriptor, mask and name of each event.
+        """
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self) -> None:
+        """Close the inotify file descriptor, which drops every watch."""
+        os.close(self.fd)
+
+class RepoWatcher:
+    """
+    Keeps the set of repositories under the project folder current and reports
+    repositories whose HEAD or FETCH_HEAD was changed by other tools.
+
+    Linux inotify is used when available, so an idle project folder costs nothing.
+    Otherwise the folder and the watched git files are polled.
+    """
+
+    def __init__(self, project_folder: str, on_change: Callable[[str], None], max_depth: int = 1,
+                 exclude: Optional[List[str]] = None, mode: str = "auto", poll_interval: float = 5.0,
+                 ignore: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            project_folder (str): The folder that holds the repositories.
+            on_change (Callable[[str], None]): Called with a repository path when it is added or its HEAD or FETCH_HEAD changes.
+            max_depth (int): How many levels below the project folder are searched for repositories.
+            exclude (Optional[List[str]]): Globs of folders skipped while searching for repositories.
+            mode (str): 'inotify', 'poll', or 'auto' to use inotify when available.
+            poll_interval (float): Seconds between polls when polling.
+            ignore (Optional[Callable[[str], bool]]): Called with a repository whose HEAD or FETCH_HEAD changed,
+                True drops the change, such as one Syncatron made itself.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        if mode not in ("auto", "inotify", "poll"):
+            raise ValueError(f"Unknown watch mode: {mode}")
+
+        self.project_folder = project_folder
+        self.on_change = on_change
+        self.max_depth = max_depth
+        self.exclude = exclude or []
+        self.poll_interval = poll_interval
+        self.ignore = ignore or (lambda repo: False)
+        self.use_inotify = mode == "inotify" or (mode == "auto" and is_inotify_available())
+
+        self._repos: Set[str] = set()
+        self._inotify: Optional[Inotify] = None
+        self._watches: Dict[int, Tuple[str, str]] = {}
+        self._watched_paths: Dict[Tuple[str, str], int] = {}
+        self._git_file_mtimes: Dict[str, Tuple[Optional[int], ...]] = {}
+        self._rescan_handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def repos(self) -> List[str]:
+        """The repositories currently known, sorted by path."""
+        return sorted(self._repos)
+
+    async def start(self) -> None:
+        """Scan the project folder and start watching it."""
+        if self.use_inotify:
+            self._inotify = Inotify()
+            asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_inotify_readable)
+            logger.info(f"Watching '{self.project_folder}' for repository changes with inotify.")
+        else:
+            logger.info(f"Polling '{self.project_folder}' for repository changes every {self.poll_interval} seconds.")
+
+        await self._rescan(notify=False)
+        if not self.use_inotify:
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        """Stop watching and release the inotify descriptor."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._rescan_handle is not None:
+            self._rescan_handle.cancel()
+            self._rescan_handle = None
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+            self._watches.clear()
+            self._watched_paths.clear()
+
+    async def _rescan(self, notify: bool = True) -> None:
+        try:
+            found = set(await asyncio.to_thread(scan_for_git_repos, self.project_folder, self.max_depth, self.exclude))
+        except ValueError as e:
+            logger.error(f"Could not scan project folder: {e}")
+            return
+
+        added, removed = found - self._repos, self._repos - found
+        self._repos = found
+        for repo in sorted(removed):
+            logger.info(f"Repository removed: {repo}")
+            self._git_file_mtimes.pop(repo, None)
+        for repo in sorted(added):
+            logger.info(f"Repository added: {repo}")
+            self._git_file_mtimes[repo] = get_git_file_mtimes(repo)
+            if notify:
+                self.on_change(repo)
+
+        if self._inotify is not None:
+            self._sync_watches()
+
+    async def _poll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self._rescan()
+            for repo in sorted(self._repos):
+                mtimes = get_git_file_mtimes(repo)
+                if self._git_file_mtimes.get(repo) != mtimes:
+                    self._git_file_mtimes[repo] = mtimes
+                    if self.ignore(repo):
+                        continue
+                    logger.info(f"Git HEAD or FETCH_HEAD changed in {repo}.")
+                    self.on_change(repo)
+
+    def _sync_watches(self) -> None:
+        wanted = set()
+        for directory in get_cached_listings(self.project_folder):
+            if directory in self._repos:
+                wanted.add((WATCH_REPO, directory))
+                git_dir = resolve_git_dir(directory)
+                if git_dir is not None:
+                    wanted.add((WATCH_GIT_DIR, git_dir))
+            else:
+                wanted.add((WATCH_DIRECTORY, directory))
+
+        for key in set(self._watched_paths) - wanted:
+            wd = self._watched_paths.pop(key)
+            self._watches.pop(wd, None)
+            self._inotify.remove_watch(wd)
+
+        for kind, path in wanted - set(self._watched_paths):
+            mask = GIT_DIR_MASK if kind == WATCH_GIT_DIR else DIRECTORY_MASK
+            try:
+                wd = self._inotify.add_watch(path, mask)
+            except OSError as e:
+                logger.warning(str(e))
+                continue
+            self._watches[wd] = (kind, path)
+            self._watched_paths[(kind, path)] = wd
+
+    def _on_inotify_readable(self) -> None:
+        rescan = False
+        changed_repos = set()
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            if wd not in self._watches:
+                continue
+
+            kind, path = self._watches[wd]
+            if mask & IN_IGNORED:
+                # The kernel dropped the watch, usually because the path was deleted
+                self._watches.pop(wd, None)
+                self._watched_paths.pop((kind, path), None)
+                rescan = True
+            elif kind == WATCH_GIT_DIR:
+                if name in WATCHED_GIT_FILES:
+                    changed_repos.update(repo for repo in self._repos if resolve_git_dir(repo) == path)
+                elif mask & IN_DELETE_SELF:
+                    rescan = True
+            elif kind == WATCH_REPO:
+                if name == ".git" or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    rescan = True
+            else:
+                rescan = True
+
+        for repo in sorted(changed_repos):
+            if self.ignore(repo):
+                continue
+            logger.info(f"Git HEAD or FETCH_HEAD changed in {repo}.")
+            self.on_change(repo)
+
+        if rescan and self._rescan_handle is None:
+            # Coalesce bursts of directory events, such as a clone, into a single rescan
+            loop = asyncio.get_running_loop()
+            self._rescan_handle = loop.call_later(0.2, self._schedule_rescan)
+
+    def _schedule_rescan(self) -> None:
+        self._rescan_handle = None
+        self._task = asyncio.create_task(self._rescan())
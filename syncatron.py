@@ -1,21 +1,34 @@
 import argparse
 import asyncio
 import logging
-from src.main import main
+from src.get_env import load_settings
+from src.log_setup import setup_logging, stop_logging
+from src.main import main, show_status
 
 if __name__ == "__main__":
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
-    
     # Set up argument parsing
     parser = argparse.ArgumentParser(description='Run the repository puller script.')
     parser.add_argument('--rf', type=int, default=None, help='Run frequency in seconds. Default is 5 seconds.')
     parser.add_argument('--pf', type=str, default=None, help='Path to the project folder. Default is "/default/project/folder".')
     parser.add_argument('--ak', type=str, default=None, help='Access key for git operations. Default is "your_access_key".')
+    parser.add_argument('--profile', type=str, default=None, metavar='DIR',
+                        help='Write a Chrome trace of every cycle to this folder.')
+    parser.add_argument('--profile-cprofile', type=int, default=0, metavar='N',
+                        help='With --profile, also profile every Nth cycle with cProfile. Default is never.')
+    parser.add_argument('--status', action='store_true',
+                        help='Show the deploy state and ETA of every repository, then exit.')
 
     args = parser.parse_args()
+    if args.status:
+        print(show_status(args.pf))
+        raise SystemExit(0)
+    settings = load_settings()
+    setup_logging(settings.log_format, rate_limit=settings.log_rate_limit, sample=settings.log_sample)
     try:
     # Call the main function with the parsed arguments
-        asyncio.run(main(run_frequency=args.rf, project_folder=args.pf, access_key=args.ak))
+        asyncio.run(main(run_frequency=args.rf, project_folder=args.pf, access_key=args.ak,
+                         profile_dir=args.profile, cprofile_every=args.profile_cprofile))
     except KeyboardInterrupt:
-        logging.info("Program interrupted. Exiting gracefully.")
\ No newline at end of file
+        logging.info("Program interrupted. Exiting gracefully.")
+    finally:
+        stop_logging()
\ No newline at end of file
@@ -0,0 +1,33 @@
+import pytest
+from src.build_history import WINDOW, DurationStats, estimate_finish_times, get_priority
+
+def test_moving_average_and_percentiles():
+    stats = DurationStats()
+    assert stats.percentile(50) is None
+    for duration in (10, 20, 30, 40):
+        stats.add(duration, alpha=0.5)
+    assert stats.ewma == pytest.approx(31.25)
+    assert stats.count == 4
+    assert stats.percentile(50) == 20
+    assert stats.percentile(90) == 40
+
+def test_history_keeps_a_bounded_window():
+    stats = DurationStats()
+    for duration in range(WINDOW + 10):
+        stats.add(duration)
+    assert stats.count == WINDOW + 10
+    assert stats.samples == list(range(10, WINDOW + 10))
+
+def test_priority_prefers_short_deploys_until_long_ones_have_waited():
+    assert get_priority(10, 0, 60) < get_priority(900, 0, 60)
+    # Unknown deploys rank like the default
+    assert get_priority(None, 0, 60) == get_priority(60, 0, 60)
+    # After waiting as long as it takes, a 15 minute build goes ahead of a fresh 10 second restart
+    assert get_priority(900, 900, 60) < get_priority(10, 5, 60)
+
+def test_estimate_finish_times_runs_pending_deploys_shortest_first():
+    finish = estimate_finish_times({"/build": 100.0}, {"/slow": 50.0, "/quick": 5.0, "/config": 2.0}, workers=2)
+    assert finish == {"/build": 100.0, "/config": 2.0, "/quick": 7.0, "/slow": 57.0}
+
+def test_estimate_finish_times_of_overdue_deploys():
+    assert estimate_finish_times({"/build": -30.0}, {"/next": 10.0}, workers=1) == {"/build": 0.0, "/next": 10.0}
@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from src.deploy_executor import DeployExecutor, HostResources, read_host_resources
+
+GIB = 1024 * 1024 * 1024
+
+def plenty():
+    return HostResources(cpu_count=8, memory_available=64 * GIB, load_average=0.5)
+
+async def run_deploys(executor, repos, hold=0.05):
+    running, peak, order = set(), [0], []
+
+    async def deploy(repo):
+        running.add(repo)
+        peak[0] = max(peak[0], len(running))
+        order.append(repo)
+        await asyncio.sleep(hold)
+        running.discard(repo)
+        return repo
+
+    results = await asyncio.gather(*(executor.run(repo, lambda repo=repo: deploy(repo)) for repo in repos))
+    return results, peak[0], order
+
+def test_read_host_resources(tmp_path):
+    (tmp_path / "meminfo").write_text("MemTotal:       16384000 kB\nMemAvailable:    2048000 kB\n")
+    (tmp_path / "loadavg").write_text("1.50 0.80 0.40 2/300 12345\n")
+    resources = read_host_resources(str(tmp_path))
+    assert resources.memory_available == 2048000 * 1024
+    assert resources.load_average == 1.5
+    assert resources.cpu_count >= 1
+
+def test_read_host_resources_without_proc(tmp_path):
+    resources = read_host_resources(str(tmp_path))
+    assert resources.memory_available is None
+    assert resources.load_average is None
+
+def test_runs_deploys_concurrently_up_to_max_workers():
+    executor = DeployExecutor(max_workers=3, memory_per_deploy=GIB, read_resources=plenty)
+    results, peak, _ = asyncio.run(run_deploys(executor, [f"/repo{i}" for i in range(6)]))
+    assert results == [f"/repo{i}" for i in range(6)]
+    assert peak == 3
+    assert executor.running == 0
+
+@pytest.mark.parametrize("resources", [
+    HostResources(cpu_count=8, memory_available=GIB + GIB // 2, load_average=0.5),
+    HostResources(cpu_count=2, memory_available=64 * GIB, load_average=2.0),
+])
+def test_admits_a_single_deploy_when_the_host_is_busy(resources):
+    executor = DeployExecutor(max_workers=4, memory_per_deploy=GIB, read_resources=lambda: resources)
+    _, peak, _ = asyncio.run(run_deploys(executor, ["/a", "/b", "/c"]))
+    assert peak == 1
+
+def test_reserves_memory_for_builds_that_just_started():
+    resources = HostResources(cpu_count=8, memory_available=2 * GIB + GIB // 2, load_average=0.5)
+    executor = DeployExecutor(max_workers=4, memory_per_deploy=GIB, read_resources=lambda: resources)
+    _, peak, _ = asyncio.run(run_deploys(executor, ["/a", "/b", "/c"]))
+    assert peak == 2
+
+def test_same_repository_is_never_deployed_twice_at_once():
+    executor = DeployExecutor(max_workers=4, memory_per_deploy=GIB, read_resources=plenty)
+    _, peak, order = asyncio.run(run_deploys(executor, ["/a", "/a", "/a"]))
+    assert peak == 1
+    assert order == ["/a", "/a", "/a"]
+
+def test_failed_deploy_releases_its_slot():
+    executor = DeployExecutor(max_workers=1, memory_per_deploy=GIB, read_resources=plenty)
+
+    async def fail():
+        raise RuntimeError("build failed")
+
+    async def succeed():
+        return "ok"
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await executor.run("/a", fail)
+        return await asyncio.wait_for(executor.run("/a", succeed), 1)
+
+    assert asyncio.run(run()) == "ok"
+    assert executor.running == 0
+
+def test_shortest_expected_deploy_starts_first():
+    executor = DeployExecutor(max_workers=1, memory_per_deploy=GIB, read_resources=plenty)
+    order = []
+
+    async def deploy(repo):
+        order.append(repo)
+        await asyncio.sleep(0.02)
+
+    async def run():
+        first = asyncio.create_task(executor.run("/running", lambda: deploy("/running")))
+        await asyncio.sleep(0)
+        expected = {"/image-build": 900.0, "/restart": 10.0, "/config": 2.0}
+        await asyncio.gather(first, *(executor.run(repo, lambda repo=repo: deploy(repo), seconds)
+                                      for repo, seconds in expected.items()))
+
+    asyncio.run(run())
+    assert order == ["/running", "/config", "/restart", "/image-build"]
+
+def test_fifo_order_ignores_expected_durations():
+    executor = DeployExecutor(max_workers=1, memory_per_deploy=GIB, read_resources=plenty, shortest_first=False)
+    _, _, order = asyncio.run(run_deploys(executor, ["/a", "/b", "/c"]))
+    assert order == ["/a", "/b", "/c"]
+
+def test_long_deploy_ages_ahead_of_new_short_ones(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("src.deploy_executor.time.monotonic", lambda: clock[0])
+    executor = DeployExecutor(max_workers=1, memory_per_deploy=GIB, read_resources=plenty)
+    executor._waiting = {"/image-build": (900.0, 1000.0), "/config": (2.0, 1000.0)}
+    assert executor.next_in_line() == "/config"
+    # Once it has waited as long as it takes, the build goes ahead of deploys that arrive later
+    clock[0] = 1900.0
+    executor._waiting["/config"] = (2.0, 1899.0)
+    assert executor.next_in_line() == "/image-build"
+
+def test_deploy_without_history_counts_as_the_median(monkeypatch):
+    monkeypatch.setattr("src.deploy_executor.time.monotonic", lambda: 1000.0)
+    executor = DeployExecutor(max_workers=1, memory_per_deploy=GIB, read_resources=plenty)
+    executor._waiting = {"/image-build": (900.0, 1000.0), "/tests": (500.0, 1000.0), "/unknown": (None, 1000.0)}
+    assert executor.next_in_line() == "/tests"
+    # Counted as 700 seconds, so waiting 250 seconds longer puts it ahead of the 500 second deploy
+    executor._waiting["/unknown"] = (None, 750.0)
+    assert executor.next_in_line() == "/unknown"
@@ -0,0 +1,32 @@
+import json
+from src.deploy_graph import break_cycles, build_graph, get_dependencies, get_deploy_levels
+
+def test_get_dependencies_resolves_siblings(tmp_path):
+    api = tmp_path / "api"
+    api.mkdir()
+    (api / ".syncatron.json").write_text(json.dumps({"depends_on": ["db", "infra/network", "api"]}))
+    assert get_dependencies(str(api)) == [str(tmp_path / "db"), str(tmp_path / "infra" / "network")]
+
+def test_get_dependencies_ignores_invalid_declarations(tmp_path, caplog):
+    (tmp_path / ".syncatron.json").write_text(json.dumps({"depends_on": {"db": True}}))
+    assert get_dependencies(str(tmp_path)) == []
+    assert "Ignoring depends_on" in caplog.text
+    (tmp_path / ".syncatron.json").write_text(json.dumps({}))
+    assert get_dependencies(str(tmp_path)) == []
+
+def test_build_graph_leaves_out_repositories_outside_the_set():
+    declared = {"/web": ["/api", "/cdn"], "/api": ["/db"]}
+    graph = build_graph(["/web", "/api"], lambda repo: declared.get(repo, []))
+    assert graph == {"/web": {"/api"}, "/api": set()}
+
+def test_get_deploy_levels():
+    graph = {"/web": {"/api"}, "/api": {"/db", "/network"}, "/db": {"/network"}, "/network": set(), "/docs": set()}
+    assert get_deploy_levels(graph) == [["/docs", "/network"], ["/db"], ["/api"], ["/web"]]
+
+def test_break_cycles_keeps_the_rest_of_the_graph():
+    graph = {"/a": {"/b"}, "/b": {"/c"}, "/c": {"/a"}, "/d": {"/a"}}
+    acyclic, cycles = break_cycles(graph)
+    assert len(cycles) == 1 and cycles[0][0] == cycles[0][-1]
+    assert sum(len(dependencies) for dependencies in acyclic.values()) == 3
+    assert acyclic["/d"] == {"/a"}
+    assert len(get_deploy_levels(graph)) == 3
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import shutil
+import pytest
+from src.deploy_planner import DeployPlan, ServiceSources, load_compose_services, plan_changes, plan_deploy
+from src.docker_handler import get_deploy_steps
+from src.process_runner import ProcessResult
+
+PROJECT = "/projects/shop"
+
+SERVICES = {
+    "api": ServiceSources("api", build_context=f"{PROJECT}/api", dockerfile=f"{PROJECT}/api/Dockerfile"),
+    "web": ServiceSources("web", build_context=f"{PROJECT}/web", dockerfile=f"{PROJECT}/docker/web.Dockerfile"),
+    "proxy": ServiceSources("proxy", bind_sources=[f"{PROJECT}/proxy/nginx.conf"]),
+    "db": ServiceSources("db"),
+}
+
+def test_readme_change_affects_nothing():
+    plan = plan_changes(PROJECT, [f"{PROJECT}/README.md"], SERVICES)
+    assert plan.is_empty
+
+def test_build_context_change_rebuilds_only_that_service():
+    plan = plan_changes(PROJECT, [f"{PROJECT}/api/app.py", f"{PROJECT}/docker/web.Dockerfile"], SERVICES)
+    assert plan.build_services == ["api", "web"]
+    assert plan.restart_services == []
+    assert not plan.recreate
+
+def test_bind_mount_change_restarts_service():
+    plan = plan_changes(PROJECT, [f"{PROJECT}/proxy/nginx.conf"], SERVICES)
+    assert plan.build_services == []
+    assert plan.restart_services == ["proxy"]
+
+def test_compose_file_change_rebuilds_and_recreates_project():
+    plan = plan_changes(PROJECT, [f"{PROJECT}/docker-compose.yml"], SERVICES)
+    assert plan.recreate
+    assert plan.build_services == ["api", "web"]
+    assert plan.restart_services == []
+
+def test_env_file_change_rebuilds_services_with_build_context():
+    plan = plan_changes(PROJECT, [f"{PROJECT}/.env", f"{PROJECT}/proxy/nginx.conf"], SERVICES)
+    assert plan.recreate
+    assert plan.build_services == ["api", "web"]
+    assert plan.restart_services == ["proxy"]
+
+def test_sibling_directory_is_not_within_context():
+    plan = plan_changes(PROJECT, [f"{PROJECT}/api-docs/index.md"], SERVICES)
+    assert plan.is_empty
+
+def test_plan_deploy_without_previous_commit_is_full():
+    assert asyncio.run(plan_deploy(PROJECT, None, "bbb")).full
+
+def test_load_compose_services(monkeypatch):
+    config = {"services": {
+        "api": {"build": {"context": f"{PROJECT}/api", "dockerfile": "Dockerfile.prod"},
+                "volumes": [{"type": "bind", "source": f"{PROJECT}/config", "target": "/config"},
+                            {"type": "volume", "source": "data", "target": "/data"}]},
+        "remote": {"build": {"context": "https://github.com/example/remote.git"}},
+        "db": {"image": "postgres:16"},
+    }}
+    monkeypatch.setattr("src.deploy_planner.get_docker_compose_file", lambda path: f"{path}/docker-compose.yml")
+    async def fake_run_command(args, sink=None):
+        # A config longer than the kept tail, behind a warning on stderr
+        lines = json.dumps(config, indent=2).splitlines()
+        sink("stderr", "WARN[0000] docker-compose.yml: the attribute `version` is obsolete")
+        for line in lines:
+            sink("stdout", line)
+        return ProcessResult(args=args, exit_code=0, tail=lines[-3:])
+
+    monkeypatch.setattr("src.deploy_planner.run_command", fake_run_command)
+
+    services = asyncio.run(load_compose_services(PROJECT))
+    assert services["api"].build_context == f"{PROJECT}/api"
+    assert services["api"].dockerfile == f"{PROJECT}/api/Dockerfile.prod"
+    assert services["api"].bind_sources == [f"{PROJECT}/config"]
+    assert services["remote"].build_context is None
+    assert services["db"].build_context is None
+
+def test_plan_deploy_uses_git_diff(monkeypatch):
+    repo = tempfile.mkdtemp()
+    try:
+        def git(*args):
+            return subprocess.run(["git", "-C", repo, *args], check=True, capture_output=True, text=True).stdout.strip()
+
+        git("init", "-q")
+        git("config", "user.email", "test@example.com")
+        git("config", "user.name", "test")
+        os.makedirs(os.path.join(repo, "api"))
+        for name in ("README.md", "api/app.py"):
+            with open(os.path.join(repo, name), "w") as handle:
+                handle.write("one\n")
+        git("add", "-A")
+        git("commit", "-q", "-m", "one")
+        first = git("rev-parse", "HEAD")
+        with open(os.path.join(repo, "api/app.py"), "w") as handle:
+            handle.write("two\n")
+        git("commit", "-q", "-am", "two")
+        second = git("rev-parse", "HEAD")
+
+        services = {"api": ServiceSources("api", build_context=os.path.join(repo, "api"))}
+        async def fake_load_compose_services(path):
+            return services
+
+        monkeypatch.setattr("src.deploy_planner.load_compose_services", fake_load_compose_services)
+        assert asyncio.run(plan_deploy(repo, first, second)).build_services == ["api"]
+        assert asyncio.run(plan_deploy(repo, "0" * 40, second)).full
+    finally:
+        shutil.rmtree(repo)
+
+@pytest.mark.parametrize("plan, expected", [
+    (None, ["rebuild", "start"]),
+    (DeployPlan(), []),
+    (DeployPlan(build_services=["api"]), ["rebuild", "start"]),
+    (DeployPlan(restart_services=["proxy"]), ["restart"]),
+    (DeployPlan(recreate=True), ["start"]),
+])
+def test_get_deploy_steps(plan, expected):
+    assert [step.name for step in get_deploy_steps(PROJECT, plan)] == expected
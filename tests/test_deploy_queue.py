@@ -0,0 +1,148 @@
+import asyncio
+from src.deploy_executor import DeployExecutor, HostResources
+from src.deploy_queue import DeployQueue
+
+def make_queue(hold=0.1, **kwargs):
+    deployed = []
+    started = []
+
+    async def deploy(repo, revision):
+        started.append((repo, revision))
+        await asyncio.sleep(hold)
+        deployed.append((repo, revision))
+
+    executor = DeployExecutor(max_workers=4, read_resources=lambda: HostResources(cpu_count=4))
+    return DeployQueue(deploy, executor, **kwargs), started, deployed
+
+def test_burst_of_submissions_costs_one_deploy():
+    async def run():
+        queue, started, deployed = make_queue(debounce=0.1)
+        for revision in ("a1", "a2", "a3"):
+            queue.submit("/repo", revision)
+            await asyncio.sleep(0.02)
+        await queue.join()
+        return started, deployed
+
+    started, deployed = asyncio.run(run())
+    assert started == [("/repo", "a3")]
+    assert deployed == [("/repo", "a3")]
+
+def test_submissions_during_a_deploy_merge_into_one_follow_up():
+    async def run():
+        queue, started, deployed = make_queue()
+        queue.submit("/repo", "a1")
+        await asyncio.sleep(0.03)
+        assert queue.is_deploying("/repo")
+        queue.submit("/repo", "a2")
+        queue.submit("/repo", "a3")
+        assert queue.pending_revision("/repo") == "a3"
+        await queue.join()
+        return deployed
+
+    assert asyncio.run(run()) == [("/repo", "a1"), ("/repo", "a3")]
+
+def test_revision_already_being_deployed_is_not_queued_again():
+    async def run():
+        queue, started, deployed = make_queue()
+        queue.submit("/repo", "a1")
+        await asyncio.sleep(0.03)
+        queue.submit("/repo", "a1")
+        await queue.join()
+        return deployed
+
+    assert asyncio.run(run()) == [("/repo", "a1")]
+
+def test_repositories_are_deployed_independently():
+    async def run():
+        queue, started, deployed = make_queue()
+        queue.submit("/one", "a1")
+        queue.submit("/two", "b1")
+        await asyncio.sleep(0.03)
+        running = queue.is_deploying("/one") and queue.is_deploying("/two")
+        await queue.join()
+        return running, deployed
+
+    running, deployed = asyncio.run(run())
+    assert running
+    assert sorted(deployed) == [("/one", "a1"), ("/two", "b1")]
+
+def test_cancel_superseded_deploy():
+    async def run():
+        deferred = []
+        queue, started, deployed = make_queue(hold=5, on_deferred=deferred.append)
+        queue.submit("/repo", "a1")
+        await asyncio.sleep(0.03)
+        queue.defer("/repo")
+        assert await queue.cancel("/repo")
+        assert not queue.is_deploying("/repo")
+        await queue.join()
+        return deployed, deferred
+
+    deployed, deferred = asyncio.run(run())
+    assert deployed == []
+    assert deferred == ["/repo"]
+
+def test_cancel_without_running_deploy():
+    async def run():
+        queue, _, _ = make_queue()
+        return await queue.cancel("/repo")
+
+    assert not asyncio.run(run())
+
+def test_failed_deploy_does_not_stop_the_queue():
+    async def run():
+        attempts = []
+
+        async def deploy(repo, revision):
+            attempts.append(revision)
+            if revision == "a1":
+                raise RuntimeError("build failed")
+
+        queue = DeployQueue(deploy, DeployExecutor(max_workers=1, read_resources=lambda: HostResources(cpu_count=1)))
+        queue.submit("/repo", "a1")
+        await asyncio.sleep(0.01)
+        queue.submit("/repo", "a2")
+        await queue.join()
+        return attempts
+
+    assert asyncio.run(run()) == ["a1", "a2"]
+
+def test_close_cancels_running_deploys():
+    async def run():
+        queue, _, deployed = make_queue(hold=5)
+        queue.submit("/repo", "a1")
+        await asyncio.sleep(0.03)
+        await asyncio.wait_for(queue.close(), 1)
+        return deployed
+
+    assert asyncio.run(run()) == []
+
+def test_dependents_wait_only_for_their_dependencies():
+    dependencies = {"/api": ["/db"], "/web": ["/api"], "/db": [], "/docs": []}
+
+    async def run():
+        queue, started, deployed = make_queue(get_dependencies=dependencies.get)
+        for repo in ("/web", "/api", "/docs", "/db"):
+            queue.submit(repo, "r1")
+        await asyncio.sleep(0.03)
+        # The database and the unrelated docs deploy in parallel, the rest waits
+        assert sorted(repo for repo, _ in started) == ["/db", "/docs"]
+        assert queue.blocking_dependencies("/web") == ["/api"]
+        await queue.join()
+        return [repo for repo, _ in deployed]
+
+    deployed = asyncio.run(run())
+    assert deployed.index("/db") < deployed.index("/api") < deployed.index("/web")
+
+def test_dependency_cycle_is_reported_and_broken(caplog):
+    dependencies = {"/a": ["/b"], "/b": ["/a"]}
+
+    async def run():
+        queue, started, deployed = make_queue(get_dependencies=dependencies.get)
+        queue.submit("/a", "r1")
+        queue.submit("/b", "r1")
+        await asyncio.wait_for(queue.join(), 1)
+        return [repo for repo, _ in deployed]
+
+    assert sorted(asyncio.run(run())) == ["/a", "/b"]
+    assert "Dependency cycle between repositories" in caplog.text
@@ -0,0 +1,38 @@
+import pytest
+from src.deploy_status import format_duration, format_status, get_status
+from src.state_store import StateStore
+
+@pytest.fixture
+def state_store():
+    store = StateStore(':memory:')
+    yield store
+    store.close()
+
+def test_status_shows_history_and_etas(state_store, monkeypatch):
+    monkeypatch.setattr('src.state_store.time.time', lambda: 1000.0)
+    for path, duration in (('/repos/api', 600.0), ('/repos/docs', 20.0), ('/repos/web', 300.0)):
+        state_store.record_duration(path, 'deploy', duration)
+    state_store.record_duration('/repos/api', 'rebuild', 540.0)
+    state_store.mark_deployed('/repos/docs', 'aaa', None, None)
+    state_store.mark_deploying('/repos/api', 'bbb', None)
+    state_store.mark_pending('/repos/web', 'ccc')
+    state_store.mark_pending('/repos/new', 'ddd')
+
+    statuses = {status.path: status for status in get_status(state_store, workers=1, now=1100.0)}
+    assert statuses['/repos/api'].eta == 500.0
+    assert statuses['/repos/api'].build == 540.0
+    # Without history the new repository counts as the median deploy of 300 seconds
+    assert statuses['/repos/new'].eta == 800.0
+    assert statuses['/repos/web'].eta == 1100.0
+    assert statuses['/repos/docs'].eta is None
+    assert statuses['/repos/docs'].revision == 'aaa'
+
+    lines = format_status(list(statuses.values())).splitlines()
+    assert lines[0].split() == ['REPOSITORY', 'STATUS', 'REVISION', 'DEPLOY', 'P50', 'P90', 'BUILD', 'ETA']
+    assert lines[1].split() == ['/repos/api', 'deploying', 'bbb', '10m00s', '10m00s', '10m00s', '9m00s', '8m20s']
+
+def test_format_duration():
+    assert format_duration(None) == '-'
+    assert format_duration(12.4) == '12s'
+    assert format_duration(185) == '3m05s'
+    assert format_duration(3720) == '1h02m'
@@ -0,0 +1,169 @@
+import json
+import os
+import socketserver
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+import pytest
+from src import docker_engine
+from src.docker_engine import (
+    get_compose_project_name,
+    get_docker_root,
+    get_project_containers,
+    prune_build_cache,
+    prune_images,
+    prune_tagged_images,
+    tag_image,
+)
+
+CONTAINERS = [
+    {"Id": "c1", "Names": ["/shop-api-1"], "Image": "shop-api", "ImageID": "sha256:aaa", "State": "running",
+     "Status": "Up 2 minutes (healthy)", "Labels": {"com.docker.compose.project": "shop",
+                                                     "com.docker.compose.service": "api"}},
+    {"Id": "c2", "Names": ["/shop-db-1"], "Image": "postgres", "ImageID": "sha256:bbb", "State": "exited",
+     "Status": "Exited (1) 5 seconds ago", "Labels": {"com.docker.compose.project": "shop",
+                                                       "com.docker.compose.service": "db"}},
+]
+
+IMAGES = [
+    {"Id": "sha256:aaa", "RepoTags": ["shop-api:latest"], "Created": 1000, "Size": 100},
+    {"Id": "sha256:old", "RepoTags": ["shop-api:v1", "registry:5000/shop-api:v1"], "Created": 1000, "Size": 200},
+    {"Id": "sha256:prev", "RepoTags": ["shop-web:syncatron-previous"], "Created": 1000, "Size": 400},
+    {"Id": "sha256:new", "RepoTags": ["shop-web:latest"], "Created": 4102444800, "Size": 800},
+    {"Id": "sha256:none", "RepoTags": ["<none>:<none>"], "Created": 1000, "Size": 1600},
+]
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    """Answers the handful of engine API endpoints Syncatron uses."""
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        return "fake-engine"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(("GET", url.path, parse_qs(url.query)))
+        if url.path.endswith("/version"):
+            self.reply(200, {"ApiVersion": "1.41", "Version": "24.0.0"})
+        elif url.path.endswith("/info"):
+            self.reply(200, {"DockerRootDir": "/data/docker"})
+        elif url.path.endswith("/images/json"):
+            self.reply(200, IMAGES)
+        elif url.path.endswith("/containers/json"):
+            self.reply(200, CONTAINERS)
+        else:
+            self.reply(404, {"message": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.requests.append(("POST", url.path, parse_qs(url.query)))
+        if url.path.endswith("/images/prune"):
+            self.reply(200, {"ImagesDeleted": [{"Deleted": "sha256:old"}], "SpaceReclaimed": 1024})
+        elif url.path.endswith("/build/prune"):
+            self.reply(200, {"CachesDeleted": ["layer"], "SpaceReclaimed": 2048})
+        elif "/images/" in url.path and url.path.endswith("/tag"):
+            self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.reply(404, {"message": "not found"})
+
+    def do_DELETE(self):
+        url = urlparse(self.path)
+        self.server.requests.append(("DELETE", url.path, parse_qs(url.query)))
+        if "/images/" in url.path:
+            self.reply(200, [{"Untagged": url.path.split("/images/", 1)[1]}])
+        else:
+            self.reply(404, {"message": "not found"})
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, FakeEngineHandler)
+        self.requests = []
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+@pytest.fixture
+def fake_engine(monkeypatch):
+    socket_path = os.path.join(tempfile.mkdtemp(), "docker.sock")
+    server = FakeEngine(socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{socket_path}")
+    docker_engine.close_client()
+    yield server
+    docker_engine.close_client()
+    server.shutdown()
+    server.server_close()
+
+def test_prune_images(fake_engine):
+    result = prune_images()
+    assert result == {"ImagesDeleted": [{"Deleted": "sha256:old"}], "SpaceReclaimed": 1024}
+    method, path, query = fake_engine.requests[-1]
+    assert (method, path) == ("POST", "/v1.41/images/prune")
+    assert json.loads(query["filters"][0]) == {"dangling": ["true"]}
+
+def test_prune_tagged_images_keeps_rollback_images(fake_engine):
+    result = prune_tagged_images({"until": "24h"}, keep_tag="syncatron-previous")
+    removed = [path for method, path, _ in fake_engine.requests if method == "DELETE"]
+    # The image a container uses, the rollback image, the recent one and the dangling one stay
+    assert removed == ["/v1.41/images/shop-api:v1", "/v1.41/images/registry:5000/shop-api:v1"]
+    assert result["SpaceReclaimed"] == 200
+
+def test_prune_build_cache(fake_engine):
+    result = prune_build_cache({"until": "24h"})
+    assert result == {"CachesDeleted": ["layer"], "SpaceReclaimed": 2048}
+    method, path, query = fake_engine.requests[-1]
+    assert (method, path) == ("POST", "/v1.41/build/prune")
+    assert json.loads(query["filters"][0]) == {"until": ["24h"]}
+
+def test_get_docker_root(fake_engine):
+    assert get_docker_root() == "/data/docker"
+
+def test_get_project_containers(fake_engine):
+    containers = get_project_containers("shop")
+    assert [(c.service, c.status, c.health) for c in containers] == [("api", "running", "healthy"),
+                                                                      ("db", "exited", None)]
+    assert (containers[0].name, containers[0].image, containers[0].image_id) == ("shop-api-1", "shop-api", "sha256:aaa")
+    assert [c.exit_code for c in containers] == [None, 1]
+    _, _, query = fake_engine.requests[-1]
+    assert json.loads(query["filters"][0]) == {"label": ["com.docker.compose.project=shop"]}
+
+def test_tag_image(fake_engine):
+    assert tag_image("sha256:aaa", "shop-api", "syncatron-previous")
+    method, path, query = fake_engine.requests[-1]
+    assert (method, path) == ("POST", "/v1.41/images/sha256:aaa/tag")
+    assert query["repo"] == ["shop-api"] and query["tag"] == ["syncatron-previous"]
+
+def test_client_reuses_its_connections(fake_engine):
+    get_project_containers("shop")
+    prune_images()
+    connections = fake_engine.connections
+    for _ in range(5):
+        get_project_containers("shop")
+        prune_images()
+    assert fake_engine.connections == connections
+
+def test_get_compose_project_name(monkeypatch):
+    monkeypatch.delenv("COMPOSE_PROJECT_NAME", raising=False)
+    assert get_compose_project_name("/projects/My Shop.v2/") == "myshopv2"
+    monkeypatch.setenv("COMPOSE_PROJECT_NAME", "Custom")
+    assert get_compose_project_name("/projects/shop") == "custom"
@@ -1,18 +1,26 @@
 # test_docker_operations.py
 
+import asyncio
 import pytest
-import subprocess
 import logging
 import os
+import time
+from types import SimpleNamespace
 from src.docker_handler import (
     get_docker_compose_file,
     teardown_container,
     rebuild_container,
     start_container,
-    remove_unused_images,
     run_command,
     handle_docker_operations,
+    should_build_without_cache,
+    split_image_reference,
+    wait_until_healthy,
 )
+from src.docker_engine import ContainerStatus
+from src.process_runner import ProcessResult
+from src.deploy_planner import DeployPlan
+from src.state_store import StateStore
 
 @pytest.fixture(scope='module', autouse=True)
 def configure_logging():
@@ -34,41 +42,252 @@ def test_get_docker_compose_file_invalid_path():
     with pytest.raises(ValueError, match="Path cannot be empty"):
         get_docker_compose_file("")
 
-def test_teardown_container_valid(mock_docker_compose_file, monkeypatch):
-    def mock_run(command, shell, text=True, capture_output=True):
-        return subprocess.CompletedProcess(args=command, returncode=0)
+@pytest.fixture
+def mock_run_process(monkeypatch):
+    # Record the commands instead of running docker
+    commands = []
 
-    monkeypatch.setattr(subprocess, "run", mock_run)
-    assert teardown_container(mock_docker_compose_file)  # Should return True
+    async def fake_run_process(args, timeout=None, **kwargs):
+        commands.append(args)
+        return ProcessResult(args=list(args), exit_code=0, tail=["Test Output"])
 
-def test_rebuild_container_valid(mock_docker_compose_file, monkeypatch):
-    def mock_run(command, shell, text=True, capture_output=True):
-        return subprocess.CompletedProcess(args=command, returncode=0)
+    monkeypatch.setattr("src.docker_handler.run_process", fake_run_process)
+    yield commands
 
-    monkeypatch.setattr(subprocess, "run", mock_run)
-    assert rebuild_container(mock_docker_compose_file)  # Should return True
+def test_teardown_container_valid(mock_docker_compose_file, mock_run_process):
+    assert asyncio.run(teardown_container(mock_docker_compose_file))  # Should return True
+    assert mock_run_process == [["docker", "compose", "-f", "/mock/path/docker-compose.yml", "down"]]
 
-def test_start_container_valid(mock_docker_compose_file, monkeypatch):
-    def mock_run(command, shell, text=True, capture_output=True):
-        return subprocess.CompletedProcess(args=command, returncode=0)
+def test_rebuild_container_valid(mock_docker_compose_file, mock_run_process):
+    assert asyncio.run(rebuild_container(mock_docker_compose_file))  # Should return True
+    assert asyncio.run(rebuild_container(mock_docker_compose_file, ["api"], no_cache=True))
+    assert mock_run_process[0][-1] == "build"
+    assert mock_run_process[1][-3:] == ["build", "--no-cache", "api"]
 
-    monkeypatch.setattr(subprocess, "run", mock_run)
-    assert start_container(mock_docker_compose_file)  # Should return True
+def test_start_container_valid(mock_docker_compose_file, mock_run_process):
+    assert asyncio.run(start_container(mock_docker_compose_file))  # Should return True
+    assert asyncio.run(start_container(mock_docker_compose_file, ["api"]))
+    assert mock_run_process[1][-4:] == ["up", "-d", "--no-deps", "api"]
 
-def test_remove_unused_images(mock_docker_compose_file, monkeypatch):
-    def mock_run(command, shell, text=True, capture_output=True):
-        return subprocess.CompletedProcess(args=command, returncode=0)
+def test_start_container_failure(mock_docker_compose_file, monkeypatch, caplog):
+    async def failing_run_process(args, timeout=None, **kwargs):
+        return ProcessResult(args=list(args), exit_code=1, tail=["step 3/9", "no space left on device"])
 
-    monkeypatch.setattr(subprocess, "run", mock_run)
-    assert remove_unused_images()  # Should return True
+    monkeypatch.setattr("src.docker_handler.run_process", failing_run_process)
+    assert not asyncio.run(start_container(mock_docker_compose_file))
+    assert "no space left on device" in caplog.text
 
-def test_run_command_valid(monkeypatch):
-    def mock_run(command, shell, text=True, capture_output=True):
-        return subprocess.CompletedProcess(args=command, returncode=0, stdout="Test Output", stderr="")
+def test_run_command_valid(mock_run_process):
+    result = asyncio.run(run_command(["echo", "Test"]))
+    assert (result.output, result.exit_code) == ("Test Output", 0)  # Matches the mocked output
 
-    monkeypatch.setattr(subprocess, "run", mock_run)
-    assert run_command("echo Test") == ("Test Output", "", 0)  # Matches the mocked output
+def test_run_command_empty():
+    with pytest.raises(ValueError, match="Command cannot be empty"):
+        asyncio.run(run_command([]))
 
 def test_handle_docker_operations_invalid_path(caplog):
-    handle_docker_operations("")
-    assert "Invalid path provided. Exiting." in caplog.text
\ No newline at end of file
+    asyncio.run(handle_docker_operations(""))
+    assert "Invalid path provided. Exiting." in caplog.text
+
+@pytest.fixture
+def recorded_operations(monkeypatch):
+    calls = []
+
+    def recorder(name):
+        async def operation(*args, **kwargs):
+            calls.append(name)
+            return True
+        return operation
+
+    for name in ("teardown_container", "rebuild_container", "start_container"):
+        monkeypatch.setattr(f"src.docker_handler.{name}", recorder(name))
+    monkeypatch.setattr("src.docker_handler.get_compose_file_hash", lambda path: "hash1")
+    monkeypatch.setattr("src.docker_handler.get_project_containers", lambda project: [])
+    yield calls
+
+def test_handle_docker_operations_records_deploy(recorded_operations):
+    state_store = StateStore(":memory:")
+    report = asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb"))
+    # Rolling mode builds before it touches the running containers
+    assert recorded_operations == ["rebuild_container", "start_container"]
+    assert report.success and report.mode == "rolling"
+    state = state_store.get("/mock/path")
+    assert (state.deploy_status, state.deployed_sha, state.compose_hash) == ("deployed", "bbb", "hash1")
+    assert state.build_duration is not None
+
+def test_handle_docker_operations_recreate_mode(recorded_operations):
+    report = asyncio.run(handle_docker_operations("/mock/path", mode="recreate"))
+    assert recorded_operations == ["teardown_container", "rebuild_container", "start_container"]
+    assert report.success
+
+def test_handle_docker_operations_measures_downtime(monkeypatch, recorded_operations):
+    clock = iter(range(100))
+    monkeypatch.setattr("src.docker_handler.time", SimpleNamespace(monotonic=lambda: next(clock), time=time.time))
+    report = asyncio.run(handle_docker_operations("/mock/path"))
+    # Only the start step takes the services down in rolling mode
+    assert report.downtime == 1
+    assert report.build_duration == 1
+
+    clock = iter(range(100))
+    report = asyncio.run(handle_docker_operations("/mock/path", mode="recreate"))
+    # Teardown, build and start all run while the services are down
+    assert report.downtime == 5
+
+def test_handle_docker_operations_failure_report(monkeypatch, recorded_operations):
+    async def failing_start(*args, **kwargs):
+        return False
+
+    monkeypatch.setattr("src.docker_handler.start_container", failing_start)
+    state_store = StateStore(":memory:")
+    report = asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb"))
+    assert not report.success
+    assert state_store.get("/mock/path").deploy_status == "failed"
+
+def test_should_build_without_cache(tmp_path):
+    state_store = StateStore(":memory:")
+    assert not should_build_without_cache(str(tmp_path), state_store)
+    # The interval forces a no-cache build until one has been recorded
+    assert should_build_without_cache(str(tmp_path), state_store, no_cache_interval=24)
+    state_store.record_no_cache_build(str(tmp_path))
+    assert not should_build_without_cache(str(tmp_path), state_store, no_cache_interval=24)
+
+    (tmp_path / ".syncatron.json").write_text('{"no_cache": true}')
+    assert should_build_without_cache(str(tmp_path), state_store)
+
+def test_handle_docker_operations_skips_deployed_revision(recorded_operations):
+    state_store = StateStore(":memory:")
+    state_store.mark_deployed("/mock/path", "bbb", "hash1", 1.0)
+    asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb"))
+    assert recorded_operations == []
+
+def test_handle_docker_operations_resumes_interrupted_deploy(recorded_operations):
+    state_store = StateStore(":memory:")
+    state_store.mark_deploying("/mock/path", "bbb", "hash1")
+    state_store.mark_step_completed("/mock/path", "rebuild")
+    asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb"))
+    assert recorded_operations == ["start_container"]
+
+def test_handle_docker_operations_records_durations(monkeypatch, recorded_operations):
+    clock = iter(range(100))
+    monkeypatch.setattr("src.docker_handler.time", SimpleNamespace(monotonic=lambda: next(clock), time=time.time))
+    state_store = StateStore(":memory:")
+    plan = DeployPlan(build_services=["web"])
+    asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb", plan))
+
+    durations = state_store.get_durations("/mock/path")
+    assert {phase: stats.ewma for phase, stats in durations.items()} == {"rebuild": 1, "start": 1, "deploy": 5}
+    assert set(state_store.get_durations("/mock/path", "web")) == {"rebuild", "start"}
+
+@pytest.mark.parametrize("reference, expected", [
+    ("shop-api", ("shop-api", "latest")),
+    ("postgres:16", ("postgres", "16")),
+    ("registry:5000/team/app", ("registry:5000/team/app", "latest")),
+    ("registry:5000/team/app:1.2@sha256:abc", ("registry:5000/team/app", "1.2")),
+])
+def test_split_image_reference(reference, expected):
+    assert split_image_reference(reference) == expected
+
+class StubEngine:
+    """Stands in for the engine and docker compose of a project with an api and a db service."""
+
+    def __init__(self, monkeypatch, healths):
+        self.containers = {"api": self.container("api", "sha256:old"), "db": self.container("db", "sha256:db")}
+        # Health the new api container reports on each poll, it keeps the last one
+        self.healths = list(healths)
+        self.tags = []
+        self.commands = []
+        monkeypatch.setattr("src.docker_handler.HEALTH_POLL_INTERVAL", 0.01)
+        monkeypatch.setattr("src.docker_handler.get_project_containers", self.list_containers)
+        monkeypatch.setattr("src.docker_handler.tag_image", self.tag_image)
+        monkeypatch.setattr("src.docker_handler.start_container", self.start)
+        monkeypatch.setattr("src.docker_handler.run_process", self.run_process)
+        monkeypatch.setattr(os.path, "exists", lambda path: path.endswith("docker-compose.yml"))
+
+    @staticmethod
+    def container(service, image_id, health=None):
+        return ContainerStatus(id=f"{service}-{image_id}", name=f"shop-{service}-1", service=service,
+                               status="running", health=health, image_id=image_id, image=f"shop-{service}")
+
+    def list_containers(self, project):
+        if "api" in self.containers and self.containers["api"].image_id == "sha256:new":
+            health = self.healths.pop(0) if len(self.healths) > 1 else self.healths[0]
+            self.containers["api"] = self.container("api", "sha256:new", health)
+        return list(self.containers.values())
+
+    def tag_image(self, image, repository, tag):
+        self.tags.append((image, f"{repository}:{tag}"))
+        return True
+
+    async def start(self, path, services=None, timeout=None):
+        self.containers["api"] = self.container("api", "sha256:new", "starting")
+        return True
+
+    async def run_process(self, args, timeout=None, **kwargs):
+        self.commands.append(args[4:])
+        # Compose recreates each service from the image its reference points at now
+        for service in args[9:]:
+            image = next(image for image, reference in reversed(self.tags) if reference == f"shop-{service}:latest")
+            self.containers[service] = self.container(service, image)
+        return ProcessResult(args=list(args), exit_code=0, tail=[])
+
+def deploy_api(health_timeout=5):
+    state_store = StateStore(":memory:")
+    plan = DeployPlan(build_services=["api"])
+    report = asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb", plan, health_timeout=health_timeout))
+    return report, state_store.get("/mock/path").deploy_status
+
+def test_healthy_deploy_keeps_the_previous_images(monkeypatch, recorded_operations):
+    engine = StubEngine(monkeypatch, ["starting", "starting", "healthy"])
+    report, status = deploy_api()
+    assert report.success and not report.rolled_back and status == "deployed"
+    assert engine.tags == [("sha256:old", "shop-api:syncatron-previous"), ("sha256:db", "shop-db:syncatron-previous")]
+    assert engine.commands == []
+
+def test_unhealthy_deploy_rolls_back_without_a_rebuild(monkeypatch, recorded_operations):
+    engine = StubEngine(monkeypatch, ["starting", "unhealthy"])
+    started = time.monotonic()
+    report, status = deploy_api()
+    assert time.monotonic() - started < 1
+    assert report.rolled_back and not report.success and status == "failed"
+    assert engine.tags[-1] == ("sha256:old", "shop-api:latest")
+    # Only the service that changed is recreated, from the image it ran before
+    assert engine.commands == [["up", "-d", "--no-build", "--no-deps", "--force-recreate", "api"]]
+    assert engine.containers["api"].image_id == "sha256:old"
+    assert recorded_operations == ["rebuild_container"]
+
+def test_deploy_that_stays_unhealthy_past_the_deadline_rolls_back(monkeypatch, recorded_operations):
+    engine = StubEngine(monkeypatch, ["starting"])
+    report, _ = deploy_api(health_timeout=0.05)
+    assert report.rolled_back
+    assert engine.containers["api"].image_id == "sha256:old"
+
+def test_failed_build_in_recreate_mode_rolls_back(monkeypatch, recorded_operations):
+    engine = StubEngine(monkeypatch, ["healthy"])
+
+    async def teardown(path, timeout=None):
+        engine.containers.clear()
+        return True
+
+    async def failing_build(*args, **kwargs):
+        return False
+
+    monkeypatch.setattr("src.docker_handler.teardown_container", teardown)
+    monkeypatch.setattr("src.docker_handler.rebuild_container", failing_build)
+    state_store = StateStore(":memory:")
+    report = asyncio.run(handle_docker_operations("/mock/path", state_store, "bbb", mode="recreate", health_timeout=5))
+    assert report.rolled_back and not report.success
+    assert state_store.get("/mock/path").deploy_status == "failed"
+    # The torn down project is started again from the images it ran before
+    assert engine.commands == [["up", "-d", "--no-build", "--no-deps", "--force-recreate", "api", "db"]]
+    assert {service: container.image_id for service, container in engine.containers.items()} == \
+        {"api": "sha256:old", "db": "sha256:db"}
+
+def test_no_containers_are_not_healthy(monkeypatch):
+    db = StubEngine.container("db", "sha256:db")
+    monkeypatch.setattr("src.docker_handler.HEALTH_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr("src.docker_handler.get_project_containers", lambda project: [db])
+    assert asyncio.run(wait_until_healthy("/mock/path", None, 0.05))
+    assert not asyncio.run(wait_until_healthy("/mock/path", ["api"], 0.05))
+
+    monkeypatch.setattr("src.docker_handler.get_project_containers", lambda project: [])
+    assert not asyncio.run(wait_until_healthy("/mock/path", None, 0.05))
@@ -31,4 +31,64 @@ def test_scan_for_invalid_directory():
     Test scanning for an invalid directory.
     """
     with pytest.raises(ValueError):
-        scan_for_git_repos("invalid/path/to/dir")
\ No newline at end of file
+        scan_for_git_repos("invalid/path/to/dir")
+
+def test_scan_detects_git_files_and_nested_repos(setup_git_repos):
+    """
+    Test that .git files count as repositories and that depth limits the search.
+    """
+    with open(os.path.join(setup_git_repos, "not_a_git_repo", ".git"), "w") as git_file:
+        git_file.write("gitdir: /elsewhere/.git/worktrees/wt\n")
+    os.makedirs(os.path.join(setup_git_repos, "group", "nested", ".git"))
+    os.makedirs(os.path.join(setup_git_repos, "repo1", "sub", ".git"))
+
+    repos = scan_for_git_repos(setup_git_repos)
+    assert os.path.join(setup_git_repos, "not_a_git_repo") in repos
+    assert os.path.join(setup_git_repos, "group", "nested") not in repos
+
+    repos = scan_for_git_repos(setup_git_repos, max_depth=2)
+    assert os.path.join(setup_git_repos, "group", "nested") in repos
+    # The search does not descend into repositories
+    assert os.path.join(setup_git_repos, "repo1", "sub") not in repos
+
+def test_scan_ignores_unrelated_git_file(setup_git_repos):
+    """
+    Test that a .git file without a gitdir pointer is not a repository.
+    """
+    with open(os.path.join(setup_git_repos, "not_a_git_repo", ".git"), "w") as git_file:
+        git_file.write("not a pointer")
+    assert len(scan_for_git_repos(setup_git_repos)) == 2
+
+def test_scan_exclusion_globs(setup_git_repos):
+    """
+    Test that excluded folders are skipped by name and by relative path.
+    """
+    os.makedirs(os.path.join(setup_git_repos, "group", "nested", ".git"))
+    assert scan_for_git_repos(setup_git_repos, exclude=["repo1"]) == [os.path.join(setup_git_repos, "repo2")]
+    assert os.path.join(setup_git_repos, "group", "nested") not in scan_for_git_repos(
+        setup_git_repos, max_depth=2, exclude=["group/*"])
+
+def test_scan_reuses_unchanged_listings(setup_git_repos, monkeypatch):
+    """
+    Test that a second scan only lists directories whose mtime changed.
+    """
+    scan_for_git_repos(setup_git_repos)
+
+    listed = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listed.append(path) or real_scandir(path))
+    assert len(scan_for_git_repos(setup_git_repos)) == 2
+    assert listed == []
+
+    os.makedirs(os.path.join(setup_git_repos, "repo3", ".git"))
+    repos = scan_for_git_repos(setup_git_repos)
+    assert os.path.join(setup_git_repos, "repo3") in repos
+    assert sorted(listed) == sorted([setup_git_repos, os.path.join(setup_git_repos, "repo3")])
+
+def test_scan_notices_removed_repo(setup_git_repos):
+    """
+    Test that a removed repository disappears from the next scan.
+    """
+    scan_for_git_repos(setup_git_repos)
+    shutil.rmtree(os.path.join(setup_git_repos, "repo2"))
+    assert scan_for_git_repos(setup_git_repos) == [os.path.join(setup_git_repos, "repo1")]
@@ -1,7 +1,7 @@
 import os
 import pytest
 from unittest.mock import patch
-from src.get_env import load_environment_variables
+from src.get_env import load_environment_variables, load_settings
 
 # Sample test cases for environment variable loading
 def test_load_environment_variables_valid(monkeypatch):
@@ -56,4 +56,80 @@ def test_load_environment_variables_invalid_run_frequency_type(monkeypatch):
     monkeypatch.setenv('GIT_ACCESS_KEY', 'some_access_key')
 
     with pytest.raises(ValueError, match="RUN_FREQUENCY must be set to a positive integer."):
-        load_environment_variables()
\ No newline at end of file
+        load_environment_variables()
+
+def test_load_settings_defaults(monkeypatch):
+    """Test that unset optional settings fall back to their defaults."""
+    monkeypatch.delenv('PULL_WORKERS', raising=False)
+    monkeypatch.delenv('PULL_TIMEOUT', raising=False)
+
+    settings = load_settings()
+
+    assert settings.pull_workers == 8
+    assert settings.pull_timeout == 120
+
+def test_load_settings_invalid_pull_workers(monkeypatch):
+    """Test handling of invalid PULL_WORKERS."""
+    monkeypatch.setenv('PULL_WORKERS', 'many')
+
+    with pytest.raises(ValueError, match="PULL_WORKERS must be set to a positive integer."):
+        load_settings()
+
+def test_load_settings_update_mode(monkeypatch):
+    """Test that the update mode, depth and filter are read together."""
+    monkeypatch.setenv('UPDATE_MODE', 'Reset')
+    monkeypatch.setenv('FETCH_DEPTH', '1')
+    monkeypatch.setenv('FETCH_FILTER', 'blob:none')
+
+    settings = load_settings()
+
+    assert (settings.update_mode, settings.fetch_depth, settings.fetch_filter) == ("reset", 1, "blob:none")
+
+def test_load_settings_invalid_update_mode(monkeypatch):
+    monkeypatch.setenv('UPDATE_MODE', 'rebase')
+
+    with pytest.raises(ValueError, match="UPDATE_MODE must be one of: pull, ff-only, reset."):
+        load_settings()
+
+def test_load_settings_health_timeout(monkeypatch):
+    monkeypatch.delenv('HEALTH_TIMEOUT', raising=False)
+    assert load_settings().health_timeout == 120
+
+    monkeypatch.setenv('HEALTH_TIMEOUT', '0')
+    assert load_settings().health_timeout == 0
+
+    monkeypatch.setenv('HEALTH_TIMEOUT', '-5')
+    with pytest.raises(ValueError, match="HEALTH_TIMEOUT must be set to a positive integer."):
+        load_settings()
+
+@pytest.mark.parametrize("name, attribute", [
+    ("WEBHOOK_PORT", "webhook_port"),
+    ("NO_CACHE_INTERVAL", "no_cache_interval"),
+    ("DEPLOY_WORKERS", "deploy_workers"),
+    ("DEPLOY_DEBOUNCE", "deploy_debounce"),
+    ("POLL_MAX_INTERVAL", "poll_max_interval"),
+    ("FETCH_DEPTH", "fetch_depth"),
+    ("MAINTENANCE_INTERVAL", "maintenance_interval"),
+])
+def test_load_settings_zero_is_accepted(monkeypatch, name, attribute):
+    monkeypatch.setenv(name, '0')
+    assert getattr(load_settings(), attribute) == 0
+
+def test_load_settings_webhook_requires_secret(monkeypatch):
+    monkeypatch.setenv('WEBHOOK_PORT', '8000')
+    monkeypatch.delenv('WEBHOOK_SECRET', raising=False)
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET must be set when WEBHOOK_PORT is"):
+        load_settings()
+
+    monkeypatch.setenv('WEBHOOK_INSECURE', 'true')
+    assert load_settings().webhook_insecure
+
+    monkeypatch.delenv('WEBHOOK_INSECURE')
+    monkeypatch.setenv('WEBHOOK_SECRET', 'token')
+    assert load_settings().webhook_secret == 'token'
+
+def test_load_settings_log_format(monkeypatch):
+    monkeypatch.setenv('LOG_FORMAT', 'JSON')
+    monkeypatch.setenv('LOG_RATE_LIMIT', '0')
+    settings = load_settings()
+    assert (settings.log_format, settings.log_rate_limit, settings.log_sample) == ("json", 0, 10)
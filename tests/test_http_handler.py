@@ -0,0 +1,93 @@
+import asyncio
+import json
+import pytest
+from src.http_handler import (get_repository_name, make_metrics_handler, make_webhook_handler, match_repository,
+                              start_http_server)
+
+REPOS = ["/projects/api", "/projects/group/frontend"]
+
+async def send_request(port, method, path, body=b"", headers=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+    for name, value in (headers or {}).items():
+        head += f"{name}: {value}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    return int(status_line.split()[1]), rest.split(b"\r\n\r\n", 1)[1]
+
+def run_webhook(method, path, payload, headers=None, secret=""):
+    triggered = []
+
+    async def exercise():
+        handler = make_webhook_handler(lambda: REPOS, triggered.append, secret)
+        server = await start_http_server("127.0.0.1", 0, {("POST", "/webhook"): handler})
+        port = server.sockets[0].getsockname()[1]
+        try:
+            body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            return await send_request(port, method, path, body, headers)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    status, body = asyncio.run(exercise())
+    return status, body, triggered
+
+def test_webhook_queues_named_repository():
+    status, body, triggered = run_webhook("POST", "/webhook", {"repository": "frontend"})
+    assert status == 202
+    assert json.loads(body) == {"queued": "/projects/group/frontend"}
+    assert triggered == ["/projects/group/frontend"]
+
+def test_webhook_unknown_repository():
+    status, _, triggered = run_webhook("POST", "/webhook", {"repository": "missing"})
+    assert status == 404
+    assert triggered == []
+
+def test_webhook_invalid_json():
+    status, _, triggered = run_webhook("POST", "/webhook", b"{not json")
+    assert status == 400
+    assert triggered == []
+
+def test_webhook_requires_secret():
+    status, _, triggered = run_webhook("POST", "/webhook", {"repository": "api"}, secret="s3cret")
+    assert status == 401
+    assert triggered == []
+
+    status, _, triggered = run_webhook("POST", "/webhook", {"repository": "api"},
+                                       headers={"X-Syncatron-Token": "s3cret"}, secret="s3cret")
+    assert status == 202
+    assert triggered == ["/projects/api"]
+
+def test_unknown_route_and_method():
+    assert run_webhook("POST", "/other", {})[0] == 404
+    assert run_webhook("GET", "/webhook", {})[0] == 405
+
+def test_metrics_endpoint():
+    async def exercise():
+        handler = make_metrics_handler(lambda: "syncatron_up 1\n")
+        server = await start_http_server("127.0.0.1", 0, {("GET", "/metrics"): handler})
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await send_request(port, "GET", "/metrics")
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(exercise()) == (200, b"syncatron_up 1\n")
+
+@pytest.mark.parametrize("payload, expected", [
+    ({"repository": "api"}, "api"),
+    ({"repository": {"name": "api", "full_name": "org/api"}}, "api"),
+    ({"project": {"path": "api"}}, "api"),
+    ({"ref": "refs/heads/main"}, None),
+])
+def test_get_repository_name(payload, expected):
+    assert get_repository_name(payload) == expected
+
+def test_match_repository():
+    assert match_repository("group/frontend", REPOS) == "/projects/group/frontend"
+    assert match_repository("/projects/api", REPOS) == "/projects/api"
+    assert match_repository("end", REPOS) is None
@@ -0,0 +1,79 @@
+import asyncio
+import time
+import pytest
+from src.docker_engine import DockerException
+from src.image_gc import ImageCollector
+
+@pytest.fixture
+def prunes(monkeypatch):
+    """Record the prunes instead of sending them to the engine."""
+    calls = []
+
+    def recorder(name):
+        def prune(filters, **options):
+            calls.append((name, filters, options) if options else (name, filters))
+            return {"SpaceReclaimed": 100}
+        return prune
+
+    monkeypatch.setattr("src.image_gc.prune_images", recorder("images"))
+    monkeypatch.setattr("src.image_gc.prune_tagged_images", recorder("tagged_images"))
+    monkeypatch.setattr("src.image_gc.prune_build_cache", recorder("build_cache"))
+    monkeypatch.setattr("src.image_gc.get_docker_root", lambda: "/var/lib/docker")
+    return calls
+
+def test_collects_once_after_builds_finished(prunes):
+    collector = ImageCollector(read_usage=lambda path: 10.0)
+    assert not asyncio.run(collector.collect_if_needed())
+
+    with collector.building():
+        pass
+    with collector.building():
+        pass
+    assert asyncio.run(collector.collect_if_needed())
+    assert prunes == [("images", {"dangling": True, "until": "24h"}), ("build_cache", {"until": "24h"})]
+
+    # Nothing was built since, so the next cycle leaves the images alone
+    assert not asyncio.run(collector.collect_if_needed())
+    assert len(prunes) == 2
+
+def test_waits_for_running_builds(prunes):
+    collector = ImageCollector(read_usage=lambda path: 10.0)
+    with collector.building():
+        with collector.building():
+            pass
+        assert not asyncio.run(collector.collect_if_needed())
+    assert asyncio.run(collector.collect_if_needed())
+
+def test_watermark_forces_collection_of_unused_images(prunes):
+    collector = ImageCollector(watermark=80, keep_hours=0, read_usage=lambda path: 92.0)
+    with collector.building():
+        assert asyncio.run(collector.collect_if_needed())
+    assert prunes == [("images", {"dangling": True}), ("tagged_images", {}, {"keep_tag": "syncatron-previous"}),
+                      ("build_cache", {})]
+
+def test_budget_skips_remaining_stages(monkeypatch, prunes):
+    def slow_prune(filters):
+        time.sleep(0.2)
+        return {"SpaceReclaimed": 1}
+
+    monkeypatch.setattr("src.image_gc.prune_images", slow_prune)
+    collector = ImageCollector(budget=0.05)
+    assert asyncio.run(collector.collect()) == 0
+    assert prunes == []
+
+def test_engine_errors_do_not_stop_later_stages(monkeypatch, prunes):
+    def failing_prune(filters):
+        raise DockerException("engine unreachable")
+
+    monkeypatch.setattr("src.image_gc.prune_images", failing_prune)
+    assert asyncio.run(ImageCollector().collect()) == 100
+    assert [name for name, _ in prunes] == ["build_cache"]
+
+def test_unreachable_docker_root_disables_watermark(monkeypatch, prunes):
+    def unreachable():
+        raise DockerException("engine unreachable")
+
+    monkeypatch.setattr("src.image_gc.get_docker_root", unreachable)
+    collector = ImageCollector(read_usage=lambda path: 99.0)
+    assert collector.get_disk_usage() is None
+    assert not asyncio.run(collector.collect_if_needed())
@@ -0,0 +1,61 @@
+import json
+import logging
+import threading
+import contextvars
+from src.log_setup import JsonFormatter, RateLimitFilter, log_context, setup_logging, stop_logging
+
+def make_record(message, level=logging.INFO, lineno=10):
+    return logging.LogRecord("src.git_handler", level, "/src/git_handler.py", lineno, message, None, None)
+
+def test_json_lines_carry_the_log_context(capsys, monkeypatch):
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    assert setup_logging("json") is not None
+    logger = logging.getLogger("src.git_handler")
+    with log_context(cycle_id="c0ffee01"):
+        with log_context(repo="/repos/app", phase="pull"):
+            logger.info("No updates detected in %s.", "/repos/app")
+            # Threads started with a copy of the context log with it as well
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(logger.warning, "from a thread"))
+            thread.start()
+            thread.join()
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Deploy failed")
+    stop_logging()
+
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [line["message"] for line in lines] == ["No updates detected in /repos/app.", "from a thread", "Deploy failed"]
+    assert {key: lines[0][key] for key in ("repo", "phase", "cycle_id", "level")} == \
+        {"repo": "/repos/app", "phase": "pull", "cycle_id": "c0ffee01", "level": "INFO"}
+    assert lines[1]["repo"] == "/repos/app"
+    assert "repo" not in lines[2] and lines[2]["cycle_id"] == "c0ffee01"
+    assert "ValueError: boom" in lines[2]["exception"]
+
+def test_setup_leaves_configured_logging_alone(monkeypatch):
+    handler = logging.NullHandler()
+    monkeypatch.setattr(logging.getLogger(), "handlers", [handler])
+    assert setup_logging() is None
+    assert logging.getLogger().handlers == [handler]
+
+def test_rate_limit_samples_repeated_messages():
+    clock = [0.0]
+    limiter = RateLimitFilter(rate_limit=3, sample=2, clock=lambda: clock[0])
+    records = [make_record(f"No updates detected in /repos/{i}.") for i in range(8)]
+    kept = [record for record in records if limiter.filter(record)]
+
+    # Three pass, then every second one, telling how many were dropped before it
+    assert [record.getMessage() for record in kept] == [
+        "No updates detected in /repos/0.", "No updates detected in /repos/1.", "No updates detected in /repos/2.",
+        "No updates detected in /repos/4. (1 similar messages dropped)",
+        "No updates detected in /repos/6. (1 similar messages dropped)",
+    ]
+    # Other call sites and warnings are not limited, and the limit resets after a minute
+    assert limiter.filter(make_record("Updates detected", lineno=20))
+    assert limiter.filter(make_record("Git command error", level=logging.WARNING))
+    clock[0] = 60.0
+    assert limiter.filter(make_record("No updates detected in /repos/8."))
+
+def test_json_formatter_leaves_out_unset_fields():
+    entry = json.loads(JsonFormatter().format(make_record("Scanning")))
+    assert set(entry) == {"time", "level", "logger", "message"}
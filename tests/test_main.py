@@ -1,14 +1,18 @@
 # tests/test_main.py
 
-import pytest
+import asyncio
 import logging
-import time
 import threading
+import time
+import pytest
 from unittest.mock import patch
-from src.main import start_scheduler, log_scheduled_task, main
-
-# Setup logging at the DEBUG level for the tests
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+from src import main as syncatron
+from src.get_env import Settings
+from src.git_handler import get_repo_lock
+from src.poll_scheduler import PollScheduler
+from src.state_store import StateStore
+from src.main import (get_http_routes, get_poll_interval_override, get_update_options, log_scheduled_task, main,
+                      scheduler, sync_repositories, wait_for_triggers)
 
 @pytest.fixture
 def mock_load_env_vars():
@@ -16,46 +20,190 @@ def mock_load_env_vars():
     with patch('src.main.load_environment_variables', return_value=(5, 'test_project_folder', 'test_access_key')):
         yield
 
-def test_log_scheduled_task(caplog):
-    """Test the log_scheduled_task function logging."""
-    with caplog.at_level(logging.INFO):
-        log_scheduled_task()
-    
-    assert "Scheduled task executed." in caplog.text
-
-def test_start_scheduler(mock_load_env_vars):
-    """Test the start_scheduler function initializes the scheduler correctly."""
-    # Mock the scheduler to just call the log_scheduled_task without waiting
-    with patch('sched.scheduler.enter') as mock_enter:
-        thread = threading.Thread(target=start_scheduler, args=(5,))
-        thread.start()
-        
-        # Give it some time to run
-        time.sleep(1)
-        
-        # Check the scheduler's enter call
-        assert mock_enter.call_count > 0
-        thread.join(timeout=1)
-
-def test_main_function(mock_load_env_vars):
-    """Test that the main function runs without errors."""
-    # Mocking the logging functions to avoid cluttering the output
-    with patch('logging.info') as mock_log_info:
-        # Execute main function which will use the mocked load_environment_variables
-        # Calling main with should_run set to False to terminate the loop immediately.
-        main(should_run=False)
-        
+def fake_pulls(updated):
+    """Replace the concurrent pull with one that reports the given repositories as updated."""
+    async def pull(access_key, repos, **kwargs):
+        for repo in repos:
+            yield repo, repo in updated
+    return patch('src.main.pull_repositories_concurrently', pull)
+
+@pytest.fixture
+def deployed():
+    """Record deploys instead of running them."""
+    deploys = []
+
+    async def deploy(repo, revision, settings, state_store=None):
+        deploys.append(repo)
+
+    with patch('src.main.deploy_repository', deploy):
+        yield deploys
+
+def test_log_scheduled_task(caplog, deployed):
+    """Test that the scheduled task scans the project folder and deploys the updated repositories."""
+    with patch('src.main.scan_for_git_repos', return_value=['/projects/a', '/projects/b']), \
+            fake_pulls({'/projects/b'}), caplog.at_level(logging.INFO):
+        asyncio.run(log_scheduled_task(5, '/projects', 'key'))
+
+    assert "Found 2 git repositories. Trying updates" in caplog.text
+    assert deployed == ['/projects/b']
+
+def test_sync_repositories_without_changes(caplog, deployed):
+    with fake_pulls(set()), caplog.at_level(logging.INFO):
+        updated = asyncio.run(sync_repositories(['/projects/a'], 'key', Settings()))
+
+    assert updated == []
+    assert deployed == []
+    assert "No git repositories with changes" in caplog.text
+
+def test_sync_repositories_skips_repositories_being_deployed(deployed):
+    async def run():
+        queue = syncatron.create_deploy_queue(Settings())
+        with patch.object(queue, 'is_deploying', lambda repo: repo == '/projects/a'):
+            with fake_pulls({'/projects/a', '/projects/b'}):
+                updated = await sync_repositories(['/projects/a', '/projects/b'], 'key', Settings(), None, queue)
+        await queue.join()
+        return updated
+
+    assert asyncio.run(run()) == ['/projects/b']
+    assert deployed == ['/projects/b']
+
+def test_wait_for_triggers_merges_duplicates():
+    async def run():
+        triggers = asyncio.Queue()
+        for repo in ('/projects/a', '/projects/b', '/projects/a'):
+            triggers.put_nowait(repo)
+        return await wait_for_triggers(triggers, 1), await wait_for_triggers(triggers, 0.01)
+
+    assert asyncio.run(run()) == (['/projects/a', '/projects/b'], [])
+
+def test_wait_for_triggers_takes_queued_triggers_without_time_left():
+    async def run():
+        triggers = asyncio.Queue()
+        triggers.put_nowait('/projects/a')
+        return await wait_for_triggers(triggers, 0), triggers.empty()
+
+    assert asyncio.run(run()) == (['/projects/a'], True)
+
+def test_scheduler_polls_repositories_when_due():
+    """Test that repositories are polled again and idle ones back off."""
+    polled = []
+
+    async def sync(repos, *args):
+        polled.append(sorted(repos))
+        return []
+
+    async def run():
+        with patch('src.main.sync_repositories', sync), \
+                patch('src.main.find_repositories', return_value=['/projects/a', '/projects/b']), \
+                patch('src.main.create_poll_scheduler', lambda *args: PollScheduler(1, 8, jitter=0)):
+            task = asyncio.ensure_future(scheduler(1, '/projects', 'key', Settings(), triggers=asyncio.Queue()))
+            await asyncio.sleep(2.5)
+            task.cancel()
+
+    asyncio.run(run())
+    # Due at once, then one second later, then backed off to two seconds
+    assert polled[:2] == [['/projects/a', '/projects/b'], ['/projects/a', '/projects/b']]
+    assert len(polled) == 2
+
+def test_scheduler_syncs_triggered_repositories():
+    synced = []
+
+    async def sync(repos, *args):
+        synced.append(repos)
+        return []
+
+    async def run():
+        triggers = asyncio.Queue()
+        with patch('src.main.sync_repositories', sync), patch('src.main.find_repositories', return_value=[]):
+            task = asyncio.ensure_future(scheduler(60, '/projects', 'key', Settings(), triggers=triggers))
+            await asyncio.sleep(0.05)
+            triggers.put_nowait('/projects/a')
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+    asyncio.run(run())
+    assert synced == [['/projects/a']]
+
+def test_get_poll_interval_override(tmp_path):
+    assert get_poll_interval_override(str(tmp_path)) is None
+    (tmp_path / ".syncatron.json").write_text('{"poll_interval": 300}')
+    assert get_poll_interval_override(str(tmp_path)) == 300
+    (tmp_path / ".syncatron.json").write_text('{"poll_interval": "often"}')
+    assert get_poll_interval_override(str(tmp_path)) is None
+
+def test_deploy_waits_for_a_pull_in_progress():
+    repo = '/projects/slow-pull'
+    events = []
+    pulling = threading.Event()
+
+    def slow_pull():
+        with get_repo_lock(repo):
+            pulling.set()
+            time.sleep(0.3)
+            events.append('pulled')
+
+    async def docker_operations(path, *args):
+        events.append('deployed')
+
+    async def run():
+        queue = syncatron.create_deploy_queue(Settings())
+        pull = threading.Thread(target=slow_pull)
+        pull.start()
+        pulling.wait()
+        # The deploy is due at once, while the pull is still rewriting the checkout
+        queue.submit(repo, 'bbb')
+        await queue.join()
+        pull.join()
+
+    with patch('src.main.handle_docker_operations', docker_operations):
+        asyncio.run(run())
+    assert events == ['pulled', 'deployed']
+
+def test_metrics_are_served_without_the_webhook():
+    webhook, metrics = object(), object()
+    assert get_http_routes(Settings(), webhook, metrics) == {}
+    assert get_http_routes(Settings(metrics_port=9100), webhook, metrics) == \
+        {("0.0.0.0", 9100): {("GET", "/metrics"): metrics}}
+    settings = Settings(webhook_port=8000, webhook_secret="token", metrics_port=9100)
+    assert get_http_routes(settings, webhook, metrics) == {
+        ("0.0.0.0", 8000): {("POST", "/webhook"): webhook, ("GET", "/metrics"): metrics},
+        ("0.0.0.0", 9100): {("GET", "/metrics"): metrics},
+    }
+
+def test_update_options_leave_gc_to_git_without_maintenance():
+    assert get_update_options(Settings()).git_options == {}
+    assert get_update_options(Settings(maintenance_interval=24)).git_options == {"c": "gc.auto=0"}
+
+def test_main_function(mock_load_env_vars, tmp_path):
+    """Test that the main function logs its configuration and cleans up when the scheduler stops."""
+    async def stop(*args):
+        raise asyncio.CancelledError
+
+    with patch('src.main.load_settings', return_value=Settings(state_path=str(tmp_path / 'state.db'))), \
+            patch('src.main.scheduler', stop), patch('logging.info') as mock_log_info:
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main())
+
         mock_log_info.assert_any_call("Run Frequency: 5")
         mock_log_info.assert_any_call("Project Folder: test_project_folder")
         mock_log_info.assert_any_call("Git Access Key: test_access_key")
 
-@pytest.mark.parametrize("interval", [1, 2, 3])
-def test_scheduler_run_frequency(mock_load_env_vars, interval):
-    """Test that the scheduler runs at the expected frequency."""
-    with patch('sched.scheduler.enter', side_effect=lambda delay, priority, action: action()):
-        thread = threading.Thread(target=start_scheduler, args=(interval,))
-        thread.start()
-        
-        # Allow the scheduled task to execute
-        time.sleep(4)  # Wait a bit longer than the interval
-        thread.join(timeout=1)  # Ensure the thread has completed
\ No newline at end of file
+def test_show_status(tmp_path, monkeypatch):
+    monkeypatch.setenv('STATE_PATH', str(tmp_path / 'state.db'))
+    store = StateStore(str(tmp_path / 'state.db'))
+    store.record_duration('/repos/app', 'deploy', 90.0)
+    store.mark_pending('/repos/app', 'bbb')
+    store.close()
+
+    lines = syncatron.show_status().splitlines()
+    assert lines[1].split() == ['/repos/app', 'pending', 'bbb', '1m30s', '1m30s', '1m30s', '-', '1m30s']
+
+def test_show_status_needs_no_credentials(tmp_path, monkeypatch):
+    for name in ('STATE_PATH', 'GIT_ACCESS_KEY', 'RUN_FREQUENCY', 'WEBHOOK_SECRET'):
+        monkeypatch.delenv(name, raising=False)
+    # Settings of the running instance that do not concern the status are not read
+    monkeypatch.setenv('WEBHOOK_PORT', '8000')
+    monkeypatch.setenv('PULL_WORKERS', 'many')
+    monkeypatch.setenv('PROJECT_FOLDER', str(tmp_path))
+    lines = syncatron.show_status().splitlines()
+    assert lines[0].split()[0] == 'REPOSITORY'
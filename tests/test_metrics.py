@@ -0,0 +1,73 @@
+import asyncio
+import time
+import pytest
+from src.metrics import Counter, Gauge, Histogram, Registry, Timer, EVENT_LOOP_LAG, monitor_event_loop_lag
+
+def test_counter_renders_labelled_samples():
+    counter = Counter("pulls_total", "Pulls.", ["repo", "outcome"])
+    counter.inc(repo="/a", outcome="updated")
+    counter.inc(2, repo="/a", outcome="updated")
+    counter.inc(repo='/b"c', outcome="error")
+    assert counter.get(repo="/a", outcome="updated") == 3
+    assert counter.render().splitlines() == [
+        "# HELP pulls_total Pulls.",
+        "# TYPE pulls_total counter",
+        'pulls_total{repo="/a",outcome="updated"} 3',
+        'pulls_total{repo="/b\\"c",outcome="error"} 1',
+    ]
+
+def test_labels_must_match():
+    counter = Counter("pulls_total", "Pulls.", ["repo"])
+    with pytest.raises(ValueError):
+        counter.inc(phase="build")
+
+def test_gauge_goes_up_and_down():
+    gauge = Gauge("running", "Running.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.get() == 1
+    gauge.set(5)
+    assert gauge.render().splitlines()[-1] == "running 5"
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("duration_seconds", "Duration.", ["phase"], buckets=(1, 10))
+    for value in (0.5, 2, 20):
+        histogram.observe(value, phase="rebuild")
+    assert histogram.get_count(phase="rebuild") == 3
+    assert histogram.get_sum(phase="rebuild") == 22.5
+    assert histogram.render().splitlines()[2:] == [
+        'duration_seconds_bucket{phase="rebuild",le="1"} 1',
+        'duration_seconds_bucket{phase="rebuild",le="10"} 2',
+        'duration_seconds_bucket{phase="rebuild",le="+Inf"} 3',
+        'duration_seconds_sum{phase="rebuild"} 22.5',
+        'duration_seconds_count{phase="rebuild"} 3',
+    ]
+
+def test_timer_observes_elapsed_time():
+    histogram = Histogram("scan_seconds", "Scan.")
+    with Timer(histogram) as timer:
+        pass
+    assert histogram.get_count() == 1
+    assert histogram.get_sum() == timer.elapsed
+
+def test_registry_rejects_duplicate_names():
+    registry = Registry()
+    registry.register(Gauge("running", "Running."))
+    with pytest.raises(ValueError):
+        registry.register(Counter("running", "Running."))
+    assert registry.render().startswith("# HELP running Running.\n")
+
+def test_event_loop_lag_is_measured():
+    before = EVENT_LOOP_LAG.get_count()
+
+    async def block_loop():
+        monitor = asyncio.create_task(monitor_event_loop_lag(interval=0.01))
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        monitor.cancel()
+
+    asyncio.run(block_loop())
+    assert EVENT_LOOP_LAG.get_count() > before
+    assert EVENT_LOOP_LAG.get_sum() >= 0.05
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from git import GitCommandError, Repo
+from src.git_handler import UpdateOptions, pull_repository
+from src.mirror_cache import get_mirror_path, list_mirrors, update_mirror
+from src.repo_cache import REPO_CACHE
+
+def commit_file(repo: Repo, name: str, content: str) -> str:
+    with open(os.path.join(repo.working_tree_dir, name), 'w') as f:
+        f.write(content)
+    repo.index.add([name])
+    return repo.index.commit(f"Update {name}").hexsha
+
+def count_own_objects(repo: Repo) -> int:
+    stats = dict(line.split(': ') for line in repo.git.count_objects('-v').splitlines())
+    return int(stats['count']) + int(stats['in-pack'])
+
+class TestMirrorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(REPO_CACHE.clear)
+        self.origin = os.path.join(self.tmp.name, 'origin.git')
+        Repo.init(self.origin, bare=True, initial_branch='main')
+        self.author = Repo.clone_from(self.origin, os.path.join(self.tmp.name, 'author'))
+        self.author.git.checkout('-b', 'main')
+        commit_file(self.author, 'app.txt', 'v1')
+        self.author.git.push('origin', 'main')
+        self.mirror_dir = os.path.join(self.tmp.name, 'mirrors')
+
+    def push(self, content: str) -> str:
+        sha = commit_file(self.author, 'app.txt', content)
+        self.author.git.push('origin', 'main')
+        return sha
+
+    def test_mirror_is_only_fetched_when_a_commit_is_missing(self):
+        path = update_mirror(self.mirror_dir, self.origin, None, {})
+        self.assertEqual(list_mirrors(self.mirror_dir), [path])
+        self.assertEqual(Repo(path).git.config('gc.pruneExpire'), 'never')
+
+        known = self.author.head.commit.hexsha
+        shutil.move(self.origin, self.origin + '.moved')
+        self.assertEqual(update_mirror(self.mirror_dir, self.origin, known, {}), path)
+        with self.assertRaises(GitCommandError):
+            update_mirror(self.mirror_dir, self.origin, 'f' * 40, {})
+
+    def test_checkouts_of_the_same_remote_share_one_mirror(self):
+        # Cloned over a transport, so the checkouts hold packs like clones of a network remote do
+        checkouts = [Repo.clone_from(f'file://{self.origin}', os.path.join(self.tmp.name, name))
+                     for name in ('prod', 'staging')]
+        sha = self.push('v2')
+        options = UpdateOptions(mode='ff-only', mirror_dir=self.mirror_dir)
+
+        for checkout in checkouts:
+            self.assertTrue(pull_repository('token', checkout.working_tree_dir, options=options))
+            self.assertEqual(checkout.head.commit.hexsha, sha)
+            self.assertEqual(count_own_objects(checkout), 0)
+        self.assertEqual(list_mirrors(self.mirror_dir), [get_mirror_path(self.mirror_dir, f'file://{self.origin}')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import random
+from src.poll_scheduler import PollScheduler
+
+def make_scheduler(**kwargs):
+    kwargs.setdefault("jitter", 0.0)
+    return PollScheduler(10, 80, **kwargs)
+
+def test_new_repositories_are_due_at_once():
+    polls = make_scheduler()
+    polls.update_repos(["/a", "/b"], now=100)
+    assert polls.next_due() == 100
+    assert sorted(polls.pop_due(100)) == ["/a", "/b"]
+    assert polls.pop_due(100) == []
+
+def test_idle_repository_backs_off_up_to_max_interval():
+    polls = make_scheduler()
+    polls.update_repos(["/a"], now=0)
+    now, intervals = 0, []
+    for _ in range(6):
+        assert polls.pop_due(now) == ["/a"]
+        polls.reschedule("/a", changed=False, now=now)
+        intervals.append(polls.get_state("/a").interval)
+        now = polls.next_due()
+    assert intervals == [20, 40, 80, 80, 80, 80]
+
+def test_changed_repository_returns_to_base_interval():
+    polls = make_scheduler()
+    polls.update_repos(["/a"], now=0)
+    polls.pop_due(0)
+    polls.reschedule("/a", changed=False, now=0)
+    polls.pop_due(20)
+    polls.reschedule("/a", changed=True, now=20)
+    assert polls.get_state("/a").interval == 10
+    assert polls.next_due() == 30
+
+def test_schedule_does_not_drift_with_poll_duration():
+    polls = PollScheduler(10, None, jitter=0.0)
+    polls.update_repos(["/a"], now=0)
+    ticks = []
+    now = 0
+    for _ in range(5):
+        polls.pop_due(now)
+        # Each poll takes 3 seconds
+        polls.reschedule("/a", changed=True, now=now + 3)
+        now = polls.next_due()
+        ticks.append(now)
+    assert ticks == [10, 20, 30, 40, 50]
+
+def test_schedule_does_not_drift_with_jitter():
+    polls = PollScheduler(10, None, jitter=0.1, rng=random.Random(7))
+    polls.update_repos(["/a"], now=0)
+    now = 0
+    for _ in range(200):
+        assert polls.pop_due(now) == ["/a"]
+        polls.reschedule("/a", changed=True, now=now + 0.05)
+        now = polls.next_due()
+    assert polls.get_state("/a").tick == 2000
+
+def test_overrun_poll_starts_afresh():
+    polls = PollScheduler(10, None, jitter=0.0)
+    polls.update_repos(["/a"], now=0)
+    polls.pop_due(0)
+    polls.reschedule("/a", changed=True, now=25)
+    assert polls.next_due() == 35
+
+def test_early_reschedule_replaces_pending_entry():
+    polls = make_scheduler()
+    polls.update_repos(["/a"], now=0)
+    polls.pop_due(0)
+    polls.reschedule("/a", changed=False, now=0)
+    # A triggered sync at 5 found changes
+    polls.reschedule("/a", changed=True, now=5)
+    assert polls.pop_due(15) == ["/a"]
+    assert polls.pop_due(100) == []
+
+def test_override_fixes_interval():
+    polls = make_scheduler(get_override=lambda repo: 300 if repo == "/slow" else None)
+    polls.update_repos(["/slow", "/fast"], now=0)
+    polls.pop_due(0)
+    polls.reschedule("/slow", changed=True, now=0)
+    polls.reschedule("/fast", changed=True, now=0)
+    assert polls.get_state("/slow").interval == 300
+    assert polls.get_state("/fast").interval == 10
+
+def test_jitter_spreads_due_times():
+    polls = PollScheduler(100, None, jitter=0.1, rng=random.Random(1))
+    repos = [f"/repo{i}" for i in range(20)]
+    polls.update_repos(repos, now=0)
+    polls.pop_due(0)
+    for repo in repos:
+        polls.reschedule(repo, changed=True, now=0)
+    due_times = [polls.get_state(repo).due for repo in repos]
+    assert all(90 <= due <= 110 for due in due_times)
+    assert len(set(due_times)) == len(repos)
+
+def test_removed_repositories_are_forgotten():
+    polls = make_scheduler()
+    polls.update_repos(["/a", "/b"], now=0)
+    polls.update_repos(["/b"], now=0)
+    assert polls.repos == ["/b"]
+    assert polls.pop_due(0) == ["/b"]
+    polls.reschedule("/a", changed=True, now=0)
+    assert polls.get_state("/a") is None
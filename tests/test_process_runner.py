@@ -0,0 +1,57 @@
+import asyncio
+import sys
+import time
+import pytest
+from src.process_runner import run_process
+
+def test_streams_lines_to_sink():
+    lines = []
+    result = asyncio.run(run_process([sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr)"],
+                                     sink=lambda stream, line: lines.append((stream, line))))
+    assert result.exit_code == 0
+    assert sorted(lines) == [("stderr", "err"), ("stdout", "out")]
+    assert sorted(result.tail) == ["err", "out"]
+
+def test_keeps_only_the_last_lines():
+    result = asyncio.run(run_process([sys.executable, "-c", "for i in range(10000): print(i)"],
+                                     sink=lambda stream, line: None, tail_lines=3))
+    assert result.tail == ["9997", "9998", "9999"]
+
+def test_reports_exit_code():
+    result = asyncio.run(run_process([sys.executable, "-c", "raise SystemExit(3)"]))
+    assert result.exit_code == 3
+    assert not result.timed_out
+
+def test_timeout_kills_process():
+    start = time.monotonic()
+    result = asyncio.run(run_process([sys.executable, "-c", "import time; print('started', flush=True); time.sleep(30)"],
+                                     timeout=0.5))
+    assert time.monotonic() - start < 5
+    assert result.timed_out
+    assert result.exit_code == -1
+    assert result.tail[0] == "started"
+
+def test_cancellation_kills_process():
+    async def cancel_soon():
+        task = asyncio.ensure_future(run_process([sys.executable, "-c", "import time; time.sleep(30)"]))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    asyncio.run(cancel_soon())
+    assert time.monotonic() - start < 5
+
+def test_missing_program():
+    result = asyncio.run(run_process(["definitely-not-a-real-program"]))
+    assert result.exit_code == -1
+    assert result.tail
+
+def test_shell_metacharacters_are_not_interpreted():
+    result = asyncio.run(run_process(["echo", "a; echo injected"], sink=lambda stream, line: None))
+    assert result.tail == ["a; echo injected"]
+
+def test_empty_command():
+    with pytest.raises(ValueError, match="Command cannot be empty"):
+        asyncio.run(run_process([]))
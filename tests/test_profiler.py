@@ -0,0 +1,76 @@
+import asyncio
+import json
+import pytest
+from src import profiler
+from src.profiler import Profiler, span
+
+@pytest.fixture
+def trace_dir(tmp_path):
+    yield tmp_path
+    profiler.disable_profiling()
+
+def read_trace(path):
+    with open(path) as handle:
+        events = json.load(handle)["traceEvents"]
+    return [event for event in events if event["ph"] == "X"], [event for event in events if event["ph"] == "M"]
+
+def test_span_outside_of_a_cycle_records_nothing():
+    with span("scan") as recorded:
+        pass
+    assert recorded is None
+
+def test_cycle_writes_chrome_trace(trace_dir):
+    profiler.enable_profiling(str(trace_dir))
+
+    async def run():
+        with profiler.cycle("poll"):
+            with span("scan", "scan"):
+                await asyncio.sleep(0.01)
+            await asyncio.to_thread(lambda: span("pull", "git", repo="/a").__enter__().__exit__(None, None, None))
+
+    asyncio.run(run())
+    spans, metadata = read_trace(trace_dir / "cycle-000001.trace.json")
+    names = {event["name"]: event for event in spans}
+    assert set(names) == {"cycle 1", "scan", "pull"}
+    assert names["pull"]["args"] == {"repo": "/a"}
+    assert names["scan"]["dur"] >= 10000
+    # The thread gets a track of its own
+    assert names["pull"]["tid"] != names["scan"]["tid"]
+    assert {event["tid"] for event in metadata} == {event["tid"] for event in spans}
+
+def test_trace_is_rewritten_when_tasks_started_in_the_cycle_finish(trace_dir):
+    profiler.enable_profiling(str(trace_dir))
+
+    async def deploy():
+        await asyncio.sleep(0.05)
+        with span("rebuild", "docker", repo="/a"):
+            pass
+
+    async def run():
+        with profiler.cycle("poll"):
+            task = asyncio.create_task(deploy())
+        spans, _ = read_trace(trace_dir / "cycle-000001.trace.json")
+        assert [event["name"] for event in spans] == ["cycle 1"]
+        await task
+
+    asyncio.run(run())
+    spans, _ = read_trace(trace_dir / "cycle-000001.trace.json")
+    assert [event["name"] for event in spans] == ["cycle 1", "rebuild"]
+
+def test_failed_span_is_marked(trace_dir):
+    profiler.enable_profiling(str(trace_dir))
+    with pytest.raises(RuntimeError):
+        with profiler.cycle("poll"):
+            with span("start", "docker"):
+                raise RuntimeError("boom")
+    spans, _ = read_trace(trace_dir / "cycle-000001.trace.json")
+    assert {event["name"]: event["args"].get("error") for event in spans} == {"cycle 1": "RuntimeError",
+                                                                            "start": "RuntimeError"}
+
+def test_cprofile_every_nth_cycle(trace_dir):
+    instance = Profiler(str(trace_dir), cprofile_every=2)
+    for _ in range(4):
+        with instance.cycle("poll"):
+            sum(range(1000))
+    assert sorted(path.name for path in trace_dir.glob("*.prof")) == ["cycle-000002.prof", "cycle-000004.prof"]
+    assert len(list(trace_dir.glob("*.trace.json"))) == 4
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from git import Repo, NoSuchPathError
+from src.repo_cache import RepoCache
+
+class TestRepoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = RepoCache(max_size=2)
+        self.addCleanup(self.cache.clear)
+
+    def make_repo(self, name: str) -> str:
+        directory = os.path.join(self.tmp.name, name)
+        Repo.init(directory)
+        return directory
+
+    def test_handle_is_reused_with_its_cat_file_process(self):
+        directory = self.make_repo('a')
+        repo = self.cache.get(directory)
+        tree = repo.git.write_tree()
+        repo.git.get_object_header(tree)
+        process = repo.git.cat_file_header
+
+        self.assertIs(self.cache.get(directory), repo)
+        self.assertIs(repo.git.cat_file_header, process)
+
+    def test_handle_is_reopened_when_git_dir_is_replaced(self):
+        directory = self.make_repo('a')
+        repo = self.cache.get(directory)
+        shutil.rmtree(os.path.join(directory, '.git'))
+        Repo.init(directory)
+
+        self.assertIsNot(self.cache.get(directory), repo)
+
+    def test_handle_is_reopened_when_config_changes(self):
+        directory = self.make_repo('a')
+        repo = self.cache.get(directory)
+        with repo.config_writer() as config:
+            config.set_value('remote "origin"', 'url', 'https://github.com/example/project.git')
+        os.utime(os.path.join(directory, '.git', 'config'), ns=(0, 0))
+
+        self.assertIsNot(self.cache.get(directory), repo)
+
+    def test_removed_repository_is_dropped(self):
+        directory = self.make_repo('a')
+        self.cache.get(directory)
+        shutil.rmtree(directory)
+
+        with self.assertRaises(NoSuchPathError):
+            self.cache.get(directory)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_handle_is_closed(self):
+        a, b, c = (self.make_repo(name) for name in 'abc')
+        handle_a = self.cache.get(a)
+        handle_b = self.cache.get(b)
+        self.cache.get(a)
+
+        with patch.object(handle_b, 'close') as close_b:
+            self.cache.get(c)
+        close_b.assert_called_once()
+        self.assertEqual(len(self.cache), 2)
+        self.assertIs(self.cache.get(a), handle_a)
+
+    def test_handles_in_use_are_not_evicted(self):
+        a, b, c = (self.make_repo(name) for name in 'abc')
+        handle_a = self.cache.get(a)
+        self.cache.get(b)
+
+        with self.cache.get_lock(a):
+            self.cache.get(c)
+            self.assertIs(self.cache.get(a), handle_a)
+
+    def test_resize_closes_excess_handles(self):
+        for name in 'ab':
+            self.cache.get(self.make_repo(name))
+        self.cache.resize(1)
+        self.assertEqual(len(self.cache), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import tempfile
+import pytest
+from src.state_store import StateStore, get_default_state_path
+
+@pytest.fixture
+def state_store():
+    store = StateStore(':memory:')
+    yield store
+    store.close()
+
+def test_unknown_repo_has_no_state(state_store):
+    assert state_store.get('/repos/app') is None
+
+def test_record_remote_sha(state_store):
+    state_store.record_remote_sha('/repos/app', 'aaa')
+    state_store.record_remote_sha('/repos/app', 'bbb')
+    assert state_store.get('/repos/app').remote_sha == 'bbb'
+
+def test_deploy_lifecycle(state_store):
+    state_store.mark_pending('/repos/app', 'bbb')
+    assert [state.path for state in state_store.pending_deploys()] == ['/repos/app']
+
+    state_store.mark_deploying('/repos/app', 'bbb', 'hash1')
+    state_store.mark_step_completed('/repos/app', 'rebuild')
+    state_store.mark_deployed('/repos/app', 'bbb', 'hash1', 12.5)
+
+    state = state_store.get('/repos/app')
+    assert state.deploy_status == 'deployed'
+    assert state.deployed_sha == 'bbb'
+    assert state.compose_hash == 'hash1'
+    assert state.build_duration == 12.5
+    assert state.completed_step is None
+    assert state_store.pending_deploys() == []
+
+def test_interrupted_deploy_keeps_completed_step(state_store):
+    state_store.mark_deploying('/repos/app', 'bbb', 'hash1')
+    state_store.mark_step_completed('/repos/app', 'rebuild')
+
+    # Restarting the same revision resumes, a new revision starts over
+    state_store.mark_deploying('/repos/app', 'bbb', 'hash1')
+    assert state_store.get('/repos/app').completed_step == 'rebuild'
+    state_store.mark_deploying('/repos/app', 'ccc', 'hash1')
+    assert state_store.get('/repos/app').completed_step is None
+
+def test_pending_deploys_filtered_by_path(state_store):
+    state_store.mark_pending('/repos/app', 'bbb')
+    state_store.mark_pending('/repos/other', 'ccc')
+    assert [state.path for state in state_store.pending_deploys(['/repos/other'])] == ['/repos/other']
+
+def test_failed_deploy_is_not_pending(state_store):
+    state_store.mark_deploying('/repos/app', 'bbb', 'hash1')
+    state_store.mark_failed('/repos/app')
+    assert state_store.pending_deploys() == []
+
+def test_state_survives_reopening():
+    folder = tempfile.mkdtemp()
+    path = get_default_state_path(folder)
+    store = StateStore(path)
+    store.mark_pending('/repos/app', 'bbb')
+    store.close()
+
+    reopened = StateStore(path)
+    assert reopened.get('/repos/app').target_sha == 'bbb'
+    reopened.close()
+    assert os.path.exists(os.path.join(folder, '.syncatron', 'state.db'))
+
+def test_older_database_is_migrated(tmp_path):
+    path = str(tmp_path / "state.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE repos (path TEXT PRIMARY KEY, remote_sha TEXT, target_sha TEXT, deployed_sha TEXT, "
+                       "compose_hash TEXT, build_duration REAL, deploy_status TEXT, completed_step TEXT, updated_at REAL)")
+    connection.close()
+
+    store = StateStore(path)
+    store.record_no_cache_build('/repos/app')
+    assert store.get('/repos/app').no_cache_built_at is not None
+    store.close()
+
+def test_duration_history_per_repository_and_service(state_store):
+    state_store.record_duration('/repos/app', 'rebuild', 100.0, ['web'])
+    state_store.record_duration('/repos/app', 'rebuild', 200.0, ['web', 'worker'])
+    state_store.record_duration('/repos/app', 'deploy', 220.0)
+
+    durations = state_store.get_durations('/repos/app')
+    assert set(durations) == {'rebuild', 'deploy'}
+    assert durations['rebuild'].count == 2 and durations['rebuild'].samples == [100.0, 200.0]
+    assert state_store.get_durations('/repos/app', 'worker')['rebuild'].ewma == 200.0
+    assert state_store.list_services('/repos/app') == ['web', 'worker']
+    assert state_store.get_durations('/repos/other') == {}
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import pytest
+from src.watch_handler import RepoWatcher, is_inotify_available
+
+@pytest.fixture
+def project_folder():
+    """
+    Create a temporary project folder holding a single git repository.
+    """
+    temp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(temp_dir, "repo1", ".git"))
+    with open(os.path.join(temp_dir, "repo1", ".git", "HEAD"), "w") as head:
+        head.write("ref: refs/heads/main\n")
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+async def wait_until(condition, timeout=3.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.02)
+
+async def exercise_watcher(project_folder, mode):
+    changes = []
+    watcher = RepoWatcher(project_folder, changes.append, mode=mode, poll_interval=0.05)
+    await watcher.start()
+    try:
+        repo1 = os.path.join(project_folder, "repo1")
+        repo2 = os.path.join(project_folder, "repo2")
+        assert watcher.repos == [repo1]
+
+        os.makedirs(os.path.join(repo2, ".git"))
+        await wait_until(lambda: repo2 in watcher.repos)
+        await wait_until(lambda: repo2 in changes)
+
+        # Another tool fetching into repo1
+        with open(os.path.join(repo1, ".git", "FETCH_HEAD"), "w") as fetch_head:
+            fetch_head.write("abc\t\tbranch 'main'\n")
+        await wait_until(lambda: repo1 in changes)
+
+        shutil.rmtree(repo2)
+        await wait_until(lambda: repo2 not in watcher.repos)
+    finally:
+        await watcher.stop()
+
+@pytest.mark.skipif(not is_inotify_available(), reason="inotify is not available")
+def test_watcher_with_inotify(project_folder):
+    asyncio.run(exercise_watcher(project_folder, "inotify"))
+
+def test_watcher_with_polling(project_folder):
+    asyncio.run(exercise_watcher(project_folder, "poll"))
+
+async def exercise_ignored_changes(project_folder, mode):
+    changes = []
+    ignored = {os.path.join(project_folder, "repo1")}
+    watcher = RepoWatcher(project_folder, changes.append, mode=mode, poll_interval=0.05,
+                          ignore=ignored.__contains__)
+    await watcher.start()
+    try:
+        repo1 = os.path.join(project_folder, "repo1")
+        # A fetch by Syncatron itself, then one by another tool
+        with open(os.path.join(repo1, ".git", "FETCH_HEAD"), "w") as fetch_head:
+            fetch_head.write("abc\t\tbranch 'main'\n")
+        await asyncio.sleep(0.3)
+        assert changes == []
+
+        ignored.clear()
+        with open(os.path.join(repo1, ".git", "FETCH_HEAD"), "w") as fetch_head:
+            fetch_head.write("def\t\tbranch 'main'\n")
+        await wait_until(lambda: repo1 in changes)
+    finally:
+        await watcher.stop()
+
+@pytest.mark.skipif(not is_inotify_available(), reason="inotify is not available")
+def test_watcher_ignores_own_changes_with_inotify(project_folder):
+    asyncio.run(exercise_ignored_changes(project_folder, "inotify"))
+
+def test_watcher_ignores_own_changes_with_polling(project_folder):
+    asyncio.run(exercise_ignored_changes(project_folder, "poll"))
+
+def test_watcher_rejects_unknown_mode(project_folder):
+    with pytest.raises(ValueError, match="Unknown watch mode"):
+        RepoWatcher(project_folder, lambda repo: None, mode="fanotify")